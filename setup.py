@@ -26,7 +26,10 @@ setup_args = dict(
     packages=['tbxi'],
     install_requires=['macresources'],
     entry_points=dict(console_scripts=['tbxi = tbxi.__main__:main']),
-    ext_modules=[Extension('tbxi.fast_lzss', ['speedups/fast_lzss.c'])],
+    ext_modules=[
+        Extension('tbxi.fast_lzss', ['speedups/fast_lzss.c']),
+        Extension('tbxi.fast_hqx', ['speedups/fast_hqx.c']),
+    ],
 )
 
 # http://charlesleifer.com/blog/misadventures-in-python-packaging-optional-c-extensions/
@@ -0,0 +1,441 @@
+#define PY_SSIZE_T_CLEAN 1
+#include <Python.h>
+
+#include <stdlib.h>
+#include <stdint.h>
+#include <string.h>
+
+/*
+ * The hqx (Mac "binhex") codec, behaving exactly like slow_hqx.py, which
+ * is modeled on the original C code by Jack Jansen.
+ */
+
+#define RUNCHAR 0x90
+
+#define SKIP  0xfe  /* \r and \n */
+#define DONE  0xfd  /* ':' */
+#define FAIL  0xff  /* anything else not in the table */
+
+static const uint8_t b2a_table[] =
+    "!\"#$%&'()*+,-012345689@ABCDEFGHIJKLMNPQRSTUVXYZ[`abcdefhijklmpqr";
+
+static uint8_t a2b_table[256];
+
+static const uint16_t crc_table[256] = {
+    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
+    0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad, 0xe1ce, 0xf1ef,
+    0x1231, 0x0210, 0x3273, 0x2252, 0x52b5, 0x4294, 0x72f7, 0x62d6,
+    0x9339, 0x8318, 0xb37b, 0xa35a, 0xd3bd, 0xc39c, 0xf3ff, 0xe3de,
+    0x2462, 0x3443, 0x0420, 0x1401, 0x64e6, 0x74c7, 0x44a4, 0x5485,
+    0xa56a, 0xb54b, 0x8528, 0x9509, 0xe5ee, 0xf5cf, 0xc5ac, 0xd58d,
+    0x3653, 0x2672, 0x1611, 0x0630, 0x76d7, 0x66f6, 0x5695, 0x46b4,
+    0xb75b, 0xa77a, 0x9719, 0x8738, 0xf7df, 0xe7fe, 0xd79d, 0xc7bc,
+    0x48c4, 0x58e5, 0x6886, 0x78a7, 0x0840, 0x1861, 0x2802, 0x3823,
+    0xc9cc, 0xd9ed, 0xe98e, 0xf9af, 0x8948, 0x9969, 0xa90a, 0xb92b,
+    0x5af5, 0x4ad4, 0x7ab7, 0x6a96, 0x1a71, 0x0a50, 0x3a33, 0x2a12,
+    0xdbfd, 0xcbdc, 0xfbbf, 0xeb9e, 0x9b79, 0x8b58, 0xbb3b, 0xab1a,
+    0x6ca6, 0x7c87, 0x4ce4, 0x5cc5, 0x2c22, 0x3c03, 0x0c60, 0x1c41,
+    0xedae, 0xfd8f, 0xcdec, 0xddcd, 0xad2a, 0xbd0b, 0x8d68, 0x9d49,
+    0x7e97, 0x6eb6, 0x5ed5, 0x4ef4, 0x3e13, 0x2e32, 0x1e51, 0x0e70,
+    0xff9f, 0xefbe, 0xdfdd, 0xcffc, 0xbf1b, 0xaf3a, 0x9f59, 0x8f78,
+    0x9188, 0x81a9, 0xb1ca, 0xa1eb, 0xd10c, 0xc12d, 0xf14e, 0xe16f,
+    0x1080, 0x00a1, 0x30c2, 0x20e3, 0x5004, 0x4025, 0x7046, 0x6067,
+    0x83b9, 0x9398, 0xa3fb, 0xb3da, 0xc33d, 0xd31c, 0xe37f, 0xf35e,
+    0x02b1, 0x1290, 0x22f3, 0x32d2, 0x4235, 0x5214, 0x6277, 0x7256,
+    0xb5ea, 0xa5cb, 0x95a8, 0x8589, 0xf56e, 0xe54f, 0xd52c, 0xc50d,
+    0x34e2, 0x24c3, 0x14a0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405,
+    0xa7db, 0xb7fa, 0x8799, 0x97b8, 0xe75f, 0xf77e, 0xc71d, 0xd73c,
+    0x26d3, 0x36f2, 0x0691, 0x16b0, 0x6657, 0x7676, 0x4615, 0x5634,
+    0xd94c, 0xc96d, 0xf90e, 0xe92f, 0x99c8, 0x89e9, 0xb98a, 0xa9ab,
+    0x5844, 0x4865, 0x7806, 0x6827, 0x18c0, 0x08e1, 0x3882, 0x28a3,
+    0xcb7d, 0xdb5c, 0xeb3f, 0xfb1e, 0x8bf9, 0x9bd8, 0xabbb, 0xbb9a,
+    0x4a75, 0x5a54, 0x6a37, 0x7a16, 0x0af1, 0x1ad0, 0x2ab3, 0x3a92,
+    0xfd2e, 0xed0f, 0xdd6c, 0xcd4d, 0xbdaa, 0xad8b, 0x9de8, 0x8dc9,
+    0x7c26, 0x6c07, 0x5c64, 0x4c45, 0x3ca2, 0x2c83, 0x1ce0, 0x0cc1,
+    0xef1f, 0xff3e, 0xcf5d, 0xdf7c, 0xaf9b, 0xbfba, 0x8fd9, 0x9ff8,
+    0x6e17, 0x7e36, 0x4e55, 0x5e74, 0x2e93, 0x3eb2, 0x0ed1, 0x1ef0,
+};
+
+static PyObject *Incomplete;
+
+/*
+ * Returns the number of bytes written, and sets *done if a ':' ended the
+ * data. On a bad character, returns -1 with the character in *bad.
+ */
+static Py_ssize_t a2b_hqx(uint8_t *dst, const uint8_t *src, size_t len,
+    int *done, int *leftbits_out, uint8_t *bad)
+{
+    uint8_t *start = dst, value;
+    unsigned int leftchar = 0;
+    int leftbits = 0;
+    size_t i;
+
+    *done = 0;
+    for (i = 0; i < len; i++) {
+        value = a2b_table[src[i]];
+        if (value == SKIP)
+            continue;
+        if (value == DONE) {
+            *done = 1;
+            break;
+        }
+        if (value == FAIL) {
+            *bad = src[i];
+            return -1;
+        }
+
+        leftchar = (leftchar << 6) | value;
+        leftbits += 6;
+        if (leftbits >= 8) {
+            leftbits -= 8;
+            *dst++ = leftchar >> leftbits;
+            leftchar &= (1 << leftbits) - 1;
+        }
+    }
+
+    *leftbits_out = leftbits;
+    return dst - start;
+}
+
+static size_t b2a_hqx(uint8_t *dst, const uint8_t *src, size_t len)
+{
+    uint8_t *start = dst;
+    unsigned int leftchar = 0;
+    int leftbits = 0;
+    size_t i;
+
+    for (i = 0; i < len; i++) {
+        leftchar = (leftchar << 8) | src[i];
+        leftbits += 8;
+        while (leftbits >= 6) {
+            leftbits -= 6;
+            *dst++ = b2a_table[(leftchar >> leftbits) & 0x3f];
+        }
+        leftchar &= (1 << leftbits) - 1;
+    }
+    if (leftbits)
+        *dst++ = b2a_table[leftchar << (6 - leftbits)];
+
+    return dst - start;
+}
+
+/* Worst case: every RUNCHAR doubles, other bytes never grow */
+static size_t rle_encode_hqx(uint8_t *dst, const uint8_t *src, size_t len)
+{
+    uint8_t *start = dst, b;
+    size_t i = 0, count;
+
+    while (i < len) {
+        b = src[i];
+        for (count = 1; i + count < len && src[i + count] == b; count++);
+        i += count;
+
+        if (b == RUNCHAR) {
+            while (count--) {
+                *dst++ = RUNCHAR;
+                *dst++ = 0;
+            }
+            continue;
+        }
+
+        while (count > 255) {
+            *dst++ = b;
+            *dst++ = RUNCHAR;
+            *dst++ = 255;
+            count -= 255;
+        }
+        if (count > 3) {
+            *dst++ = b;
+            *dst++ = RUNCHAR;
+            *dst++ = count;
+        } else {
+            while (count--)
+                *dst++ = b;
+        }
+    }
+
+    return dst - start;
+}
+
+#define RLE_OK        0
+#define RLE_ORPHANED  1
+#define RLE_TRUNCATED 2
+
+/* With dst NULL, just measures the output */
+static int rle_decode_hqx(uint8_t *dst, size_t *dstlen, const uint8_t *src, size_t len)
+{
+    size_t i, out = 0;
+    uint8_t count;
+
+    for (i = 0; i < len; i++) {
+        if (src[i] != RUNCHAR) {
+            if (dst)
+                dst[out] = src[i];
+            out++;
+            continue;
+        }
+
+        if (++i == len)
+            return RLE_TRUNCATED;
+        count = src[i];
+
+        if (count == 0) {
+            if (dst)
+                dst[out] = RUNCHAR;
+            out++;
+            continue;
+        }
+
+        if (out == 0)
+            return RLE_ORPHANED;
+
+        /* 1 copy of the byte was already appended */
+        if (dst)
+            memset(dst + out, dst[out - 1], count - 1);
+        out += count - 1;
+    }
+
+    *dstlen = out;
+    return RLE_OK;
+}
+
+static PyObject *wrap_a2b(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *retval, *key;
+    Py_ssize_t got;
+    int done, leftbits = 0;
+    uint8_t bad = 0;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
+
+    retval = PyBytes_FromStringAndSize(NULL, src.len / 4 * 3 + 3);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    got = a2b_hqx((uint8_t *)PyBytes_AS_STRING(retval), src.buf, (size_t)src.len,
+        &done, &leftbits, &bad);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+
+    if (got < 0) {
+        Py_DECREF(retval);
+        key = PyLong_FromLong(bad);
+        if (key != NULL) {
+            PyErr_SetObject(PyExc_KeyError, key);
+            Py_DECREF(key);
+        }
+        return NULL;
+    }
+
+    if (leftbits && !done) {
+        Py_DECREF(retval);
+        PyErr_SetString(Incomplete, "String has incomplete number of bytes");
+        return NULL;
+    }
+
+    if (_PyBytes_Resize(&retval, got) < 0)
+        return NULL;
+
+    return Py_BuildValue("(Ni)", retval, done);
+}
+
+static PyObject *wrap_b2a(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *retval;
+    size_t got;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
+
+    if (src.len > PY_SSIZE_T_MAX / 8) {
+        PyBuffer_Release(&src);
+        return PyErr_NoMemory();
+    }
+
+    retval = PyBytes_FromStringAndSize(NULL, (src.len * 8 + 5) / 6);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    got = b2a_hqx((uint8_t *)PyBytes_AS_STRING(retval), src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+
+    if (_PyBytes_Resize(&retval, (Py_ssize_t)got) < 0)
+        return NULL;
+    return retval;
+}
+
+static PyObject *wrap_crc(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *crc_obj, *mask, *masked;
+    unsigned int crc;
+    const uint8_t *p;
+    Py_ssize_t i;
+
+    if (!PyArg_ParseTuple(args, "y*O", &src, &crc_obj))
+        return NULL;
+
+    /* Like crc & 0xffff in Python, so any int will do */
+    mask = PyLong_FromLong(0xffff);
+    if (mask == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+    masked = PyNumber_And(crc_obj, mask);
+    Py_DECREF(mask);
+    if (masked == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+    crc = (unsigned int)PyLong_AsUnsignedLong(masked);
+    Py_DECREF(masked);
+    if (PyErr_Occurred()) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+
+    p = src.buf;
+    Py_BEGIN_ALLOW_THREADS
+    for (i = 0; i < src.len; i++)
+        crc = ((crc << 8) & 0xff00) ^ crc_table[(crc >> 8) ^ p[i]];
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+
+    return PyLong_FromUnsignedLong(crc);
+}
+
+static PyObject *wrap_rle_encode(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *retval;
+    size_t got;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
+
+    if (src.len > PY_SSIZE_T_MAX / 2) {
+        PyBuffer_Release(&src);
+        return PyErr_NoMemory();
+    }
+
+    retval = PyBytes_FromStringAndSize(NULL, src.len * 2);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    got = rle_encode_hqx((uint8_t *)PyBytes_AS_STRING(retval), src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+
+    if (_PyBytes_Resize(&retval, (Py_ssize_t)got) < 0)
+        return NULL;
+    return retval;
+}
+
+static PyObject *wrap_rle_decode(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *retval;
+    size_t dstlen;
+    int err;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
+
+    /* Measure first, then decode into a bytes object of exactly that size */
+    Py_BEGIN_ALLOW_THREADS
+    err = rle_decode_hqx(NULL, &dstlen, src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    if (err == RLE_TRUNCATED) {
+        PyBuffer_Release(&src);
+        PyErr_SetNone(Incomplete);
+        return NULL;
+    }
+    if (err == RLE_ORPHANED) {
+        PyBuffer_Release(&src);
+        PyErr_SetString(PyExc_ValueError, "Orphaned RLE code at start");
+        return NULL;
+    }
+    if (dstlen > PY_SSIZE_T_MAX) {
+        PyBuffer_Release(&src);
+        return PyErr_NoMemory();
+    }
+
+    retval = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)dstlen);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    rle_decode_hqx((uint8_t *)PyBytes_AS_STRING(retval), &dstlen, src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+    return retval;
+}
+
+static PyMethodDef module_methods[] = {
+    {"a2b", wrap_a2b, METH_VARARGS, NULL},
+    {"b2a", wrap_b2a, METH_VARARGS, NULL},
+    {"crc", wrap_crc, METH_VARARGS, NULL},
+    {"rle_decode", wrap_rle_decode, METH_VARARGS, NULL},
+    {"rle_encode", wrap_rle_encode, METH_VARARGS, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef this_module = {
+    PyModuleDef_HEAD_INIT,
+    "fast_hqx",
+    "Fast hqx (Mac \"binhex\") encoding",
+    -1,
+    module_methods
+};
+
+PyMODINIT_FUNC PyInit_fast_hqx(void)
+{
+    PyObject *m;
+    int i;
+
+    memset(a2b_table, FAIL, sizeof(a2b_table));
+    for (i = 0; i < 64; i++)
+        a2b_table[b2a_table[i]] = i;
+    a2b_table['\r'] = a2b_table['\n'] = SKIP;
+    a2b_table[':'] = DONE;
+
+    m = PyModule_Create(&this_module);
+    if (m == NULL)
+        return NULL;
+
+    Incomplete = PyErr_NewException("tbxi.fast_hqx.Incomplete", NULL, NULL);
+    if (Incomplete == NULL) {
+        Py_DECREF(m);
+        return NULL;
+    }
+
+    Py_INCREF(Incomplete);
+    if (PyModule_AddObject(m, "Incomplete", Incomplete) < 0) {
+        Py_DECREF(Incomplete);
+        Py_DECREF(m);
+        return NULL;
+    }
+
+    return m;
+}
@@ -1,7 +1,6 @@
 #define PY_SSIZE_T_CLEAN 1
 #include <Python.h>
-
-#define LARGE_BUFFER 0x1000000
+#include <structmember.h>
 
 #include <stdlib.h>
 #include <stdint.h>
@@ -41,19 +40,51 @@ struct encode_state {
 };
 
 
-int
-decompress_lzss(uint8_t *dst, uint8_t *src, uint32_t srclen)
+/*
+ * Count the bytes that decompress_lzss() would produce, without
+ * producing them. This is cheap because only the flag bytes and the
+ * length nibbles need to be looked at.
+ */
+size_t
+decompressed_len_lzss(const uint8_t *src, size_t srclen)
+{
+    const uint8_t *srcend = src + srclen;
+    size_t count = 0;
+    unsigned int flags = 0;
+
+    for ( ; ; ) {
+        if (((flags >>= 1) & 0x100) == 0) {
+            if (src < srcend) flags = *src++ | 0xFF00; else break;
+        }
+        if (flags & 1) {
+            if (src < srcend) src++; else break;
+            count += 1;
+        } else {
+            if (srcend - src < 2) break;
+            count += (src[1] & 0x0F) + THRESHOLD + 1;
+            src += 2;
+        }
+    }
+
+    return count;
+}
+
+/*
+ * Returns the number of bytes written to dst, or -1 if the output
+ * would not fit in dstlen bytes (in which case dst holds a prefix).
+ */
+Py_ssize_t
+decompress_lzss(uint8_t *dst, size_t dstlen, const uint8_t *src, size_t srclen)
 {
     /* ring buffer of size N, with extra F-1 bytes to aid string comparison */
     uint8_t text_buf[N + F - 1];
     uint8_t *dststart = dst;
-    uint8_t *srcend = src + srclen;
+    uint8_t *dstend = dst + dstlen;
+    const uint8_t *srcend = src + srclen;
     int  i, j, k, r, c;
     unsigned int flags;
-    
-    dst = dststart;
-    srcend = src + srclen;
-    for (i = 0; i < N - F; i++)
+
+    for (i = 0; i < N; i++)
         text_buf[i] = ' ';
     r = N - F;
     flags = 0;
@@ -64,6 +95,7 @@ decompress_lzss(uint8_t *dst, uint8_t *src, uint32_t srclen)
         }   /* to count eight */
         if (flags & 1) {
             if (src < srcend) c = *src++; else break;
+            if (dst >= dstend) return -1;
             *dst++ = c;
             text_buf[r++] = c;
             r &= (N - 1);
@@ -72,6 +104,7 @@ decompress_lzss(uint8_t *dst, uint8_t *src, uint32_t srclen)
             if (src < srcend) j = *src++; else break;
             i |= ((j & 0xF0) << 4);
             j  =  (j & 0x0F) + THRESHOLD;
+            if (dstend - dst <= j) return -1;
             for (k = 0; k <= j; k++) {
                 c = text_buf[(i + k) & (N - 1)];
                 *dst++ = c;
@@ -80,10 +113,24 @@ decompress_lzss(uint8_t *dst, uint8_t *src, uint32_t srclen)
             }
         }
     }
-    
+
     return dst - dststart;
 }
 
+/* Reset a state that has been through init_state(): only the roots, parents and buffer */
+static void reset_state(struct encode_state *sp)
+{
+    int  i;
+
+    memset(sp->text_buf, ' ', N - F);
+    memset(sp->text_buf + N - F, 0, F - 1 + F);
+    for (i = N + 1; i <= N + 256; i++)
+        sp->rchild[i] = NIL;
+    for (i = 0; i < N; i++)
+        sp->parent[i] = NIL;
+    sp->match_position = sp->match_length = 0;
+}
+
 /*
  * initialize state, mostly the trees
  *
@@ -95,16 +142,8 @@ decompress_lzss(uint8_t *dst, uint8_t *src, uint32_t srclen)
  * Note there are 256 trees. */
 static void init_state(struct encode_state *sp)
 {
-    int  i;
-
     memset(sp, 0, sizeof(*sp));
-
-    for (i = 0; i < N - F; i++)
-        sp->text_buf[i] = ' ';
-    for (i = N + 1; i <= N + 256; i++)
-        sp->rchild[i] = NIL;
-    for (i = 0; i < N; i++)
-        sp->parent[i] = NIL;
+    reset_state(sp);
 }
 
 /*
@@ -198,20 +237,17 @@ static void delete_node(struct encode_state *sp, int p)
     sp->parent[p] = NIL;
 }
 
-uint8_t *
-compress_lzss(uint8_t *dst, size_t dstlen, uint8_t *src, size_t srcLen)
+/* The encoder proper, using state that the caller has init_state()'d */
+static uint8_t *
+compress_lzss_state(struct encode_state *sp, uint8_t *dst, size_t dstlen, const uint8_t *src, size_t srcLen)
 {
-    /* Encoding state, mostly tree but some current match stuff */
-    struct encode_state *sp;
-
     int  i, c, len, r, s, last_match_length, code_buf_ptr;
     uint8_t code_buf[17], mask;
-    uint8_t *srcend = src + srcLen;
+    const uint8_t *srcend = src + srcLen;
     uint8_t *dstend = dst + dstlen;
 
     /* initialize trees */
-    sp = (struct encode_state *) malloc(sizeof(*sp));
-    init_state(sp);
+    reset_state(sp);
 
     /*
      * code_buf[1..16] saves eight units of code, and code_buf[0] works
@@ -228,10 +264,8 @@ compress_lzss(uint8_t *dst, size_t dstlen, uint8_t *src, size_t srcLen)
     /* Read F bytes into the last F bytes of the buffer */
     for (len = 0; len < F && src < srcend; len++)
         sp->text_buf[r + len] = *src++;  
-    if (!len) {
-        free(sp);
+    if (!len)
         return (void *) 0;  /* text of size zero */
-    }
     /*
      * Insert the F strings, each of which begins with one or more
      * 'space' characters.  Note the order in which these strings are
@@ -265,10 +299,8 @@ compress_lzss(uint8_t *dst, size_t dstlen, uint8_t *src, size_t srcLen)
             for (i = 0; i < code_buf_ptr; i++)
                 if (dst < dstend)
                     *dst++ = code_buf[i]; 
-                else {
-                    free(sp);
+                else
                     return (void *) 0;
-                }
             code_buf[0] = 0;
             code_buf_ptr = mask = 1;
         }
@@ -308,51 +340,1373 @@ compress_lzss(uint8_t *dst, size_t dstlen, uint8_t *src, size_t srcLen)
         for (i = 0; i < code_buf_ptr; i++)
             if (dst < dstend)
                 *dst++ = code_buf[i]; 
-            else {
-                free(sp);
+            else
                 return (void *) 0;
+    }
+
+    return dst;
+}
+
+uint8_t *
+compress_lzss(uint8_t *dst, size_t dstlen, uint8_t *src, size_t srcLen)
+{
+    /* Encoding state, mostly tree but some current match stuff */
+    struct encode_state *sp;
+    uint8_t *retval;
+
+    sp = (struct encode_state *) malloc(sizeof(*sp));
+    if (sp == NULL)
+        return (void *) 0;
+    init_state(sp);
+    retval = compress_lzss_state(sp, dst, dstlen, src, srcLen);
+    free(sp);
+    return retval;
+}
+
+
+/*
+ * A resumable version of the loop in compress_lzss(). It makes exactly the
+ * same decisions, but it can be paused at any token boundary, and it can be
+ * started part way through the input (with a fresh tree, as though the input
+ * began there). Tokens are kept unpacked so that the output of several
+ * encoders can be joined together without regard to the flag bytes.
+ */
+struct encoder {
+    struct encode_state st;
+
+    int s, r, len;      /* as in compress_lzss */
+    int pending;        /* bytes of the last token not yet read into the tree */
+    int started, done;
+    Py_ssize_t pos;     /* input offset of the next token */
+
+    /* one flag (1 = literal) per token, and its 1 or 2 code bytes */
+    uint8_t *flags, *codes;
+    Py_ssize_t nflags, ncodes, cap;
+};
+
+static void encoder_init(struct encoder *e, Py_ssize_t start)
+{
+    init_state(&e->st);
+    e->s = 0;
+    e->r = N - F;
+    e->len = e->pending = e->started = e->done = 0;
+    e->pos = start;
+    e->flags = e->codes = NULL;
+    e->nflags = e->ncodes = e->cap = 0;
+}
+
+static void encoder_free_tokens(struct encoder *e)
+{
+    free(e->flags);
+    free(e->codes);
+    e->flags = e->codes = NULL;
+    e->nflags = e->ncodes = e->cap = 0;
+}
+
+static int encoder_reserve(struct encoder *e)
+{
+    Py_ssize_t newcap;
+    uint8_t *newflags, *newcodes;
+
+    if (e->nflags < e->cap)
+        return 1;
+
+    newcap = e->cap ? e->cap * 2 : 4096;
+    newflags = realloc(e->flags, newcap);
+    if (newflags == NULL)
+        return 0;
+    e->flags = newflags;
+    newcodes = realloc(e->codes, newcap * 2);
+    if (newcodes == NULL)
+        return 0;
+    e->codes = newcodes;
+    e->cap = newcap;
+    return 1;
+}
+
+/*
+ * Read input from *srcp up to srcend, and stop at the first token boundary
+ * at or after offset stop. If final is not set, also stop when the input
+ * runs out, and expect to be called again with more. Returns 0 if out of
+ * memory.
+ */
+static int encoder_run(struct encoder *e, const uint8_t **srcp, const uint8_t *srcend,
+    int final, Py_ssize_t stop)
+{
+    struct encode_state *sp = &e->st;
+    const uint8_t *src = *srcp;
+    int i, c;
+
+    if (!e->started) {
+        /* Read F bytes into the last F bytes of the buffer */
+        while (e->len < F && src < srcend)
+            sp->text_buf[e->r + e->len++] = *src++;
+        if (e->len < F && !final)
+            goto out;
+        e->started = 1;
+        if (!e->len) {
+            e->done = 1;  /* text of size zero */
+            goto out;
+        }
+        for (i = 1; i <= F; i++)
+            insert_node(sp, e->r - i);
+        insert_node(sp, e->r);
+    }
+
+    for ( ; ; ) {
+        if (e->pending == 0) {
+            if (e->done || e->pos >= stop)
+                break;
+            if (!encoder_reserve(e)) {
+                *srcp = src;
+                return 0;
             }
+
+            /* match_length may be spuriously long near the end of text. */
+            if (sp->match_length > e->len)
+                sp->match_length = e->len;
+            if (sp->match_length <= THRESHOLD) {
+                sp->match_length = 1;
+                e->flags[e->nflags++] = 1;
+                e->codes[e->ncodes++] = sp->text_buf[e->r];
+            } else {
+                e->flags[e->nflags++] = 0;
+                e->codes[e->ncodes++] = (uint8_t) sp->match_position;
+                e->codes[e->ncodes++] = (uint8_t)
+                    ( ((sp->match_position >> 4) & 0xF0)
+                    |  (sp->match_length - (THRESHOLD + 1)) );
+            }
+            e->pending = sp->match_length;
+            e->pos += sp->match_length;
+        }
+
+        while (e->pending > 0 && src < srcend) {
+            delete_node(sp, e->s);
+            c = *src++;
+            sp->text_buf[e->s] = c;
+            if (e->s < F - 1)
+                sp->text_buf[e->s + N] = c;
+            e->s = (e->s + 1) & (N - 1);
+            e->r = (e->r + 1) & (N - 1);
+            insert_node(sp, e->r);
+            e->pending--;
+        }
+
+        if (e->pending > 0 && !final)
+            break;
+
+        while (e->pending > 0) {
+            delete_node(sp, e->s);
+            e->s = (e->s + 1) & (N - 1);
+            e->r = (e->r + 1) & (N - 1);
+            if (--e->len)
+                insert_node(sp, e->r);
+            e->pending--;
+        }
+
+        if (e->len == 0)
+            e->done = 1;
+    }
+
+out:
+    *srcp = src;
+    return 1;
+}
+
+/*
+ * Will these two encoders make the same decisions from here on, given the
+ * same input? Only the parts of the state that can affect future decisions
+ * are compared: links of nodes that are not in a tree are never read.
+ */
+static int encoder_same_state(const struct encoder *a, const struct encoder *b)
+{
+    const struct encode_state *x = &a->st, *y = &b->st;
+    int i;
+
+    if (a->pos != b->pos || a->s != b->s || a->r != b->r || a->len != b->len
+            || a->pending || b->pending || a->started != b->started || a->done != b->done)
+        return 0;
+    if (x->match_length != y->match_length || x->match_position != y->match_position)
+        return 0;
+    if (memcmp(x->text_buf, y->text_buf, sizeof(x->text_buf)))
+        return 0;
+    for (i = N + 1; i <= N + 256; i++)
+        if (x->rchild[i] != y->rchild[i])
+            return 0;
+    for (i = 0; i < N; i++) {
+        if (x->parent[i] != y->parent[i])
+            return 0;
+        if (x->parent[i] != NIL && (x->lchild[i] != y->lchild[i] || x->rchild[i] != y->rchild[i]))
+            return 0;
+    }
+    return 1;
+}
+
+/* Pack tokens eight at a time behind a flag byte, exactly as compress_lzss does */
+struct packer {
+    uint8_t code_buf[17], mask;
+    int code_buf_ptr;
+};
+
+static void packer_init(struct packer *pk)
+{
+    pk->code_buf[0] = 0;
+    pk->code_buf_ptr = pk->mask = 1;
+}
+
+static uint8_t *packer_put(struct packer *pk, uint8_t *dst,
+    const uint8_t *flags, Py_ssize_t nflags, const uint8_t *codes)
+{
+    Py_ssize_t t;
+
+    for (t = 0; t < nflags; t++) {
+        if (flags[t]) {
+            pk->code_buf[0] |= pk->mask;
+            pk->code_buf[pk->code_buf_ptr++] = *codes++;
+        } else {
+            pk->code_buf[pk->code_buf_ptr++] = *codes++;
+            pk->code_buf[pk->code_buf_ptr++] = *codes++;
+        }
+        if ((pk->mask <<= 1) == 0) {
+            memcpy(dst, pk->code_buf, pk->code_buf_ptr);
+            dst += pk->code_buf_ptr;
+            pk->code_buf[0] = 0;
+            pk->code_buf_ptr = pk->mask = 1;
+        }
+    }
+    return dst;
+}
+
+static uint8_t *packer_flush(struct packer *pk, uint8_t *dst)
+{
+    if (pk->code_buf_ptr > 1) {
+        memcpy(dst, pk->code_buf, pk->code_buf_ptr);
+        dst += pk->code_buf_ptr;
+    }
+    packer_init(pk);
+    return dst;
+}
+
+/* Upper bound on the packed size of some tokens */
+#define PACKED_BOUND(ncodes, nflags) ((ncodes) + ((nflags) + 7) / 8)
+
+
+/*
+ * Every input position is inserted into the trees in the same order, with
+ * the same deletions, whichever tokens are chosen. So one pass can record
+ * the longest match available at each position (lens is zero if too short
+ * to use), and any parse can then be made from those.
+ */
+static int find_matches_lzss(const uint8_t *src, size_t srclen, uint8_t *lens, uint16_t *poss)
+{
+    struct encode_state *sp;
+    const uint8_t *srcend = src + srclen;
+    size_t k;
+    int i, c, len, r, s;
+
+    sp = (struct encode_state *) malloc(sizeof(*sp));
+    if (sp == NULL)
+        return 0;
+    init_state(sp);
+
+    s = 0;  r = N - F;
+    for (len = 0; len < F && src < srcend; len++)
+        sp->text_buf[r + len] = *src++;
+    for (i = 1; i <= F; i++)
+        insert_node(sp, r - i);
+    insert_node(sp, r);
+
+    for (k = 0; k < srclen; k++) {
+        if (sp->match_length > len)
+            sp->match_length = len;
+        lens[k] = sp->match_length > THRESHOLD ? sp->match_length : 0;
+        poss[k] = sp->match_position;
+
+        /* Move along one byte, exactly as compress_lzss() does */
+        delete_node(sp, s);
+        if (src < srcend) {
+            c = *src++;
+            sp->text_buf[s] = c;
+            if (s < F - 1)
+                sp->text_buf[s + N] = c;
+            s = (s + 1) & (N - 1);
+            r = (r + 1) & (N - 1);
+            insert_node(sp, r);
+        } else {
+            s = (s + 1) & (N - 1);
+            r = (r + 1) & (N - 1);
+            if (--len)
+                insert_node(sp, r);
+        }
     }
 
     free(sp);
+    return 1;
+}
+
+/*
+ * Choose the tokens that make the smallest output, by working backwards from
+ * the end. A literal costs 9 bits and a match 17 bits, counting flag bits.
+ * Any match can be shortened, so every length from 3 to lens[k] is an option.
+ * Also works out how long compress_lzss() output would be, for comparison.
+ */
+uint8_t *
+compress_lzss_optimal(uint8_t *dst, const uint8_t *src, size_t srclen, size_t *greedy_len)
+{
+    uint8_t *lens, *choice;
+    uint16_t *poss;
+    uint32_t *cost, c, best;
+    struct packer pk;
+    size_t k, tokens, codes;
+    int l;
+    uint8_t flag, code[2];
+
+    lens = malloc(srclen);
+    choice = malloc(srclen);
+    poss = malloc(srclen * sizeof(*poss));
+    cost = malloc((srclen + 1) * sizeof(*cost));
+    if (lens == NULL || choice == NULL || poss == NULL || cost == NULL
+            || !find_matches_lzss(src, srclen, lens, poss)) {
+        free(lens); free(choice); free(poss); free(cost);
+        return NULL;
+    }
+
+    /* The greedy parse just takes every match it finds */
+    tokens = codes = 0;
+    for (k = 0; k < srclen; k += lens[k] ? lens[k] : 1) {
+        tokens++;
+        codes += lens[k] ? 2 : 1;
+    }
+    *greedy_len = PACKED_BOUND(codes, tokens);
+
+    cost[srclen] = 0;
+    for (k = srclen; k-- > 0; ) {
+        best = cost[k + 1] + 9;
+        choice[k] = 1;
+        for (l = THRESHOLD + 1; l <= lens[k]; l++) {
+            c = cost[k + l] + 17;
+            if (c < best) {
+                best = c;
+                choice[k] = l;
+            }
+        }
+        cost[k] = best;
+    }
+
+    packer_init(&pk);
+    for (k = 0; k < srclen; k += choice[k]) {
+        if (choice[k] == 1) {
+            flag = 1;
+            code[0] = src[k];
+        } else {
+            flag = 0;
+            code[0] = (uint8_t) poss[k];
+            code[1] = (uint8_t) (((poss[k] >> 4) & 0xF0) | (choice[k] - (THRESHOLD + 1)));
+        }
+        dst = packer_put(&pk, dst, &flag, 1, code);
+    }
+    dst = packer_flush(&pk, dst);
+
+    free(lens); free(choice); free(poss); free(cost);
     return dst;
 }
 
 
+/*
+ * A quick greedy encoder for development builds. It makes a valid stream
+ * for any Okumura-style decoder, but not the same one as compress_lzss().
+ * Candidate matches are found on hash chains of three-byte prefixes, only
+ * the most recent FAST_DEPTH of which are tried.
+ */
+#define FAST_HASH_BITS  15
+#define FAST_DEPTH      16
+#define FAST_HASH(p)    ((((uint32_t)(p)[0] << 16 | (uint32_t)(p)[1] << 8 | (p)[2]) \
+                          * 2654435761u) >> (32 - FAST_HASH_BITS))
+
+uint8_t *
+compress_lzss_fast(uint8_t *dst, const uint8_t *src, size_t srclen)
+{
+    /* last position (plus one) with each hash, and the one before each */
+    size_t *head, *prev;
+    struct packer pk;
+    size_t i, j, cand, best_pos, best_len, max_len, len, end;
+    uint8_t flag, codes[2];
+    int depth;
+
+    head = calloc((size_t)1 << FAST_HASH_BITS, sizeof(*head));
+    prev = calloc(N, sizeof(*prev));
+    if (head == NULL || prev == NULL) {
+        free(head);
+        free(prev);
+        return NULL;
+    }
+
+    packer_init(&pk);
+    i = 0;
+    while (i < srclen) {
+        best_len = best_pos = 0;
+        max_len = srclen - i < F ? srclen - i : F;
+
+        if (max_len > THRESHOLD) {
+            cand = head[FAST_HASH(src + i)];
+            for (depth = FAST_DEPTH; cand && depth; depth--) {
+                j = cand - 1;
+                if (i - j > N - F)  /* would no longer be in the ring buffer */
+                    break;
+                if (src[j + best_len] == src[i + best_len]) {
+                    for (len = 0; len < max_len && src[j + len] == src[i + len]; len++)
+                        ;
+                    if (len > best_len) {
+                        best_len = len;
+                        best_pos = j;
+                        if (len == max_len)
+                            break;
+                    }
+                }
+                cand = prev[j & (N - 1)];
+            }
+        }
+
+        if (best_len > THRESHOLD) {
+            /* input offset k went into the ring buffer at (k + N - F) % N */
+            best_pos = (best_pos + N - F) & (N - 1);
+            flag = 0;
+            codes[0] = (uint8_t) best_pos;
+            codes[1] = (uint8_t) (((best_pos >> 4) & 0xF0) | (best_len - (THRESHOLD + 1)));
+        } else {
+            best_len = 1;
+            flag = 1;
+            codes[0] = src[i];
+        }
+        dst = packer_put(&pk, dst, &flag, 1, codes);
+
+        for (end = i + best_len; i < end; i++) {
+            if (srclen - i > THRESHOLD) {
+                size_t h = FAST_HASH(src + i);
+                prev[i & (N - 1)] = head[h];
+                head[h] = i + 1;
+            }
+        }
+    }
+    dst = packer_flush(&pk, dst);
+
+    free(head);
+    free(prev);
+    return dst;
+}
+
+
+/*
+ * A resumable version of decompress_lzss(), which can stop whenever it runs
+ * out of input or output space, even in the middle of a token.
+ */
+struct decoder {
+    uint8_t text_buf[N];
+    int r;
+    unsigned int flags;  /* bit 8 clear means a flag byte is due */
+    int byte1, have_byte1;  /* first half of a position-and-length pair */
+    int match_pos, match_left;  /* dictionary copy in progress */
+};
+
+static void decoder_init(struct decoder *d)
+{
+    memset(d->text_buf, ' ', N);
+    d->r = N - F;
+    d->flags = 0;
+    d->byte1 = d->have_byte1 = 0;
+    d->match_pos = d->match_left = 0;
+}
+
+/* Returns the number of bytes written, and advances *srcp past what was used */
+static size_t decoder_run(struct decoder *d, uint8_t *dst, size_t dstlen,
+    const uint8_t **srcp, const uint8_t *srcend)
+{
+    uint8_t *text_buf = d->text_buf;
+    uint8_t *p = dst, *dstend = dst + dstlen;
+    const uint8_t *src = *srcp;
+    int r = d->r, c, j;
+    unsigned int flags = d->flags;
+
+    for ( ; ; ) {
+        while (d->match_left && p < dstend) {
+            c = text_buf[d->match_pos];
+            d->match_pos = (d->match_pos + 1) & (N - 1);
+            d->match_left--;
+            *p++ = c;
+            text_buf[r] = c;
+            r = (r + 1) & (N - 1);
+        }
+        if (p >= dstend) break;
+
+        if ((flags & 0x100) == 0) {
+            if (src < srcend) flags = *src++ | 0xFF00; else break;
+        }
+        if (flags & 1) {
+            if (src < srcend) c = *src++; else break;
+            *p++ = c;
+            text_buf[r] = c;
+            r = (r + 1) & (N - 1);
+        } else {
+            if (!d->have_byte1) {
+                if (src < srcend) d->byte1 = *src++; else break;
+                d->have_byte1 = 1;
+            }
+            if (src < srcend) j = *src++; else break;
+            d->have_byte1 = 0;
+            d->match_pos = d->byte1 | ((j & 0xF0) << 4);
+            d->match_left = (j & 0x0F) + THRESHOLD + 1;
+        }
+        flags >>= 1;
+    }
+
+    d->r = r;
+    d->flags = flags;
+    *srcp = src;
+    return p - dst;
+}
+
+
 /* Python wrapper stuff happens here */
 
 
 static PyObject *wrap_compress(PyObject *self, PyObject *args)
 {
-    uint8_t *src, *dst, *returned;
-    Py_ssize_t src_len, dst_len;
+    Py_buffer src;
+    PyObject *retval;
+    uint8_t *dst, *returned;
+    Py_ssize_t bound;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
+
+    /* compress_lzss signals an empty result the same way as an error */
+    if (src.len == 0) {
+        PyBuffer_Release(&src);
+        return PyBytes_FromStringAndSize(NULL, 0);
+    }
+
+    /* Worst case is all literals: every byte plus a flag byte per eight */
+    if (src.len > (PY_SSIZE_T_MAX - 7) / 9 * 8) {
+        PyBuffer_Release(&src);
+        return PyErr_NoMemory();
+    }
+    bound = src.len + (src.len + 7) / 8;
+
+    retval = PyBytes_FromStringAndSize(NULL, bound);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+    dst = (uint8_t *)PyBytes_AS_STRING(retval);
+
+    Py_BEGIN_ALLOW_THREADS
+    returned = compress_lzss(dst, (size_t)bound, src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+
+    if (returned == NULL) {
+        Py_DECREF(retval);
+        return PyErr_NoMemory();
+    }
+
+    if (_PyBytes_Resize(&retval, returned - dst) < 0)
+        return NULL;
+
+    return retval;
+}
+
+/*
+ * Compress a list of buffers, which is much quicker than calling compress()
+ * on each one if they are small: one encoder state and one output arena do
+ * for the lot, and the GIL is only released once.
+ */
+static PyObject *wrap_compress_many(PyObject *self, PyObject *arg)
+{
+    PyObject *seq, *retval = NULL, *item;
+    Py_buffer *srcs;
+    Py_ssize_t i, count, got = 0, *lens = NULL;
+    size_t total = 0, bound, offset;
+    struct encode_state *sp = NULL;
+    uint8_t *arena = NULL, *returned;
+    int ok = 1;
+
+    seq = PySequence_Fast(arg, "expected a sequence of buffers");
+    if (seq == NULL)
+        return NULL;
+    count = PySequence_Fast_GET_SIZE(seq);
+
+    srcs = PyMem_Calloc(count ? count : 1, sizeof(*srcs));
+    lens = PyMem_Calloc(count ? count : 1, sizeof(*lens));
+    if (srcs == NULL || lens == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+
+    for (got = 0; got < count; got++) {
+        if (PyObject_GetBuffer(PySequence_Fast_GET_ITEM(seq, got), &srcs[got], PyBUF_SIMPLE) < 0)
+            goto out;
+        /* Worst case is all literals: every byte plus a flag byte per eight */
+        if (srcs[got].len > (PY_SSIZE_T_MAX - 7) / 9 * 8) {
+            PyErr_NoMemory();
+            got++;
+            goto out;
+        }
+        bound = srcs[got].len + (srcs[got].len + 7) / 8;
+        if (total > (size_t)PY_SSIZE_T_MAX - bound) {
+            PyErr_NoMemory();
+            got++;
+            goto out;
+        }
+        total += bound;
+    }
+
+    sp = malloc(sizeof(*sp));
+    arena = malloc(total ? total : 1);
+    if (sp == NULL || arena == NULL) {
+        PyErr_NoMemory();
+        goto out;
+    }
+    init_state(sp);
+
+    Py_BEGIN_ALLOW_THREADS
+    offset = 0;
+    for (i = 0; i < count; i++) {
+        lens[i] = 0;
+        if (srcs[i].len == 0)
+            continue;
+        bound = srcs[i].len + (srcs[i].len + 7) / 8;
+        returned = compress_lzss_state(sp, arena + offset, bound, srcs[i].buf, (size_t)srcs[i].len);
+        if (returned == NULL) {
+            ok = 0;
+            break;
+        }
+        lens[i] = returned - (arena + offset);
+        offset += bound;
+    }
+    Py_END_ALLOW_THREADS
+
+    if (!ok) {
+        PyErr_NoMemory();
+        goto out;
+    }
+
+    retval = PyList_New(count);
+    if (retval == NULL)
+        goto out;
+
+    offset = 0;
+    for (i = 0; i < count; i++) {
+        item = PyBytes_FromStringAndSize((const char *)arena + offset, lens[i]);
+        if (item == NULL) {
+            Py_CLEAR(retval);
+            goto out;
+        }
+        PyList_SET_ITEM(retval, i, item);
+        if (srcs[i].len)
+            offset += srcs[i].len + (srcs[i].len + 7) / 8;
+    }
+
+out:
+    for (i = 0; i < got; i++)
+        if (srcs[i].obj != NULL)
+            PyBuffer_Release(&srcs[i]);
+    PyMem_Free(srcs);
+    PyMem_Free(lens);
+    free(sp);
+    free(arena);
+    Py_DECREF(seq);
+    return retval;
+}
+
+static PyObject *wrap_compress_fast(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *retval;
+    uint8_t *dst, *returned;
+    Py_ssize_t bound;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
 
-    if(!PyArg_ParseTuple(args, "y#", &src, &src_len)) {
-        PyErr_SetString(PyExc_ValueError, "bad args"); return NULL;
+    if (src.len > (PY_SSIZE_T_MAX - 7) / 9 * 8) {
+        PyBuffer_Release(&src);
+        return PyErr_NoMemory();
+    }
+    bound = src.len + (src.len + 7) / 8;
+
+    retval = PyBytes_FromStringAndSize(NULL, bound);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
     }
+    dst = (uint8_t *)PyBytes_AS_STRING(retval);
+
+    Py_BEGIN_ALLOW_THREADS
+    returned = compress_lzss_fast(dst, src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
 
-    /* Now, we guess how long the object goes (naughty!) */
-    dst = malloc(LARGE_BUFFER);
-    if (dst == NULL) {
+    PyBuffer_Release(&src);
+
+    if (returned == NULL) {
+        Py_DECREF(retval);
         return PyErr_NoMemory();
     }
 
-    returned = compress_lzss(dst, (size_t)LARGE_BUFFER, src, (size_t)src_len);
+    if (_PyBytes_Resize(&retval, returned - dst) < 0)
+        return NULL;
+
+    return retval;
+}
+
+/* Returns the optimally parsed data, and the length compress() would give */
+static PyObject *wrap_compress_optimal(PyObject *self, PyObject *args)
+{
+    Py_buffer src;
+    PyObject *packed;
+    uint8_t *dst, *returned;
+    Py_ssize_t bound;
+    size_t greedy_len = 0;
+
+    if (!PyArg_ParseTuple(args, "y*", &src))
+        return NULL;
+
+    if (src.len == 0) {
+        PyBuffer_Release(&src);
+        return Py_BuildValue("y#n", "", (Py_ssize_t)0, (Py_ssize_t)0);
+    }
+
+    if (src.len > (PY_SSIZE_T_MAX - 7) / 9 * 8) {
+        PyBuffer_Release(&src);
+        return PyErr_NoMemory();
+    }
+    bound = src.len + (src.len + 7) / 8;
+
+    packed = PyBytes_FromStringAndSize(NULL, bound);
+    if (packed == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+    dst = (uint8_t *)PyBytes_AS_STRING(packed);
+
+    Py_BEGIN_ALLOW_THREADS
+    returned = compress_lzss_optimal(dst, src.buf, (size_t)src.len, &greedy_len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+
     if (returned == NULL) {
-        free(dst);
+        Py_DECREF(packed);
         return PyErr_NoMemory();
     }
 
-    dst_len = returned - dst;
+    if (_PyBytes_Resize(&packed, returned - dst) < 0)
+        return NULL;
+
+    return Py_BuildValue("Nn", packed, (Py_ssize_t)greedy_len);
+}
+
+static PyObject *wrap_decompress(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"src", "expected_len", NULL};
+    Py_buffer src;
+    PyObject *expected_obj = Py_None, *retval;
+    Py_ssize_t expected_len, got_len;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*|O", kwlist, &src, &expected_obj))
+        return NULL;
+
+    if (expected_obj == Py_None) {
+        Py_BEGIN_ALLOW_THREADS
+        expected_len = (Py_ssize_t)decompressed_len_lzss(src.buf, (size_t)src.len);
+        Py_END_ALLOW_THREADS
+    } else {
+        expected_len = PyNumber_AsSsize_t(expected_obj, PyExc_OverflowError);
+        if (expected_len == -1 && PyErr_Occurred()) {
+            PyBuffer_Release(&src);
+            return NULL;
+        }
+        if (expected_len < 0) {
+            PyBuffer_Release(&src);
+            PyErr_SetString(PyExc_ValueError, "expected_len must not be negative");
+            return NULL;
+        }
+    }
+
+    retval = PyBytes_FromStringAndSize(NULL, expected_len);
+    if (retval == NULL) {
+        PyBuffer_Release(&src);
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    got_len = decompress_lzss((uint8_t *)PyBytes_AS_STRING(retval), (size_t)expected_len,
+        src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
 
-    PyObject *retval = PyBytes_FromStringAndSize((const char *)dst, dst_len);
-    free(dst);
+    if (got_len != expected_len) {
+        Py_DECREF(retval);
+        PyErr_Format(PyExc_ValueError, "LZSS data does not decompress to %zd bytes", expected_len);
+        return NULL;
+    }
 
     return retval;
 }
 
+static PyObject *wrap_decompress_into(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"src", "buffer", "offset", NULL};
+    Py_buffer src, dst;
+    Py_ssize_t offset = 0, got_len;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*w*|n", kwlist, &src, &dst, &offset))
+        return NULL;
+
+    if (offset < 0 || offset > dst.len) {
+        PyBuffer_Release(&src);
+        PyBuffer_Release(&dst);
+        PyErr_SetString(PyExc_ValueError, "offset out of range");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+    got_len = decompress_lzss((uint8_t *)dst.buf + offset, (size_t)(dst.len - offset),
+        src.buf, (size_t)src.len);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&src);
+    PyBuffer_Release(&dst);
+
+    if (got_len < 0) {
+        PyErr_SetString(PyExc_ValueError, "buffer too small for decompressed data");
+        return NULL;
+    }
+
+    return PyLong_FromSsize_t(got_len);
+}
+
+/*
+ * Objects that work without the GIL hold their own lock meanwhile, as
+ * _bz2's do, so that two threads using one object wait for each other.
+ */
+#define ACQUIRE_LOCK(obj) do { \
+    if (!PyThread_acquire_lock((obj)->lock, 0)) { \
+        Py_BEGIN_ALLOW_THREADS \
+        PyThread_acquire_lock((obj)->lock, 1); \
+        Py_END_ALLOW_THREADS \
+    } } while (0)
+#define RELEASE_LOCK(obj) PyThread_release_lock((obj)->lock)
+
+/*
+ * Encoder objects expose the resumable encoder, so that the input can be
+ * split into segments and compressed on several threads. See lzss.py.
+ */
+typedef struct {
+    PyObject_HEAD
+    Py_buffer src;
+    Py_ssize_t next;  /* offset of the first unread input byte */
+    struct encoder *e;
+    PyThread_type_lock lock;
+} EncoderObject;
+
+static PyTypeObject EncoderType;
+
+static PyObject *Encoder_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"src", "start", NULL};
+    EncoderObject *self;
+    Py_ssize_t start = 0;
+
+    self = (EncoderObject *)type->tp_alloc(type, 0);
+    if (self == NULL)
+        return NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "y*|n", kwlist, &self->src, &start)) {
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    if (start < 0 || start > self->src.len) {
+        PyErr_SetString(PyExc_ValueError, "start out of range");
+        Py_DECREF(self);
+        return NULL;
+    }
+
+    self->lock = PyThread_allocate_lock();
+    self->e = malloc(sizeof(*self->e));
+    if (self->lock == NULL || self->e == NULL) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+    encoder_init(self->e, start);
+    self->next = start;
+
+    return (PyObject *)self;
+}
+
+static void Encoder_dealloc(EncoderObject *self)
+{
+    if (self->e != NULL) {
+        encoder_free_tokens(self->e);
+        free(self->e);
+    }
+    if (self->src.obj != NULL)
+        PyBuffer_Release(&self->src);
+    if (self->lock != NULL)
+        PyThread_free_lock(self->lock);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *Encoder_run(EncoderObject *self, PyObject *args)
+{
+    Py_ssize_t stop = PY_SSIZE_T_MAX;
+    const uint8_t *src, *srcend;
+    int ok;
+
+    if (!PyArg_ParseTuple(args, "|n", &stop))
+        return NULL;
+
+    ACQUIRE_LOCK(self);
+    src = (const uint8_t *)self->src.buf + self->next;
+    srcend = (const uint8_t *)self->src.buf + self->src.len;
+
+    Py_BEGIN_ALLOW_THREADS
+    ok = encoder_run(self->e, &src, srcend, 1, stop);
+    Py_END_ALLOW_THREADS
+
+    self->next = src - (const uint8_t *)self->src.buf;
+    RELEASE_LOCK(self);
+
+    if (!ok)
+        return PyErr_NoMemory();
+
+    Py_RETURN_NONE;
+}
+
+static PyObject *Encoder_copy(EncoderObject *self, PyObject *unused)
+{
+    EncoderObject *other;
+
+    other = (EncoderObject *)EncoderType.tp_alloc(&EncoderType, 0);
+    if (other == NULL)
+        return NULL;
+
+    if (PyObject_GetBuffer(self->src.obj, &other->src, PyBUF_SIMPLE) < 0) {
+        Py_DECREF(other);
+        return NULL;
+    }
+
+    other->lock = PyThread_allocate_lock();
+    other->e = malloc(sizeof(*other->e));
+    if (other->lock == NULL || other->e == NULL) {
+        Py_DECREF(other);
+        return PyErr_NoMemory();
+    }
+    ACQUIRE_LOCK(self);
+    memcpy(other->e, self->e, sizeof(*other->e));
+    other->next = self->next;
+    RELEASE_LOCK(self);
+    other->e->flags = other->e->codes = NULL;  /* tokens stay with the original */
+    other->e->nflags = other->e->ncodes = other->e->cap = 0;
+
+    return (PyObject *)other;
+}
+
+static PyObject *Encoder_same_state(EncoderObject *self, PyObject *other)
+{
+    EncoderObject *first, *second;
+    int same;
+
+    if (!PyObject_TypeCheck(other, &EncoderType)) {
+        PyErr_SetString(PyExc_TypeError, "expected an Encoder");
+        return NULL;
+    }
+
+    /* Lock both in address order, so that a.same_state(b) and
+       b.same_state(a) on two threads cannot deadlock */
+    first = self < (EncoderObject *)other ? self : (EncoderObject *)other;
+    second = self < (EncoderObject *)other ? (EncoderObject *)other : self;
+
+    ACQUIRE_LOCK(first);
+    if (second != first)
+        ACQUIRE_LOCK(second);
+    same = encoder_same_state(self->e, ((EncoderObject *)other)->e);
+    if (second != first)
+        RELEASE_LOCK(second);
+    RELEASE_LOCK(first);
+
+    return PyBool_FromLong(same);
+}
+
+static PyObject *Encoder_discard(EncoderObject *self, PyObject *unused)
+{
+    ACQUIRE_LOCK(self);
+    encoder_free_tokens(self->e);
+    RELEASE_LOCK(self);
+    Py_RETURN_NONE;
+}
+
+static PyObject *Encoder_get_pos(EncoderObject *self, void *closure)
+{
+    Py_ssize_t pos;
+
+    ACQUIRE_LOCK(self);
+    pos = self->e->pos;
+    RELEASE_LOCK(self);
+    return PyLong_FromSsize_t(pos);
+}
+
+static PyObject *Encoder_get_done(EncoderObject *self, void *closure)
+{
+    int done;
+
+    ACQUIRE_LOCK(self);
+    done = self->e->done;
+    RELEASE_LOCK(self);
+    return PyBool_FromLong(done);
+}
+
+static PyMethodDef Encoder_methods[] = {
+    {"run", (PyCFunction)Encoder_run, METH_VARARGS, NULL},
+    {"copy", (PyCFunction)Encoder_copy, METH_NOARGS, NULL},
+    {"same_state", (PyCFunction)Encoder_same_state, METH_O, NULL},
+    {"discard", (PyCFunction)Encoder_discard, METH_NOARGS, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyGetSetDef Encoder_getset[] = {
+    {"pos", (getter)Encoder_get_pos, NULL, NULL, NULL},
+    {"done", (getter)Encoder_get_done, NULL, NULL, NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject EncoderType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "tbxi.fast_lzss.Encoder",
+    .tp_basicsize = sizeof(EncoderObject),
+    .tp_dealloc = (destructor)Encoder_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_methods = Encoder_methods,
+    .tp_getset = Encoder_getset,
+    .tp_new = Encoder_new,
+};
+
+static int compare_addresses(const void *a, const void *b)
+{
+    uintptr_t x = (uintptr_t)*(EncoderObject *const *)a;
+    uintptr_t y = (uintptr_t)*(EncoderObject *const *)b;
+
+    return (x > y) - (x < y);
+}
+
+/* Pack the tokens of several Encoders, in order, into one LZSS stream */
+static PyObject *wrap_pack_tokens(PyObject *self, PyObject *arg)
+{
+    PyObject *seq, *retval;
+    EncoderObject **list, **locked;
+    struct packer pk;
+    Py_ssize_t i, count, nflags = 0, ncodes = 0;
+    uint8_t *dst = NULL;
+
+    seq = PySequence_Fast(arg, "expected a sequence of Encoders");
+    if (seq == NULL)
+        return NULL;
+
+    count = PySequence_Fast_GET_SIZE(seq);
+    list = PyMem_Malloc(sizeof(*list) * (count ? count : 1) * 2);
+    if (list == NULL) {
+        Py_DECREF(seq);
+        return PyErr_NoMemory();
+    }
+    locked = list + (count ? count : 1);
+
+    for (i = 0; i < count; i++) {
+        PyObject *item = PySequence_Fast_GET_ITEM(seq, i);
+        if (!PyObject_TypeCheck(item, &EncoderType)) {
+            PyMem_Free(list);
+            Py_DECREF(seq);
+            PyErr_SetString(PyExc_TypeError, "expected a sequence of Encoders");
+            return NULL;
+        }
+        list[i] = locked[i] = (EncoderObject *)item;
+    }
+
+    /* Lock each Encoder once, in address order, as same_state() does */
+    qsort(locked, count, sizeof(*locked), compare_addresses);
+    for (i = 0; i < count; i++)
+        if (i == 0 || locked[i] != locked[i - 1])
+            ACQUIRE_LOCK(locked[i]);
+
+    for (i = 0; i < count; i++) {
+        nflags += list[i]->e->nflags;
+        ncodes += list[i]->e->ncodes;
+    }
+
+    retval = PyBytes_FromStringAndSize(NULL, PACKED_BOUND(ncodes, nflags));
+    if (retval != NULL) {
+        dst = (uint8_t *)PyBytes_AS_STRING(retval);
+        packer_init(&pk);
+        for (i = 0; i < count; i++)
+            dst = packer_put(&pk, dst, list[i]->e->flags, list[i]->e->nflags, list[i]->e->codes);
+        dst = packer_flush(&pk, dst);
+    }
+
+    for (i = 0; i < count; i++)
+        if (i == 0 || locked[i] != locked[i - 1])
+            RELEASE_LOCK(locked[i]);
+
+    PyMem_Free(list);
+    Py_DECREF(seq);
+
+    if (retval == NULL)
+        return NULL;
+
+    if (_PyBytes_Resize(&retval, dst - (uint8_t *)PyBytes_AS_STRING(retval)) < 0)
+        return NULL;
+    return retval;
+}
+
+/* Streaming decompressor, modelled on bz2.BZ2Decompressor */
+typedef struct {
+    PyObject_HEAD
+    struct decoder d;
+    Py_ssize_t expected_len;  /* -1 if unknown */
+    Py_ssize_t total_out;
+    uint8_t *input;  /* input that could not be used yet */
+    Py_ssize_t input_len;
+    PyObject *unused_data;
+    char eof;
+    PyThread_type_lock lock;
+} DecompressorObject;
+
+static PyObject *Decompressor_new(PyTypeObject *type, PyObject *args, PyObject *kwargs)
+{
+    DecompressorObject *self;
+
+    self = (DecompressorObject *)type->tp_alloc(type, 0);
+    if (self == NULL)
+        return NULL;
+
+    self->lock = PyThread_allocate_lock();
+    if (self->lock == NULL) {
+        Py_DECREF(self);
+        return PyErr_NoMemory();
+    }
+
+    return (PyObject *)self;
+}
+
+static int Decompressor_init(DecompressorObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"expected_len", NULL};
+    PyObject *expected_obj = Py_None, *empty;
+    Py_ssize_t expected_len = -1;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|O", kwlist, &expected_obj))
+        return -1;
+
+    if (expected_obj != Py_None) {
+        expected_len = PyNumber_AsSsize_t(expected_obj, PyExc_OverflowError);
+        if (expected_len == -1 && PyErr_Occurred())
+            return -1;
+        if (expected_len < 0) {
+            PyErr_SetString(PyExc_ValueError, "expected_len must not be negative");
+            return -1;
+        }
+    }
+
+    empty = PyBytes_FromStringAndSize(NULL, 0);
+    if (empty == NULL)
+        return -1;
+
+    ACQUIRE_LOCK(self);
+    self->expected_len = expected_len;
+    decoder_init(&self->d);
+    self->total_out = 0;
+    PyMem_Free(self->input);
+    self->input = NULL;
+    self->input_len = 0;
+    Py_XSETREF(self->unused_data, empty);
+    self->eof = (expected_len == 0);
+    RELEASE_LOCK(self);
+
+    return 0;
+}
+
+static void Decompressor_dealloc(DecompressorObject *self)
+{
+    PyMem_Free(self->input);
+    Py_XDECREF(self->unused_data);
+    if (self->lock != NULL)
+        PyThread_free_lock(self->lock);
+    Py_TYPE(self)->tp_free((PyObject *)self);
+}
+
+static PyObject *Decompressor_feed_locked(DecompressorObject *self, Py_buffer *data, Py_ssize_t max_length)
+{
+    Py_ssize_t limit, got;
+    const uint8_t *src, *srcstart, *srcend;
+    uint8_t *joined;
+    PyObject *retval;
+
+    if (self->eof) {
+        if (data->len) {
+            PyObject *more = PyBytes_FromStringAndSize(data->buf, data->len);
+            if (more == NULL) {
+                PyBuffer_Release(data);
+                return NULL;
+            }
+            PyBytes_ConcatAndDel(&self->unused_data, more);
+        }
+        if (data->obj != NULL)
+            PyBuffer_Release(data);
+        if (self->unused_data == NULL)
+            return NULL;
+        return PyBytes_FromStringAndSize(NULL, 0);
+    }
+
+    /* Use the new data in place unless there is some left over */
+    if (self->input_len) {
+        joined = PyMem_Realloc(self->input, self->input_len + data->len);
+        if (joined == NULL) {
+            if (data->obj != NULL)
+                PyBuffer_Release(data);
+            return PyErr_NoMemory();
+        }
+        memcpy(joined + self->input_len, data->buf, data->len);
+        self->input = joined;
+        self->input_len += data->len;
+        srcstart = self->input;
+        srcend = srcstart + self->input_len;
+    } else {
+        srcstart = data->len ? data->buf : (const uint8_t *)"";
+        srcend = srcstart + data->len;
+    }
+
+    /* Each input byte makes at most 9 output bytes, plus a pending match */
+    limit = (srcend - srcstart) < (PY_SSIZE_T_MAX - F) / 9 ? (srcend - srcstart) * 9 + F : PY_SSIZE_T_MAX;
+    if (max_length >= 0 && max_length < limit)
+        limit = max_length;
+    if (self->expected_len >= 0 && self->expected_len - self->total_out < limit)
+        limit = self->expected_len - self->total_out;
+
+    retval = PyBytes_FromStringAndSize(NULL, limit);
+    if (retval == NULL) {
+        if (data->obj != NULL)
+            PyBuffer_Release(data);
+        return NULL;
+    }
+
+    src = srcstart;
+    Py_BEGIN_ALLOW_THREADS
+    got = decoder_run(&self->d, (uint8_t *)PyBytes_AS_STRING(retval), (size_t)limit, &src, srcend);
+    Py_END_ALLOW_THREADS
+
+    self->total_out += got;
+    if (self->expected_len >= 0 && self->total_out == self->expected_len)
+        self->eof = 1;
+
+    /* Keep whatever is left over, either for next time or as unused_data */
+    if (self->eof) {
+        Py_XSETREF(self->unused_data, PyBytes_FromStringAndSize((const char *)src, srcend - src));
+        PyMem_Free(self->input);
+        self->input = NULL;
+        self->input_len = 0;
+    } else if (srcstart == self->input) {
+        memmove(self->input, src, srcend - src);
+        self->input_len = srcend - src;
+    } else if (src < srcend) {
+        PyMem_Free(self->input);
+        self->input = PyMem_Malloc(srcend - src);
+        if (self->input != NULL)
+            memcpy(self->input, src, srcend - src);
+        self->input_len = srcend - src;
+    }
+
+    if (data->obj != NULL)
+        PyBuffer_Release(data);
+
+    if (self->eof && self->unused_data == NULL) {
+        Py_DECREF(retval);
+        return NULL;
+    }
+    if (self->input_len && self->input == NULL) {
+        self->input_len = 0;
+        Py_DECREF(retval);
+        return PyErr_NoMemory();
+    }
+
+    if (_PyBytes_Resize(&retval, got) < 0)
+        return NULL;
+    return retval;
+}
+
+static PyObject *Decompressor_feed(DecompressorObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"data", "max_length", NULL};
+    Py_buffer data = {NULL};
+    Py_ssize_t max_length = -1;
+    PyObject *retval;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "|y*n", kwlist, &data, &max_length))
+        return NULL;
+
+    ACQUIRE_LOCK(self);
+    retval = Decompressor_feed_locked(self, &data, max_length);
+    RELEASE_LOCK(self);
+    return retval;
+}
+
+static PyObject *Decompressor_get_needs_input(DecompressorObject *self, void *closure)
+{
+    int needs_input;
+
+    ACQUIRE_LOCK(self);
+    needs_input = !self->eof && self->input_len == 0 && self->d.match_left == 0;
+    RELEASE_LOCK(self);
+    return PyBool_FromLong(needs_input);
+}
+
+static PyMethodDef Decompressor_methods[] = {
+    {"feed", (PyCFunction)Decompressor_feed, METH_VARARGS | METH_KEYWORDS, NULL},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyMemberDef Decompressor_members[] = {
+    {"eof", T_BOOL, offsetof(DecompressorObject, eof), READONLY, NULL},
+    {"unused_data", T_OBJECT_EX, offsetof(DecompressorObject, unused_data), READONLY, NULL},
+    {"total_out", T_PYSSIZET, offsetof(DecompressorObject, total_out), READONLY, NULL},
+    {NULL}
+};
+
+static PyGetSetDef Decompressor_getset[] = {
+    {"needs_input", (getter)Decompressor_get_needs_input, NULL, NULL, NULL},
+    {NULL, NULL, NULL, NULL, NULL}
+};
+
+static PyTypeObject DecompressorType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "tbxi.fast_lzss.LZSSDecompressor",
+    .tp_basicsize = sizeof(DecompressorObject),
+    .tp_dealloc = (destructor)Decompressor_dealloc,
+    .tp_flags = Py_TPFLAGS_DEFAULT,
+    .tp_methods = Decompressor_methods,
+    .tp_members = Decompressor_members,
+    .tp_getset = Decompressor_getset,
+    .tp_init = (initproc)Decompressor_init,
+    .tp_new = Decompressor_new,
+};
+
 static PyMethodDef module_methods[] = {
     {"compress", wrap_compress, METH_VARARGS, NULL},
+    {"compress_fast", wrap_compress_fast, METH_VARARGS, NULL},
+    {"compress_many", wrap_compress_many, METH_O, NULL},
+    {"compress_optimal", wrap_compress_optimal, METH_VARARGS, NULL},
+    {"decompress", (PyCFunction)wrap_decompress, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"decompress_into", (PyCFunction)wrap_decompress_into, METH_VARARGS | METH_KEYWORDS, NULL},
+    {"pack_tokens", wrap_pack_tokens, METH_O, NULL},
     {NULL, NULL, 0, NULL}
 };
 
@@ -366,5 +1720,28 @@ static struct PyModuleDef this_module = {
 
 PyMODINIT_FUNC PyInit_fast_lzss(void)
 {
-    return PyModule_Create(&this_module);
+    PyObject *m;
+
+    if (PyType_Ready(&EncoderType) < 0 || PyType_Ready(&DecompressorType) < 0)
+        return NULL;
+
+    m = PyModule_Create(&this_module);
+    if (m == NULL)
+        return NULL;
+
+    Py_INCREF(&EncoderType);
+    if (PyModule_AddObject(m, "Encoder", (PyObject *)&EncoderType) < 0) {
+        Py_DECREF(&EncoderType);
+        Py_DECREF(m);
+        return NULL;
+    }
+
+    Py_INCREF(&DecompressorType);
+    if (PyModule_AddObject(m, "LZSSDecompressor", (PyObject *)&DecompressorType) < 0) {
+        Py_DECREF(&DecompressorType);
+        Py_DECREF(m);
+        return NULL;
+    }
+
+    return m;
 }
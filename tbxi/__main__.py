@@ -8,10 +8,30 @@ from os import path
 import shutil
 import macresources
 
-from .slow_lzss import decompress
-
 from . import dispatcher
 from . import binhex
+from . import cache
+from . import lzss
+
+
+# Turns the cache on without --cache, and says where to keep it
+CACHE_ENV = 'TBXI_CACHE_DIR'
+
+
+def add_cache_arguments(parser, what):
+    parser.add_argument('--cache', action='store_true', help='keep %s data between runs, in $%s or else %s (default: off)' % (what, CACHE_ENV, cache.default_directory()))
+    parser.add_argument('--cache-dir', metavar='<dir>', help='keep %s data between runs in <dir>' % what)
+    parser.add_argument('--no-cache', action='store_true', help='do not use the cache, even if $%s is set' % CACHE_ENV)
+
+
+def cache_directory(args):
+    # The cache is off unless asked for, so that nothing is written to the
+    # user's cache directory unexpectedly
+    if args.no_cache: return None
+    if args.cache_dir: return args.cache_dir
+    if os.environ.get(CACHE_ENV): return os.environ[CACHE_ENV]
+    if args.cache: return cache.default_directory()
+    return None
 
 
 def main(args=None):
@@ -48,21 +68,29 @@ def main(args=None):
     if command == 'dump':
         parser.add_argument('file', metavar='<input-file>', help='original file')
         parser.add_argument('-o', dest='output', metavar='<output-file>', help='destination (default: <input-file>.src)')
+        add_cache_arguments(parser, 'decompressed')
+        parser.add_argument('--update', action='store_true', help='dump into the existing output, writing only the files that changed')
+        parser.add_argument('-j', dest='jobs', metavar='<n>', type=int, default=os.cpu_count() or 1, help='number of threads to decode and decompress with (default: %(default)s)')
         args = parser.parse_args(args)
 
+        if args.jobs < 1: parser.error('-j must be at least 1')
+        dispatcher.threads = args.jobs
+
         if not args.output: args.output = args.file + '.src'
 
+        cache.directory = cache_directory(args)
+
         with open(args.file, 'rb') as f:
-            try:
-                shutil.rmtree(args.output)
-            except FileNotFoundError:
-                pass
+            if not args.update:
+                try:
+                    shutil.rmtree(args.output)
+                except FileNotFoundError:
+                    pass
 
             base, ext = path.splitext(args.file)
             if ext.lower() == '.hqx':
-                hb = binhex.HexBin(f)
-                data = hb.read()
-                rsrc = list(macresources.parse_file(hb.read_rsrc()))
+                fname, finfo, data, rsrc = binhex.hexbin_forks(f, args.jobs)
+                rsrc = list(macresources.parse_file(rsrc))
 
             else:
                 data = f.read()
@@ -84,16 +112,41 @@ def main(args=None):
 
             tpl = (data, rsrc)
 
-            dispatcher.dump(tpl, args.output, toplevel=True)
+            if args.update:
+                dispatcher.dump_update(tpl, args.output, toplevel=True)
+                print('update: %d written, %d unchanged, %d removed' % (dispatcher.files_written, dispatcher.files_unchanged, dispatcher.files_removed), file=sys.stderr)
+            else:
+                dispatcher.dump(tpl, args.output, toplevel=True)
 
     elif command == 'build':
         parser.add_argument('dir', metavar='<input-dir>', help='source directory')
         parser.add_argument('-o', dest='output', metavar='<output-file>', help='destination (default: Mac OS ROM)')
+        add_cache_arguments(parser, 'compressed and built')
+        parser.add_argument('--rebuild', action='store_true', help='ignore cached results, but refresh them')
+        parser.add_argument('-j', dest='jobs', metavar='<n>', type=int, default=os.cpu_count() or 1, help='number of threads to build and compress with (default: %(default)s)')
+        parser.add_argument('--lzss-mode', choices=['canonical', 'fast', 'optimal'], default='canonical', help='"fast" is quicker and "optimal" smaller, but neither matches the original (default: canonical)')
         args = parser.parse_args(args)
 
+        if args.jobs < 1: parser.error('-j must be at least 1')
+        dispatcher.threads = args.jobs
+        lzss.default_mode = args.lzss_mode
+
+        if args.lzss_mode == 'fast':
+            print('lzss-mode %s: DRAFT BUILD, NOT FOR RELEASE' % args.lzss_mode, file=sys.stderr)
+
         if not args.output: args.output = 'Mac OS ROM'
 
-        data = dispatcher.build(args.dir)
+        cache.directory = cache_directory(args)
+
+        dispatcher.rebuild = args.rebuild
+
+        data = dispatcher.build_tree(args.dir)
+
+        if cache.directory is not None:
+            print('cache: %d hits, %d misses' % (dispatcher.cache_hits, dispatcher.cache_misses), file=sys.stderr)
+
+        if args.lzss_mode == 'optimal':
+            print('lzss-mode optimal: saved %d bytes against canonical' % lzss.optimal_saved, file=sys.stderr)
 
         if isinstance(data, tuple):
             data, rsrc = data # unpack the resource list from the data fork
@@ -26,8 +26,11 @@ hexbin(inputfilename, outputfilename)
 # Modified to use a project-local alternative to `binascii` instead.
 #
 import io
+import itertools
+import mmap
 import os
 import struct
+from concurrent.futures import ThreadPoolExecutor
 
 from . import hqx
 
@@ -43,6 +46,7 @@ _DID_DATA = 1
 # Various constants
 REASONABLY_LARGE = 32768  # Minimal amount we pass the rle-coder
 LINELEN = 64
+HQX_CHUNK = 0x100000 # Characters per thread in hexbin_forks
 RUNCHAR = b"\x90"
 
 #
@@ -86,35 +90,38 @@ class _Hqxcoderengine:
 
     def __init__(self, ofp):
         self.ofp = ofp
-        self.data = b''
-        self.hqxdata = b''
+        self.data = bytearray()
+        self.hqxdata = bytearray()
         self.linelen = LINELEN - 1
 
     def write(self, data):
-        self.data = self.data + data
-        datalen = len(self.data)
-        todo = (datalen // 3) * 3
-        data = self.data[:todo]
-        self.data = self.data[todo:]
-        if not data:
+        self.data += data
+        todo = (len(self.data) // 3) * 3
+        if not todo:
             return
-        self.hqxdata = self.hqxdata + hqx.b2a(data)
+        self.hqxdata += hqx.b2a(self.data[:todo])
+        del self.data[:todo]
         self._flush(0)
 
     def _flush(self, force):
+        # Write all the complete lines at once
         first = 0
+        lines = []
         while first <= len(self.hqxdata) - self.linelen:
             last = first + self.linelen
-            self.ofp.write(self.hqxdata[first:last] + b'\n')
+            lines.append(self.hqxdata[first:last])
             self.linelen = LINELEN
             first = last
-        self.hqxdata = self.hqxdata[first:]
+        if lines:
+            lines.append(b'')
+            self.ofp.write(b'\n'.join(lines))
+        del self.hqxdata[:first]
         if force:
             self.ofp.write(self.hqxdata + b':\n')
 
     def close(self):
         if self.data:
-            self.hqxdata = self.hqxdata + hqx.b2a(self.data)
+            self.hqxdata += hqx.b2a(self.data)
         self._flush(1)
         self.ofp.close()
         del self.ofp
@@ -124,15 +131,15 @@ class _Rlecoderengine:
 
     def __init__(self, ofp):
         self.ofp = ofp
-        self.data = b''
+        self.data = bytearray()
 
     def write(self, data):
-        self.data = self.data + data
+        self.data += data
         if len(self.data) < REASONABLY_LARGE:
             return
         rledata = hqx.rle_encode(self.data)
         self.ofp.write(rledata)
-        self.data = b''
+        self.data = bytearray()
 
     def close(self):
         if self.data:
@@ -261,93 +268,95 @@ class _Hqxdecoderengine:
 
     def __init__(self, ifp):
         self.ifp = ifp
-        self.eof = 0
+        self.done = 0 # seen the closing colon
+        self.hqxdata = bytearray() # less than one 4-character group
+        self.decdata = bytearray() # decoded but not yet read
 
-    def read(self, totalwtd):
-        """Read at least wtd bytes (or until EOF)"""
-        decdata = b''
-        wtd = totalwtd
-        #
-        # The loop here is convoluted, since we don't really now how
-        # much to decode: there may be newlines in the incoming data.
-        while wtd > 0:
-            if self.eof: return decdata
-            wtd = ((wtd + 2) // 3) * 4
-            data = self.ifp.read(wtd)
-            #
-            # Next problem: there may not be a complete number of
-            # bytes in what we pass to a2b. Solve by yet another
-            # loop.
-            #
-            while True:
-                try:
-                    decdatacur, self.eof = hqx.a2b(data)
-                    break
-                except hqx.Incomplete:
-                    pass
-                newdata = self.ifp.read(1)
-                if not newdata:
+    @property
+    def eof(self):
+        return self.done and not self.decdata
+
+    def read(self, wtd):
+        """Read wtd bytes (or until EOF)"""
+        while len(self.decdata) < wtd and not self.done:
+            # There may be newlines in the incoming data, so this is a guess
+            data = self.ifp.read(max(((wtd - len(self.decdata) + 2) // 3) * 4, REASONABLY_LARGE))
+            if not data:
+                if self.hqxdata or not self.decdata:
                     raise Error('Premature EOF on binhex file')
-                data = data + newdata
-            decdata = decdata + decdatacur
-            wtd = totalwtd - len(decdata)
-            if not decdata and not self.eof:
-                raise Error('Premature EOF on binhex file')
-        return decdata
+                break
+
+            colon = data.find(b':')
+            if colon >= 0:
+                data = data[:colon + 1]
+            self.hqxdata += data.translate(None, b'\r\n')
+
+            if colon >= 0:
+                decdatacur, self.done = hqx.a2b(self.hqxdata)
+                self.hqxdata = bytearray()
+            else:
+                # Decode only whole 4-character groups
+                todo = (len(self.hqxdata) // 4) * 4
+                decdatacur, self.done = hqx.a2b(self.hqxdata[:todo])
+                del self.hqxdata[:todo]
+            self.decdata += decdatacur
+
+        rv = bytes(self.decdata[:wtd])
+        del self.decdata[:wtd]
+        return rv
 
     def close(self):
         self.ifp.close()
 
+def _rle_mark(buf):
+    """How much of buf can be RLE-decoded without orphaning a RUNCHAR"""
+    # The buffer starts on a code boundary, and any byte other than RUNCHAR
+    # ends a code, so a trailing string of RUNCHARs is made of RUNCHAR
+    # RUNCHAR pairs (a run of 0x90 repeats) plus, if there are an odd
+    # number, a RUNCHAR still waiting for its count.
+    return len(buf) - (len(buf) - len(buf.rstrip(RUNCHAR))) % 2
+
+def _rle_decode_after(lastbyte, data):
+    """RLE-decode data that follows lastbyte (None at the start)"""
+    # A repeat count at the start of data refers to the last byte decoded,
+    # so put that byte back (escaped if need be) and drop it
+    if lastbyte is None:
+        return hqx.rle_decode(data)
+    elif lastbyte == RUNCHAR[0]:
+        return hqx.rle_decode(RUNCHAR + b'\0' + data)[1:]
+    else:
+        return hqx.rle_decode(bytes([lastbyte]) + data)[1:]
+
 class _Rledecoderengine:
     """Read data via the RLE-coder"""
 
     def __init__(self, ifp):
         self.ifp = ifp
-        self.pre_buffer = b''
-        self.post_buffer = b''
+        self.pre_buffer = bytearray()
+        self.post_buffer = bytearray()
+        self.lastbyte = None
         self.eof = 0
 
     def read(self, wtd):
-        if wtd > len(self.post_buffer):
+        while wtd > len(self.post_buffer) and not self.eof:
             self._fill(wtd - len(self.post_buffer))
-        rv = self.post_buffer[:wtd]
-        self.post_buffer = self.post_buffer[wtd:]
+        rv = bytes(self.post_buffer[:wtd])
+        del self.post_buffer[:wtd]
         return rv
 
     def _fill(self, wtd):
-        self.pre_buffer = self.pre_buffer + self.ifp.read(wtd + 4)
+        self.pre_buffer += self.ifp.read(max(wtd + 4, REASONABLY_LARGE))
         if self.ifp.eof:
-            self.post_buffer = self.post_buffer + \
-                hqx.rle_decode(self.pre_buffer)
-            self.pre_buffer = b''
-            return
-
-        #
-        # Obfuscated code ahead. We have to take care that we don't
-        # end up with an orphaned RUNCHAR later on. So, we keep a couple
-        # of bytes in the buffer, depending on what the end of
-        # the buffer looks like:
-        # '\220\0\220' - Keep 3 bytes: repeated \220 (escaped as \220\0)
-        # '?\220' - Keep 2 bytes: repeated something-else
-        # '\220\0' - Escaped \220: Keep 2 bytes.
-        # '?\220?' - Complete repeat sequence: decode all
-        # otherwise: keep 1 byte.
-        #
-        mark = len(self.pre_buffer)
-        if self.pre_buffer[-3:] == RUNCHAR + b'\0' + RUNCHAR:
-            mark = mark - 3
-        elif self.pre_buffer[-1:] == RUNCHAR:
-            mark = mark - 2
-        elif self.pre_buffer[-2:] == RUNCHAR + b'\0':
-            mark = mark - 2
-        elif self.pre_buffer[-2:-1] == RUNCHAR:
-            pass # Decode all
+            mark = len(self.pre_buffer)
+            self.eof = 1
         else:
-            mark = mark - 1
+            mark = _rle_mark(self.pre_buffer)
 
-        self.post_buffer = self.post_buffer + \
-            hqx.rle_decode(self.pre_buffer[:mark])
-        self.pre_buffer = self.pre_buffer[mark:]
+        decdata = _rle_decode_after(self.lastbyte, self.pre_buffer[:mark])
+        del self.pre_buffer[:mark]
+        if decdata:
+            self.lastbyte = decdata[-1]
+            self.post_buffer += decdata
 
     def close(self):
         self.ifp.close()
@@ -418,9 +427,9 @@ class HexBin:
             n = min(n, self.dlen)
         else:
             n = self.dlen
-        rv = b''
-        while len(rv) < n:
-            rv = rv + self._read(n-len(rv))
+        rv = self._read(n)
+        if len(rv) < n:
+            raise Error('Premature EOF on binhex file')
         self.dlen = self.dlen - n
         return rv
 
@@ -456,6 +465,115 @@ class HexBin:
             self.state = None
             self.ifp.close()
 
+def hexbin_forks(ifp, threads=None):
+    """Decode a whole binhex file at once: (FName, FInfo, data, rsrc)
+
+    The file is memory-mapped, the 6-bit text is decoded in parallel in
+    whole 4-character groups, and the RLE stage follows the decoded chunks
+    in order. Anything unusual is left to the HexBin class, so the result
+    is always what HexBin.read() and read_rsrc() would give.
+    """
+    if isinstance(ifp, str):
+        with io.open(ifp, 'rb') as f:
+            return hexbin_forks(f, threads)
+
+    if threads is None: threads = os.cpu_count() or 1
+
+    try:
+        with mmap.mmap(ifp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _hexbin_forks_mmap(mm, threads)
+    except (Error, hqx.Incomplete, KeyError, ValueError, OSError, struct.error):
+        pass
+
+    ifp.seek(0)
+    hb = HexBin(ifp)
+    data = hb.read()
+    rsrc = hb.read_rsrc()
+    return hb.FName, hb.FInfo, data, rsrc
+
+def _hexbin_forks_mmap(mm, threads):
+    start = mm.find(b':')
+    end = mm.find(b':', start + 1)
+    if start < 0 or end < 0:
+        raise Error('No binhex data found')
+
+    # Each chunk of the file is stripped of line breaks by its own worker,
+    # so the 4-character groups are counted first to find where they fall
+    chunks = [(i, min(i + HQX_CHUNK, end)) for i in range(start + 1, end, HQX_CHUNK)]
+
+    def strip(chunk):
+        return mm[chunk[0]:chunk[1]].translate(None, b'\r\n')
+
+    def length(chunk):
+        raw = mm[chunk[0]:chunk[1]]
+        return len(raw) - raw.count(b'\r') - raw.count(b'\n')
+
+    def a2b(chunk, skip):
+        # Leave the first characters to finish the group before the chunk,
+        # and the last to start the group after it
+        text = strip(chunk)
+        n = max(skip, skip + (len(text) - skip) // 4 * 4)
+        decdata, done = hqx.a2b(memoryview(text)[skip:n])
+        return text[:skip], decdata, text[n:]
+
+    decoded = bytearray()
+    pre_buffer = b''
+    lastbyte = None
+
+    def rle(decdata):
+        nonlocal pre_buffer, lastbyte
+        pre_buffer += decdata
+        mark = _rle_mark(pre_buffer)
+        rledata = _rle_decode_after(lastbyte, pre_buffer[:mark])
+        pre_buffer = pre_buffer[mark:]
+        if rledata:
+            lastbyte = rledata[-1]
+            decoded.extend(rledata)
+
+    with ThreadPoolExecutor(threads) as pool:
+        lengths = list(pool.map(length, chunks))
+        skips = [-n % 4 for n in itertools.accumulate([0] + lengths[:-1])]
+
+        pending = b''
+        for head, decdata, tail in pool.map(a2b, chunks, skips):
+            pending += head
+            n = len(pending) // 4 * 4
+            rle(hqx.a2b(pending[:n])[0])
+            pending = pending[n:]
+            rle(decdata)
+            pending += tail
+        rle(hqx.a2b(pending + b':')[0])
+        decoded += _rle_decode_after(lastbyte, pre_buffer)
+
+        # The header, then each fork, is followed by its CRC
+        nl = decoded[0] if decoded else 0
+        hdrlen = 1 + nl + 1 + 4 + 4 + 2 + 4 + 4
+        type, creator, flags, dlen, rlen = struct.unpack_from('>4s4shll', decoded, 1 + nl + 1)
+        if dlen < 0 or rlen < 0:
+            raise Error('Negative fork length')
+
+        parts = [(0, hdrlen), (hdrlen + 2, dlen), (hdrlen + 2 + dlen + 2, rlen)]
+        if hdrlen + 2 + dlen + 2 + rlen + 2 > len(decoded):
+            raise Error('Premature EOF on binhex file')
+
+        def checkcrc(part):
+            at, n = part
+            filecrc = struct.unpack_from('>H', decoded, at + n)[0]
+            return hqx.crc(memoryview(decoded)[at:at+n], 0) == filecrc
+
+        if not all(pool.map(checkcrc, parts)):
+            raise Error('CRC error')
+
+    finfo = FInfo()
+    finfo.Creator = creator
+    finfo.Type = type
+    finfo.Flags = flags
+
+    fname = bytes(decoded[1:1+nl])
+    data = bytes(decoded[hdrlen+2:hdrlen+2+dlen])
+    rsrc = bytes(decoded[hdrlen+2+dlen+2:hdrlen+2+dlen+2+rlen])
+    return fname, finfo, data, rsrc
+
 def hexbin(inp, out):
     """hexbin(infilename, outfilename) - Decode binhexed file"""
     ifp = HexBin(inp)
@@ -4,15 +4,16 @@ import zlib
 import sys
 import macresources
 
-try:
-    from .fast_lzss import compress
-except ImportError:
-    from .slow_lzss import compress
+from .lzss import compress
 
 from . import dispatcher
 from . import cfrg_rsrc
 
 
+# The file that marks a directory as this format
+SIGNATURE = 'Bootscript'
+
+
 def append_checksum(binary):
     cksum = ('\r\\ h# %08X' % zlib.adler32(binary)).encode('ascii')
     binary.extend(cksum)
@@ -38,6 +39,32 @@ def edit_bootscript_for_elf(script, tramp):
     return script
 
 
+def pack_image(data):
+    # Parcels go in as they are, and an old-style MacROM gets compressed
+    if data.startswith(b'prcl'): return data
+
+    return compress(data)
+
+
+def deps(src):
+    try:
+        with open(path.join(src, 'Bootscript'), 'rb') as f:
+            script = f.read()
+    except (NotADirectoryError, FileNotFoundError):
+        raise dispatcher.WrongFormat
+
+    found = [(path.join(src, 'MacOS.elf'), None)]
+
+    if re.search(rb'constant\s+(lzss|parcels)-offset', script):
+        for attempt in ['MacROM', 'Parcels']:
+            p = path.join(src, attempt)
+            if path.exists(p) or path.exists(p + '.src'):
+                found.append((p, pack_image))
+                break
+
+    return found
+
+
 def build(src):
     try:
         with open(path.join(src, 'Bootscript'), 'rb') as f:
@@ -88,8 +115,8 @@ def build(src):
         else:
             raise FileNotFoundError
 
-        if not data.startswith(b'prcl'): data = compress(data)
-        booter.extend(data)
+        booter.extend(dispatcher.derive(pack_image, data))
+        del data
 
         constants[base + '-size'] = len(booter) - constants[base + '-offset']
 
@@ -4,13 +4,18 @@ import re
 import sys
 import macresources
 
-from .slow_lzss import decompress
+from .lzss import decompress_cached
 
 from . import dispatcher
 from . import cfrg_rsrc
 
 
 # Special case: expects a (data, resource_list) tuple
+def sniff(binary):
+    if not isinstance(binary, tuple): return 0
+    return 1.0 if binary[0].startswith(b'<CHRP-BOOT>') else 0
+
+
 def dump(binary, dest_dir):
     if not isinstance(binary, tuple): raise dispatcher.WrongFormat
     binary, rsrc = binary
@@ -36,24 +41,27 @@ def dump(binary, dest_dir):
             for i in range(*m.span(1)):
                 chrp_boot_zeroed[i:i+1] = b'0'
 
-    with open(path.join(dest_dir, 'Bootscript'), 'wb') as f:
-        f.write(chrp_boot_zeroed)
+    dispatcher.write(path.join(dest_dir, 'Bootscript'), chrp_boot_zeroed)
 
+    jobs = []
     if 'elf-offset' in constants:
         elf = binary[constants['elf-offset']:][:constants['elf-size']]
-        dispatcher.dump(elf, path.join(dest_dir, 'MacOS.elf'))
+        jobs.append((elf, path.join(dest_dir, 'MacOS.elf')))
 
     other_offset = constants.get('lzss-offset', constants.get('parcels-offset'))
     other_size = constants.get('lzss-size', constants.get('parcels-size'))
-    parcels = binary[other_offset:][:other_size]
+    parcels = memoryview(binary)[other_offset:][:other_size]
 
-    if parcels.startswith(b'prcl'):
-        filename = 'Parcels'
+    if parcels[:4] == b'prcl':
+        jobs.append((bytes(parcels), path.join(dest_dir, 'Parcels')))
     else:
-        filename = 'MacROM'
-        parcels = decompress(parcels)
+        # One decompressed copy serves the file, the cache and the recursion
+        rom_path = path.join(dest_dir, 'MacROM')
+        rom = decompress_cached(parcels)
+        dispatcher.write(rom_path, rom)
+        jobs.append((rom, rom_path + '.src', True))
 
-    dispatcher.dump(parcels, path.join(dest_dir, filename))
+    dispatcher.dump_many(jobs)
 
     # Lastly, dump the System Enabler (if present and rsrc fork not stripped)
     if rsrc:
@@ -64,14 +72,9 @@ def dump(binary, dest_dir):
         for c in cfrgs:
             c.data = cfrg_rsrc.adjust_dfrkoffset_fields(c.data, -start)
 
-        with open(path.join(dest_dir, 'SysEnabler'), 'wb') as f:
-            f.write(binary[start:stop])
-
-        with open(path.join(dest_dir, 'SysEnabler.rdump'), 'wb') as f:
-            f.write(macresources.make_rez_code(rsrc, ascii_clean=True))
-
-        with open(path.join(dest_dir, 'SysEnabler.idump'), 'wb') as f:
-            f.write(b'gblyMACS')
+        dispatcher.write(path.join(dest_dir, 'SysEnabler'), binary[start:stop])
+        dispatcher.write(path.join(dest_dir, 'SysEnabler.rdump'), macresources.make_rez_code(rsrc, ascii_clean=True))
+        dispatcher.write(path.join(dest_dir, 'SysEnabler.idump'), b'gblyMACS')
 
     elif b'Joy!' in binary[other_offset+other_size:]:
         print('Resource fork missing, ignoring orphaned data fork PEFs', file=sys.stderr)
@@ -0,0 +1,152 @@
+import os
+from os import path
+import sys
+import hashlib
+import tempfile
+import threading
+
+
+# None disables the cache. The command line tool sets this, not the library.
+directory = None
+
+# Least recently used entries are evicted to keep the cache under this size
+max_size = 512 * 1024 * 1024
+
+# Total size of the entries in _size_dir: counted once, then kept up to date
+_size = None
+_size_dir = None
+_lock = threading.Lock()
+
+
+def default_directory():
+    if sys.platform == 'darwin':
+        base = path.expanduser('~/Library/Caches')
+    elif os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or path.expanduser('~')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or path.expanduser('~/.cache')
+
+    return path.join(base, 'tbxi')
+
+
+def key(*parts):
+    """Hash some strings and bytes-like objects into a cache key
+    """
+
+    h = hashlib.sha256()
+    for p in parts:
+        if isinstance(p, str): p = p.encode('utf-8')
+        p = memoryview(p).cast('B')
+        h.update(b'%d:' % len(p))
+        h.update(p)
+    return h.hexdigest()
+
+
+def _path(k):
+    return path.join(directory, k[:2], k[2:])
+
+
+def load(k):
+    """Return the bytes stored under a key, or None
+    """
+
+    if directory is None: return None
+
+    try:
+        with open(_path(k), 'rb') as f:
+            data = f.read()
+        os.utime(_path(k)) # mark as recently used
+    except OSError:
+        return None
+
+    return data
+
+
+def store(k, data):
+    global _size
+
+    if directory is None: return
+
+    with _lock:
+        _total() # before this entry is on disk
+
+    dest = _path(k)
+    try:
+        os.makedirs(path.dirname(dest), exist_ok=True)
+
+        try:
+            old_size = os.stat(dest).st_size
+        except OSError:
+            old_size = 0
+
+        fd, tmp = tempfile.mkstemp(dir=path.dirname(dest), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, dest)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+    except OSError:
+        return # a cache that cannot be written is no cache at all
+
+    with _lock:
+        total = _size = _total() + len(data) - old_size
+
+    # Leave some room, so that the next few stores do not walk the cache again
+    if total > max_size:
+        evict(max_size - max_size // 8)
+
+
+def _entries():
+    entries = []
+    for parent, dirs, files in os.walk(directory):
+        for name in files:
+            if name.startswith('.tmp-'): continue
+            p = path.join(parent, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+    return entries
+
+
+def _total():
+    # Call with _lock held
+    global _size, _size_dir
+
+    if _size is None or _size_dir != directory:
+        _size = sum(size for (mtime, size, p) in _entries())
+        _size_dir = directory
+    return _size
+
+
+def evict(limit=None):
+    """Delete the least recently used entries until the cache fits in limit
+    """
+
+    global _size, _size_dir
+
+    if directory is None: return
+    if limit is None: limit = max_size
+
+    # One thread at a time, each seeing what the last one left
+    with _lock:
+        entries = _entries()
+        total = sum(size for (mtime, size, p) in entries)
+
+        entries.sort()
+        for mtime, size, p in entries:
+            if total <= limit: break
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            total -= size
+
+        _size = total
+        _size_dir = directory
@@ -1,8 +1,16 @@
 import importlib
+import locale
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from warnings import warn
 
 import os
 from os import path
 
+from . import cache
+from . import lzss
+
 
 FORMATS = '''
     bootinfo
@@ -12,25 +20,169 @@ FORMATS = '''
 '''.split()
 
 
+# Other packages can add formats under this entry point group. Each entry
+# point names a module with sniff() and dump(), and optionally build() and
+# SIGNATURE, which work like those of the built-in formats.
+ENTRY_POINT_GROUP = 'tbxi.formats'
+
+_plugins = None
+
+# Left in each dumped directory to say which format built it
+MARKER = '.tbxi-format'
+
+# run_all() uses this many threads in all, however deeply it is nested
+threads = os.cpu_count() or 1
+
+# The workers that every run_all() shares, besides the threads calling it
+_pool = None
+_pool_size = 0
+_pool_lock = threading.Lock()
+
+# Format names held back by collect(), to be printed in order
+_local = threading.local()
+
+# Build everything, but still refresh the cached results
+rebuild = False
+
+# build() results found in and missing from the cache
+cache_hits = 0
+cache_misses = 0
+
+# Under dump_update(): the files that the dump made, and what it did to them
+_written = None
+_written_lock = threading.Lock()
+files_written = 0
+files_unchanged = 0
+files_removed = 0
+
+# Hash of the code that builds, worked out once: see _code_key()
+_code = None
+
+# While build_tree() runs: results by key, shared between threads
+_memo = None
+_memo_lock = threading.Lock()
+
+# Which unfinished keys are waiting for which others, to catch loops
+_waits = {}
+
+
 class WrongFormat(Exception):
     pass
 
 
-def build_dir(p):
+class CycleError(Exception):
+    """A source tree that names something it is itself a part of"""
+
+
+def plugins():
+    global _plugins
+
+    if _plugins is None:
+        from importlib.metadata import entry_points
+
+        eps = entry_points()
+        if hasattr(eps, 'select'):
+            eps = eps.select(group=ENTRY_POINT_GROUP)
+        else:
+            eps = eps.get(ENTRY_POINT_GROUP, [])
+
+        _plugins = {}
+        for ep in eps:
+            if ep.name in FORMATS: continue
+            try:
+                _plugins[ep.name] = ep.load()
+            except Exception as e:
+                warn('Could not load tbxi format %r: %s' % (ep.name, e))
+
+    return _plugins
+
+
+def register(name, module):
+    """Add a format by hand, as the entry point would
+    """
+
+    plugins()[name] = module
+
+
+def formats(kind):
+    """Yield (name, module) for each format that can dump or build
+    """
+
     for fmt in FORMATS:
-        mod = importlib.import_module('..%s_build' % fmt, __name__)
+        yield fmt, importlib.import_module('..%s_%s' % (fmt, kind), __name__)
+
+    for fmt, mod in plugins().items():
+        if hasattr(mod, kind):
+            yield fmt, mod
+
+
+def _strip_rsrc(fmt, binary):
+    if isinstance(binary, tuple) and fmt != 'bootinfo': binary = binary[0] # strip found resource fork
+    return binary
+
+
+def sniff(binary):
+    """List the (name, module) of formats that might fit, most likely first
+
+    Each sniff() returns a confidence between 0 (no) and 1 (a magic number),
+    and must be cheap: no copying, and only bounded scans.
+    """
+
+    ranked = []
+    for i, (fmt, mod) in enumerate(formats('dump')):
+        confidence = mod.sniff(_strip_rsrc(fmt, binary))
+        if confidence > 0:
+            ranked.append((-confidence, i, fmt, mod))
+
+    ranked.sort(key=lambda r: r[:2])
+    return [(fmt, mod) for (negconf, i, fmt, mod) in ranked]
+
+
+def resolve(p):
+    """List the (name, module) of formats that might build the directory p,
+    from its marker file or its listing, without trying any of them
+
+    Formats without a SIGNATURE file have to be tried regardless.
+    """
+
+    try:
+        with os.scandir(p) as it:
+            names = {entry.name for entry in it}
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+    marked = None
+    if MARKER in names:
+        try:
+            with open(path.join(p, MARKER)) as f:
+                marked = f.read().strip()
+        except OSError:
+            pass
+
+    found = []
+    for fmt, mod in formats('build'):
+        sig = getattr(mod, 'SIGNATURE', None)
+        if fmt == marked:
+            found.insert(0, (fmt, mod))
+        elif sig is None or sig in names:
+            found.append((fmt, mod))
+    return found
+
+
+def build_dir(p):
+    for fmt, mod in resolve(p):
         try:
             data = mod.build(p)
         except WrongFormat:
             continue
 
-        print(fmt)
+        report(fmt)
         return data
 
     raise WrongFormat
 
 
-def build(p):
+def _build(p):
     parent = path.dirname(path.abspath(p))
     name = path.basename(path.abspath(p))
 
@@ -50,20 +202,476 @@ def build(p):
     return data
 
 
+def build(p):
+    return _once(('build', path.realpath(p)), _build_cached, p)
+
+
+def _build_cached(p):
+    global cache_hits, cache_misses
+
+    # Only results built from a directory are worth keeping
+    k = None
+    if cache.directory is not None and (path.isdir(p + '.src') or path.isdir(p)):
+        k = tree_key(p)
+        entry = None if rebuild else cache.load(k)
+
+        with _memo_lock:
+            if entry is None:
+                cache_misses += 1
+            else:
+                cache_hits += 1
+
+        if entry is not None:
+            log, _, data = entry.partition(b'\n')
+            for fmt in log.decode('ascii').split():
+                report(fmt)
+            return data
+
+    data, log = collect(_build, p)
+    for fmt in log:
+        report(fmt)
+
+    if k is not None and isinstance(data, bytes):
+        cache.store(k, ' '.join(log).encode('ascii') + b'\n' + data)
+
+    return data
+
+
+def _hash_input(p):
+    # Merkle hash of a file or directory: names and contents, not mtimes
+    try:
+        with os.scandir(p) as it:
+            entries = sorted((entry.name, entry.path) for entry in it)
+    except NotADirectoryError:
+        with open(p, 'rb') as f:
+            return cache.key('file', f.read())
+    except FileNotFoundError:
+        return cache.key('missing')
+
+    parts = ['dir']
+    for name, q in entries:
+        parts.append(name)
+        parts.append(_once(('input', path.realpath(q)), _hash_input, q))
+    return cache.key(*parts)
+
+
+def tree_key(p):
+    """Hash everything that build(p) reads into a cache key
+
+    That is the names and contents of p and p.src, and of anything outside
+    them that their deps() name, along with the LZSS mode and the code.
+    """
+
+    parts = ['build', _code_key(), lzss.default_mode]
+    inside = []
+    for q in [p + '.src', p]:
+        parts.append(_once(('input', path.realpath(q)), _hash_input, q))
+        inside.append(path.join(path.realpath(q), ''))
+
+    try:
+        children = deps(p)
+    except Exception:
+        children = [] # build() will raise it properly
+
+    for child, fn in children:
+        if not path.realpath(child).startswith(tuple(inside)):
+            parts.append(tree_key(child))
+
+    return cache.key(*parts)
+
+
+def _code_key():
+    # The package version and every module and extension that could build,
+    # so that a new or patched tbxi does not find the old results
+    global _code
+
+    if _code is None:
+        from importlib.machinery import EXTENSION_SUFFIXES
+        from importlib.metadata import version, PackageNotFoundError
+
+        try:
+            parts = ['code', version('tbxi')]
+        except PackageNotFoundError:
+            parts = ['code', '']
+
+        here = path.dirname(path.abspath(__file__))
+        files = [path.join(here, name) for name in sorted(os.listdir(here))
+            if name.endswith(tuple(['.py'] + EXTENSION_SUFFIXES))]
+        files.extend(getattr(mod, '__file__', None) or '' for (name, mod) in sorted(plugins().items()))
+
+        for f in files:
+            try:
+                with open(f, 'rb') as fh:
+                    parts.extend([path.basename(f), fh.read()])
+            except OSError:
+                parts.extend([path.basename(f), b''])
+
+        _code = cache.key(*parts)
+
+    return _code
+
+
+def derive(fn, data):
+    """Return fn(data), calling fn only once per build_tree() for equal data
+    """
+
+    if _memo is None: return fn(data)
+    return _once(('derive', fn, cache.key(data)), fn, data)
+
+
+def _once(key, fn, *args):
+    # Outside build_tree(), or the first to ask for this key: do the work.
+    # Otherwise wait for whoever is doing it, unless that would close a loop.
+    if _memo is None: return fn(*args)
+
+    stack = _stack()
+    parent = stack[-1] if stack else None
+
+    with _memo_lock:
+        future = _memo.get(key)
+        mine = future is None
+        if mine: future = _memo[key] = Future()
+
+        waiting = parent is not None and not future.done()
+        if waiting:
+            if _reaches(key, parent):
+                exc = CycleError('%s is part of itself' % (key[1],))
+                if mine: future.set_exception(exc)
+                raise exc
+            _waits.setdefault(parent, []).append(key)
+
+    try:
+        if mine:
+            stack.append(key)
+            try:
+                future.set_result(collect(fn, *args))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                stack.pop()
+
+        data, log = future.result()
+    finally:
+        if waiting:
+            with _memo_lock:
+                _waits[parent].remove(key)
+                if not _waits[parent]: del _waits[parent]
+
+    # Report the formats as though they were built just now
+    for fmt in log:
+        report(fmt)
+    return data
+
+
+def _stack():
+    # The unfinished keys that the work on this thread is for, innermost last
+    stack = getattr(_local, 'stack', None)
+    if stack is None: stack = _local.stack = []
+    return stack
+
+
+def _reaches(start, target):
+    # Call with _memo_lock held
+    seen = set()
+    todo = [start]
+    while todo:
+        key = todo.pop()
+        if key == target: return True
+        if key in seen: continue
+        seen.add(key)
+        todo.extend(_waits.get(key, ()))
+    return False
+
+
+def deps(p):
+    """List (path, fn) for each thing that building p will build in turn:
+    fn is None, or something that the builder will derive() from it
+
+    This is a cheap guess from the format's deps(), never a promise.
+    """
+
+    for np in [p + '.src', p]:
+        for fmt, mod in resolve(np):
+            if not hasattr(mod, 'deps'): return [] # can only find out by building
+            try:
+                return list(mod.deps(np))
+            except WrongFormat:
+                continue
+
+    return []
+
+
+def plan(p):
+    """Group the tree under p into levels that can each be built in
+    parallel, leaves first, with each path and derivation only once
+    """
+
+    heights = {}
+    nodes = {}
+
+    def visit(q, fn, stack):
+        key = path.realpath(q)
+        nodes.setdefault((key, fn), (q, fn))
+        if key in heights: return heights[key]
+        if key in stack: return 0 # a loop: build() raises CycleError
+
+        try:
+            children = deps(q)
+        except Exception:
+            children = [] # build() will raise it properly
+
+        height = 0
+        for child, childfn in children:
+            height = max(height, visit(child, childfn, stack | {key}) + 1)
+        heights[key] = height
+        return height
+
+    visit(p, None, frozenset())
+
+    levels = [[] for _ in range(max(heights.values()) + 1)]
+    for (key, fn), node in nodes.items():
+        levels[heights[key]].append(node)
+    return levels
+
+
+def _prebuild(node):
+    q, fn = node
+    try:
+        data, log = collect(build, q) # the parent reports these when it asks
+        if fn is not None: derive(fn, data)
+    except Exception:
+        pass # raised again if the parent asks for it
+
+
+def build_tree(p):
+    """Build p as build() would, but plan the whole tree first and build it
+    from the leaves up on a pool of threads, each path only once
+
+    The parents then find their children already built, and only have to
+    lay them out. The result and the printed formats are the same.
+    """
+
+    global _memo
+
+    saved = _memo
+    _memo = {}
+    try:
+        levels = plan(p)
+        for level in levels[:-1]:
+            run_all(_prebuild, level)
+        return build(p)
+    finally:
+        _memo = saved
+
+
 def dump(binary, dest_path, toplevel=False):
     if not toplevel:
-        with open(dest_path, 'wb') as f:
-            f.write(binary)
+        write(dest_path, binary)
 
         dest_path += '.src'
 
-    for fmt in FORMATS:
-        mod = importlib.import_module('..%s_dump' % fmt, __name__)
+    # A format that sniffs positively can still turn out to be wrong
+    for fmt, mod in sniff(binary):
         try:
-            arg = binary
-            if isinstance(arg, tuple) and fmt != 'bootinfo': arg = arg[0] # strip found resource fork
-            mod.dump(arg, dest_path)
-            print(fmt)
-            break
+            mod.dump(_strip_rsrc(fmt, binary), dest_path)
         except WrongFormat:
+            continue
+
+        if path.isdir(dest_path):
+            write(path.join(dest_path, MARKER), fmt + '\n')
+        report(fmt)
+        break
+
+
+def dump_update(binary, dest_path, toplevel=False):
+    """Dump as dump() would, but into whatever is already at dest_path
+
+    Only the files that differ are written, and then the files that the
+    dump no longer makes are deleted.
+    """
+
+    global _written
+
+    _written = set()
+    try:
+        dump(binary, dest_path, toplevel)
+        _prune(dest_path if toplevel else dest_path + '.src')
+    finally:
+        _written = None
+
+
+def write(p, data):
+    """Write a file for a dump, from bytes or from text
+
+    Under dump_update(), a file that already holds the same data is left
+    alone, and any other is replaced atomically.
+    """
+
+    global files_written, files_unchanged
+
+    if isinstance(data, str):
+        data = data.replace('\n', os.linesep).encode(locale.getpreferredencoding(False))
+
+    if _written is None:
+        with open(p, 'wb') as f:
+            f.write(data)
+        return
+
+    with _written_lock:
+        _written.add(path.abspath(p))
+
+    if _same(p, data):
+        with _written_lock:
+            files_unchanged += 1
+        return
+
+    tmp = _tmp_name(p)
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    _replace(tmp, p)
+
+
+def _same(p, data):
+    # Cheap size check first, then the contents
+    try:
+        if os.stat(p).st_size != len(data): return False
+        with open(p, 'rb') as f:
+            return f.read() == data
+    except OSError:
+        return False
+
+
+def _tmp_name(p):
+    return '%s.tmp-%d-%d' % (p, os.getpid(), threading.get_ident())
+
+
+def _replace(tmp, p):
+    global files_written
+
+    if path.isdir(p) and not path.islink(p):
+        shutil.rmtree(p)
+    os.replace(tmp, p)
+
+    with _written_lock:
+        files_written += 1
+
+
+def _prune(root):
+    # Dot-files and dot-directories (.git, .gitignore...) are not ours to
+    # delete, and are never walked into, except for our own format markers
+    global files_removed
+
+    visited = []
+    for parent, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if not name.startswith('.')]
+        visited.append(parent)
+
+        for name in files:
+            if name.startswith('.') and name != MARKER: continue
+
+            p = path.abspath(path.join(parent, name))
+            if p not in _written:
+                os.remove(p)
+                files_removed += 1
+
+    for parent in reversed(visited):
+        try:
+            os.rmdir(parent) # only if nothing is left
+        except OSError:
             pass
+
+
+def report(fmt):
+    """Print the name of a format that was built or dumped, unless collect()
+    is listening on this thread
+    """
+
+    log = getattr(_local, 'log', None)
+    if log is None:
+        print(fmt)
+    else:
+        log.append(fmt)
+
+
+def collect(fn, *args):
+    """Return fn(*args) and a list of the format names it would have printed
+
+    Work done on other threads can report() these later, in a stable order.
+    """
+
+    saved = getattr(_local, 'log', None)
+    _local.log = []
+    try:
+        return fn(*args), _local.log
+    finally:
+        _local.log = saved
+
+
+def dump_many(jobs):
+    """Call dump(*args) for each args in jobs, on the shared threads
+
+    The results, and the format names printed, are the same as for dumping
+    one after another.
+    """
+
+    logs = run_all(lambda args: collect(dump, *args)[1], jobs)
+
+    for log in logs:
+        for fmt in log:
+            report(fmt)
+
+
+def run_all(fn, items):
+    """Return [fn(item) for item in items], worked on by up to threads threads
+
+    Nested calls share the same workers, so the number of threads stays the
+    same at any depth. The caller itself runs every item that no worker has
+    started, so it only ever waits for work that is already running.
+    """
+
+    items = list(items)
+    if threads < 2 or len(items) < 2:
+        return [fn(item) for item in items]
+
+    results = [None] * len(items)
+    claimed = [False] * len(items)
+    lock = threading.Lock()
+
+    # Work done for the caller is done for the keys it is building
+    stack = list(_stack())
+
+    def run(i):
+        with lock:
+            if claimed[i]: return
+            claimed[i] = True
+
+        saved = _stack()
+        _local.stack = list(stack)
+        try:
+            results[i] = fn(items[i])
+        finally:
+            _local.stack = saved
+
+    pool = _shared_pool()
+    futures = [pool.submit(run, i) for i in range(1, len(items))]
+    try:
+        for i in range(len(items)):
+            run(i)
+    finally:
+        running = [f for f in futures if not f.cancel()]
+        wait(running)
+
+    for f in running:
+        f.result() # raise any error from a worker
+    return results
+
+
+def _shared_pool():
+    global _pool, _pool_size
+
+    with _pool_lock:
+        if _pool_size != threads - 1:
+            if _pool is not None: _pool.shutdown(wait=False)
+            _pool = ThreadPoolExecutor(threads - 1)
+            _pool_size = threads - 1
+        return _pool
@@ -0,0 +1,380 @@
+import struct
+import threading
+from bisect import bisect_right
+
+from . import cache
+
+try:
+    from .fast_lzss import compress as compress_okumura, compress_many, compress_fast, compress_optimal, decompress, decompress_into, LZSSDecompressor, Encoder, pack_tokens
+except ImportError:
+    from .slow_lzss import compress as compress_okumura, compress_many, compress_fast, compress_optimal, decompress, decompress_into, LZSSDecompressor
+    Encoder = None
+
+
+N = 0x1000
+F = 18
+
+# An encoder started part way through the input (with an empty tree) often
+# ends up in exactly the same state as one that started at the beginning,
+# given enough input. On the ROM-like test data, a 256 KB warm-up converges
+# at about half of the segment boundaries, 512 KB at about three quarters
+# and 1 MB at all of them. A segment that does not converge is encoded again
+# by the previous encoder, wasting its warm-up and encoding.
+WARMUP = 0x100000
+
+# Don't bother splitting into segments smaller than this: each speculative
+# segment costs its warm-up on top of its own encoding
+MIN_SEGMENT = WARMUP
+
+# Input read per step by decompress_stream
+CHUNK = 0x10000
+
+# Modes that make identical output share cache entries
+ENCODINGS = {
+    'canonical': 'okumura',
+    'okumura': 'okumura',
+    'fast': 'fast',
+    'optimal': 'optimal',
+}
+
+# Output between checkpoints of a SeekableLZSS index
+INDEX_SPACING = 0x10000
+
+# Used when no mode is given. Only 'canonical' is fit for release builds.
+default_mode = 'canonical'
+
+# Bytes saved by 'optimal' mode against 'canonical', cache hits included
+optimal_saved = 0
+_saved_lock = threading.Lock()
+
+
+def cache_key(data, mode=None):
+    if mode is None: mode = default_mode
+    if mode not in ENCODINGS:
+        raise ValueError('unknown LZSS mode: %s' % mode)
+
+    return cache.key('lzss', ENCODINGS[mode], data)
+
+
+def compress(data, mode=None):
+    """Compress data, byte-identical to the Okumura encoder unless in 'fast' mode
+
+    'canonical' splits large inputs among threads, 'okumura' does not.
+    'fast' is a quick greedy encoder whose output is valid but not canonical.
+    'optimal' finds the smallest output that uses the same matches.
+    Results are kept in the cache, if it is enabled.
+    """
+
+    if mode is None: mode = default_mode
+
+    if cache.directory is None:
+        return _compress(data, mode)
+
+    key = cache_key(data, mode)
+    packed = cache.load(key)
+
+    if mode == 'optimal':
+        # Keep the canonical length too, so that a hit still counts its saving
+        len_key = cache.key(key, 'canonical_len')
+        canonical_len = cache.load(len_key)
+        if packed is not None and canonical_len is not None:
+            _count_saved(int(canonical_len), len(packed))
+            return packed
+
+        packed, canonical_len = _compress_optimal(data)
+        cache.store(key, packed)
+        cache.store(len_key, b'%d' % canonical_len)
+        return packed
+
+    if packed is None:
+        packed = _compress(data, mode)
+        cache.store(key, packed)
+    return packed
+
+
+def _compress(data, mode):
+    if mode == 'okumura':
+        return compress_okumura(data)
+
+    elif mode == 'fast':
+        return compress_fast(data)
+
+    elif mode == 'optimal':
+        return _compress_optimal(data)[0]
+
+    elif mode == 'canonical':
+        # The segments share dispatcher's threads with any build around them
+        from . import dispatcher
+
+        nseg = min(dispatcher.threads, len(data) // MIN_SEGMENT)
+        if Encoder is None or nseg < 2:
+            return compress_okumura(data)
+
+        seglen = (len(data) // nseg + N - 1) // N * N
+        bounds = list(range(seglen, len(data), seglen))
+        return compress_segments(data, bounds, map=_run_all_map)
+
+    else:
+        raise ValueError('unknown LZSS mode: %s' % mode)
+
+
+def _run_all_map(fn, *iterables):
+    from . import dispatcher
+    return dispatcher.run_all(lambda args: fn(*args), zip(*iterables))
+
+
+def _compress_optimal(data):
+    packed, canonical_len = compress_optimal(data)
+    _count_saved(canonical_len, len(packed))
+    return packed, canonical_len
+
+
+def _count_saved(canonical_len, optimal_len):
+    global optimal_saved
+    with _saved_lock:
+        optimal_saved += canonical_len - optimal_len
+
+
+def compress_segments(data, bounds, warmup=WARMUP, map=map):
+    """Compress data in segments, which can be done in parallel by passing an
+    executor's map function. The result is identical to compress_okumura(data).
+
+    Each segment after the first is encoded speculatively, starting a little
+    before its boundary (in bounds, ideally multiples of N). At the first
+    token boundary after the segment boundary, the previous segment's encoder
+    has to have exactly the same state as this one, and if not, the previous
+    segment's encoder just carries on into this segment.
+    """
+
+    def warm_up(boundary):
+        enc = Encoder(data, max(0, boundary - warmup) // N * N)
+        enc.run(boundary)
+        enc.discard()
+        return enc, enc.copy()
+
+    warmed = list(map(warm_up, bounds))
+    encoders = [Encoder(data)] + [enc for (enc, snap) in warmed]
+    snapshots = [snap for (enc, snap) in warmed]
+    stops = [snap.pos for snap in snapshots] + [None]
+
+    def run(enc, stop):
+        if stop is None:
+            enc.run()
+        else:
+            enc.run(stop)
+
+    list(map(run, encoders, stops))
+
+    cur = encoders[0]
+    used = [cur]
+    for i, snap in enumerate(snapshots):
+        if cur.same_state(snap):
+            cur = encoders[i + 1]
+            used.append(cur)
+        else:
+            run(cur, stops[i + 1])
+    cur.run()
+
+    return pack_tokens(used)
+
+
+def _chunks(src, chunk):
+    if hasattr(src, 'read'):
+        return iter(lambda: src.read(chunk), b'')
+    else:
+        src = memoryview(src).cast('B')
+        return (src[i:i+chunk] for i in range(0, len(src), chunk))
+
+
+def unpack_key(packed):
+    """Cache key for the decompressed form of packed, which is the same
+    whichever encoder made it
+    """
+
+    return cache.key('unlzss', packed)
+
+
+def decompress_cached(packed, expected_len=None):
+    """Decompress, keeping the result in the cache if it is enabled
+    """
+
+    if cache.directory is None:
+        return decompress(packed, expected_len)
+
+    key = unpack_key(packed)
+    plain = cache.load(key)
+    if plain is None or (expected_len is not None and len(plain) != expected_len):
+        plain = decompress(packed, expected_len)
+        cache.store(key, plain)
+    return plain
+
+
+def decompress_stream(src, write, expected_len=None, chunk=CHUNK):
+    """Decompress from a file or buffer (e.g. an mmap slice) to a write
+    function, such as a file's write or a hash's update, a chunk at a time.
+
+    Returns the number of bytes written.
+    """
+
+    obj = LZSSDecompressor(expected_len)
+
+    for data in _chunks(src, chunk):
+        while True:
+            write(obj.feed(data, chunk))
+            data = b''
+            if obj.eof or obj.needs_input: break
+        if obj.eof: break
+
+    if expected_len is not None and not obj.eof:
+        raise ValueError('LZSS stream too short')
+
+    return obj.total_out
+
+
+class SeekableLZSS:
+    """Random access to LZSS data, decompressing only from the nearest
+    checkpoint. index is the output of a previous dump_index(), which saves
+    the initial pass over the whole stream.
+
+    A checkpoint is taken at the first token boundary after every spacing
+    bytes of output. It holds the output offset, the input offset, the
+    remaining flag bits (bit 8 clear means a flag byte is due) and the ring
+    buffer, which is just the N bytes of output before that point.
+    """
+
+    _header = struct.Struct('>8sIII')
+    _checkpoint = struct.Struct('>IIH')
+    _magic = b'LZSSidx1'
+
+    def __init__(self, lzss, index=None, spacing=INDEX_SPACING):
+        self.lzss = memoryview(lzss).cast('B')
+
+        if index is None:
+            if spacing < 1:
+                raise ValueError('spacing must be positive')
+            self._build(spacing)
+        else:
+            self._load(index)
+
+        self._outs = [cp[0] for cp in self.checkpoints]
+
+    def __len__(self):
+        return self.total_len
+
+    def _build(self, spacing):
+        # decompress() in C and then a walk over the tokens is quicker than
+        # taking checkpoints in a decode loop in Python. The walk stops just
+        # where decompress() does, at the end or at a truncated token.
+        lzss = self.lzss
+        lzss_len = len(lzss)
+        plain = decompress(lzss)
+
+        checkpoints = []
+        lzss_i = out = 0
+        flags = 0
+        due = 0
+        while True:
+            if not flags & 0x100:
+                if lzss_i >= lzss_len: break
+                flags = lzss[lzss_i] | 0xff00; lzss_i += 1
+
+            if flags & 1:
+                if lzss_i >= lzss_len: break
+            else:
+                if lzss_i + 1 >= lzss_len: break
+
+            if out >= due:
+                if out >= N:
+                    window = plain[out-N:out]
+                else:
+                    window = b' ' * (N - out) + plain[:out]
+                checkpoints.append((out, lzss_i, flags, window))
+                due = (out // spacing + 1) * spacing
+
+            if flags & 1:
+                lzss_i += 1
+                out += 1
+            else:
+                out += (lzss[lzss_i + 1] & 0x0f) + 3
+                lzss_i += 2
+
+            flags >>= 1
+
+        self.spacing = spacing
+        self.total_len = len(plain)
+        self.checkpoints = checkpoints
+
+    def dump_index(self):
+        """Serialise the checkpoints, to be passed back in as index
+        """
+
+        parts = [self._header.pack(self._magic, len(self.lzss), self.total_len, self.spacing)]
+        for out, lzss_i, flags, window in self.checkpoints:
+            parts.append(self._checkpoint.pack(out, lzss_i, flags))
+            parts.append(window)
+        return b''.join(parts)
+
+    def _load(self, index):
+        index = memoryview(index).cast('B')
+        try:
+            magic, lzss_len, self.total_len, self.spacing = self._header.unpack_from(index)
+        except struct.error:
+            raise ValueError('LZSS index too short')
+        if magic != self._magic:
+            raise ValueError('not an LZSS index')
+        if lzss_len != len(self.lzss):
+            raise ValueError('LZSS index is for different data')
+
+        self.checkpoints = []
+        cp_len = self._checkpoint.size + N
+        for at in range(self._header.size, len(index), cp_len):
+            if at + cp_len > len(index):
+                raise ValueError('LZSS index truncated')
+            out, lzss_i, flags = self._checkpoint.unpack_from(index, at)
+            window = bytes(index[at+self._checkpoint.size:at+cp_len])
+            self.checkpoints.append((out, lzss_i, flags, window))
+
+    def read_at(self, offset, length):
+        """Return up to length bytes of output starting at offset
+        """
+
+        if offset < 0 or length < 0:
+            raise ValueError('offset and length must not be negative')
+        length = min(length, self.total_len - offset)
+        if length <= 0: return b''
+
+        out, lzss_i, flags, window = self.checkpoints[bisect_right(self._outs, offset) - 1]
+
+        lzss = self.lzss
+        lzss_len = len(lzss)
+
+        # As in slow_lzss.decompress, but plain[j] is output byte out + j - N
+        plain = bytearray(window)
+        stop = N + offset - out + length
+        while len(plain) < stop:
+            if not flags & 0x100:
+                if lzss_i >= lzss_len: break
+                flags = lzss[lzss_i] | 0xff00; lzss_i += 1
+
+            if flags & 1:
+                if lzss_i >= lzss_len: break
+                plain.append(lzss[lzss_i]); lzss_i += 1
+            else:
+                if lzss_i + 1 >= lzss_len: break
+                byte1 = lzss[lzss_i]
+                byte2 = lzss[lzss_i + 1]
+                lzss_i += 2
+                lookup_i = (byte2 << 4) & 0xf00 | byte1
+                lookup_len = (byte2 & 0x0f) + 3
+
+                end = len(plain)
+                start = end - 1 - (end - 1 + out - lookup_i - F) % N
+                if start + lookup_len <= end:
+                    plain += plain[start:start+lookup_len]
+                else:
+                    run = plain[start:end]
+                    plain += (run * (lookup_len // len(run) + 1))[:lookup_len]
+
+            flags >>= 1
+
+        return bytes(plain[stop-length:stop])
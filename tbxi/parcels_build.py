@@ -5,14 +5,15 @@ from binascii import crc32
 
 from .lowlevel import PrclNodeStruct, PrclChildStruct, MAGIC
 
-try:
-    from .fast_lzss import compress
-except ImportError:
-    from .slow_lzss import compress
+from .lzss import compress
 
 from . import dispatcher
 
 
+# The file that marks a directory as this format
+SIGNATURE = 'Parcelfile'
+
+
 class CodeLine(dict):
     def __getattr__(self, attrname):
         return self[attrname]
@@ -59,9 +60,44 @@ def getbool(from_str):
 class PdslParseError(Exception):
     pass
 
+def child_src(src, name):
+    if not path.isabs(name): # look rel to Parcelfile
+        name = path.join(src, name)
+
+    a, b = path.splitext(name)
+    if b.lower() == '.lzss':
+        return a, True
+    else:
+        return name, False
+
+def build_child(src, compress_it):
+    data, log = dispatcher.collect(dispatcher.build, src)
+    unpackedlen = len(data)
+    if compress_it:
+        data = dispatcher.derive(compress, data)
+    return data, unpackedlen, log
+
+def deps(src):
+    if not path.exists(path.join(src, 'Parcelfile')): raise dispatcher.WrongFormat
+    found = []
+
+    with open(path.join(src, 'Parcelfile')) as f:
+        for line in f:
+            if get_indent_level(line) != 1: continue
+            pieces = split(line, comments=True, posix=True)
+            if not pieces: continue
+
+            new = get_keys(pieces[1:], flags=gethex, name=str, src=str, deduplicate=getbool)
+            if new.src:
+                child, compress_it = child_src(src, new.src)
+                found.append((child, compress if compress_it else None))
+
+    return found
+
 def build(src):
     if not path.exists(path.join(src, 'Parcelfile')): raise dispatcher.WrongFormat
     node_list = []
+    pending = [] # (line_num, child)
 
     with open(path.join(src, 'Parcelfile')) as f:
         try:
@@ -86,19 +122,10 @@ def build(src):
                     new.compress = ''
 
                     if new.src:
-                        if not path.isabs(new.src): # look rel to Parcelfile
-                            new.src = path.join(src, new.src)
+                        new.src, compress_it = child_src(src, new.src)
+                        if compress_it: new.compress = 'lzss'
 
-                        a, b = path.splitext(new.src)
-                        if b.lower() == '.lzss':
-                            new.src = a
-                            new.compress = 'lzss'
-
-                        new.data = dispatcher.build(new.src)
-                        new.unpackedlen = len(new.data)
-                        if new.compress == 'lzss':
-                            new.data = compress(new.data)
-                        new.packedlen = len(new.data)
+                        pending.append((line_num, new))
 
                     node_list[-1].children.append(new)
 
@@ -113,6 +140,20 @@ def build(src):
         except:
             raise PdslParseError('Line %d' % line_num)
 
+    def attempt(item):
+        line_num, child = item
+        try:
+            return build_child(child.src, child.compress == 'lzss')
+        except Exception as e:
+            return e
+
+    for (line_num, child), result in zip(pending, dispatcher.run_all(attempt, pending)):
+        if isinstance(result, Exception):
+            raise PdslParseError('Line %d' % line_num) from result
+        child.data, child.unpackedlen, log = result
+        for fmt in log: dispatcher.report(fmt)
+        child.packedlen = len(child.data)
+
     # Great! Now that we have this cool data structure, turn it into parcels...
     accum = bytearray()
 
@@ -1,4 +1,5 @@
 from collections import defaultdict, Counter
+import io
 import os
 from os import path
 from shlex import quote
@@ -7,7 +8,7 @@ import hashlib
 
 from . import dispatcher
 
-from .slow_lzss import decompress
+from .lzss import decompress_cached
 from .lowlevel import PrclNodeStruct, PrclChildStruct
 from .pef_info import suggest_name
 
@@ -101,25 +102,32 @@ def guess_binary_name(parent_struct, child_struct, adjacent_name, data):
     return ''
 
 
+def sniff(binary):
+    return 1.0 if binary.startswith(b'prcl') else 0
+
+
 def dump(binary, dest_dir):
-    if not binary.startswith(b'prcl'): raise dispatcher.WrongFormat
+    if not sniff(binary): raise dispatcher.WrongFormat
 
     os.makedirs(dest_dir, exist_ok=True)
 
     basic_structure = walk_tree(binary)
 
-    # Decompress everything
-    unpacked_dict = {}
-    binary_of = lambda child: unpacked_dict[unique_binary_tpl(child)]
+    # Decompress everything, once per unique binary
     binary_counts = Counter()
+    first_child = {}
     for prclnode, children in basic_structure:
         for prclchild in children:
             binary_counts[unique_binary_tpl(prclchild)] += 1
+            first_child.setdefault(unique_binary_tpl(prclchild), prclchild)
 
-            data = binary[prclchild.ptr:prclchild.ptr+prclchild.packedlen]
-            if prclchild.compress == 'lzss': data = decompress(data)
+    def unpack(prclchild):
+        data = binary[prclchild.ptr:prclchild.ptr+prclchild.packedlen]
+        if prclchild.compress == 'lzss': data = decompress_cached(data, prclchild.unpackedlen)
+        return data
 
-            unpacked_dict[unique_binary_tpl(prclchild)] = data
+    unpacked_dict = dict(zip(first_child, dispatcher.run_all(unpack, first_child.values())))
+    binary_of = lambda child: unpacked_dict[unique_binary_tpl(child)]
 
     filename_dict = {} # maps binary data to a filename
     for prclnode, children in basic_structure:
@@ -151,11 +159,10 @@ def dump(binary, dest_dir):
     filename_dict = {b: (fn+'.pef' if b.startswith(b'Joy!peff') else fn) for (b, fn) in filename_dict.items()}
 
     # Dump blobs to disk
-    for data, filename in filename_dict.items():
-        dispatcher.dump(data, path.join(dest_dir, filename))
+    dispatcher.dump_many((data, path.join(dest_dir, filename)) for (data, filename) in filename_dict.items())
 
     # Get printing!!!
-    with open(path.join(dest_dir, 'Parcelfile'), 'w') as f:
+    with io.StringIO() as f:
         f.write(HEADER_COMMENT + '\n\n')
 
         for prclnode, children in basic_structure:
@@ -196,3 +203,5 @@ def dump(binary, dest_dir):
                         print(line, file=f)
 
             print(file=f)
+
+        dispatcher.write(path.join(dest_dir, 'Parcelfile'), f.getvalue())
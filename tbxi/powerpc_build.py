@@ -9,6 +9,9 @@ from .lowlevel import ConfigInfo
 from . import dispatcher
 
 
+# The file that marks a directory as this format
+SIGNATURE = 'Configfile-1'
+
 MAPNAMES = ['sup', 'usr', 'cpu', 'ovl']
 BATNAMES = ['ibat0', 'ibat1', 'ibat2', 'ibat3', 'dbat0', 'dbat1', 'dbat2', 'dbat3']
 
@@ -138,6 +141,22 @@ def checksum_image(binary, ofs):
     return allsums
 
 
+def deps(src):
+    # Every ConfigInfo names much the same files
+    found = {}
+    for ciname in iter_configinfo_names():
+        try:
+            ci, filenames = parse_configinfo(path.join(src, ciname))
+        except (FileNotFoundError, NotADirectoryError):
+            break
+
+        for fn in filenames.values():
+            found[path.join(src, fn)] = None
+
+    if ciname == 'Configfile-1': raise dispatcher.WrongFormat
+    return list(found.items())
+
+
 def build(src):
     cilist = []
     for ciname in iter_configinfo_names():
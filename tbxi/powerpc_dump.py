@@ -2,6 +2,7 @@ from .lowlevel import SuperMarioHeader, ConfigInfo
 
 import struct
 import shlex
+import io
 import os
 from os import path
 
@@ -293,7 +294,11 @@ def dump_configinfo(binary, offset, filename_dict, push_line):
 
 
 def is_powerpc(binary):
-    return (len(binary) == 0x400000) and (PAD in binary[:0x300000])
+    return (len(binary) == 0x400000) and (binary.find(PAD, 0, 0x300000) != -1)
+
+
+def sniff(binary):
+    return 0.5 if is_powerpc(binary) else 0
 
 
 def get_nk_version(nk):
@@ -336,6 +341,7 @@ def dump(orig_binary, dest_dir):
     fields = sorted(fields[:-1]) + fields[-1:]
 
     filename_dict = {} # Maps 'KernelCode' etc to a filename
+    jobs = []
     for start, stop, field in fields:
         # ConfigInfo is known to lie about these fields
         if field in 'HWInitCode KernelCode OpenFWBundle':
@@ -357,11 +363,14 @@ def dump(orig_binary, dest_dir):
 
         filename_dict[field + 'Offset'] = filename
 
-        dispatcher.dump(fragment, path.join(dest_dir, filename))
+        jobs.append((fragment, path.join(dest_dir, filename)))
+
+    dispatcher.dump_many(jobs)
 
     # Finally, write out ConfigInfo with paths to the files that we create
     for i, cioffset in enumerate(ci_loc, 1):
         filename = 'Configfile-%d' % i
-        with open(path.join(dest_dir, filename), 'w') as f:
+        with io.StringIO() as f:
             push_line = lambda x: print(x, file=f)
             dump_configinfo(orig_binary, cioffset, filename_dict, push_line)
+            dispatcher.write(path.join(dest_dir, filename), f.getvalue())
@@ -1,10 +1,26 @@
 """A pure-Python implementation of hqx (Mac "binhex") encoding,
-modeled on the original C code by Jack Jansen."""
+modeled on the original C code by Jack Jansen.
+
+Everything works on whole buffers: bytes.translate and extended slices
+move 6-bit groups around, and big ints OR together byte lanes that never
+carry into each other."""
+
+from array import array
+import re
+import sys
 
 RUNCHAR = 0x90
 
 _b2atable = b"!\"#$%&'()*+,-012345689@ABCDEFGHIJKLMNPQRSTUVXYZ[`abcdefhijklmpqr"
-_a2btable = {i: c for (c, i) in enumerate(_b2atable)}
+
+# Map each character to its 6-bit value, and each 6-bit value to a character
+_a2btrans = bytearray(256)
+for (c, i) in enumerate(_b2atable): _a2btrans[i] = c
+_a2btrans = bytes(_a2btrans)
+_b2atrans = _b2atable * 4
+
+def _lanes(fn):
+    return bytes(fn(i) & 0xff for i in range(256))
 
 _crctable = [
     0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7,
@@ -41,65 +57,105 @@ _crctable = [
     0x6e17, 0x7e36, 0x4e55, 0x5e74, 0x2e93, 0x3eb2, 0x0ed1, 0x1ef0,
 ]
 
+# Slicing-by-8: _crctables[k][i] is the effect of byte i with k bytes after it
+_crctables = [_crctable]
+for k in range(7):
+    _crctables.append([((v << 8) & 0xffff) ^ _crctable[v >> 8] for v in _crctables[-1]])
+
 class Incomplete(Exception):
     pass
 
+def _or(*lanes):
+    n = len(lanes[0])
+    acc = 0
+    for l in lanes: acc |= int.from_bytes(l, 'big')
+    return acc.to_bytes(n, 'big')
+
+_shl2, _shr4 = _lanes(lambda i: i << 2), _lanes(lambda i: i >> 4)
+_lo4shl4, _shr2 = _lanes(lambda i: i << 4), _lanes(lambda i: i >> 2)
+_lo2shl6 = _lanes(lambda i: i << 6)
+
 def a2b(data):
     # 'done' is really a boolean flag, but we will stick with an integer
     # value to ensure compatibility.
-    result, leftchar, leftbits, done = bytearray(), 0, 0, 0
-    for b in data:
-        if b in b'\r\n':
-            continue
-        if b == b':'[0]:
-            done = 1
-            break
-        # The original code defined a `binascii.Error`.
-        # We'll just let the `KeyError` propagate instead.
-        value = _a2btable[b]
-        leftchar, leftbits = (leftchar << 6) | value, leftbits + 6
-        if leftbits >= 8:
-            leftbits -= 8
-            result.append(leftchar >> leftbits)
-            leftchar &= ((1 << leftbits) - 1)
-    if leftbits and not done:
+    data = bytes(data)
+    done = 0
+    colon = data.find(b':')
+    if colon >= 0:
+        data = data[:colon]
+        done = 1
+    data = data.translate(None, b'\r\n')
+
+    # The original code defined a `binascii.Error`.
+    # We'll raise the same `KeyError` as a dictionary lookup would.
+    bad = data.translate(None, _b2atable)
+    if bad:
+        raise KeyError(bad[0])
+
+    values = data.translate(_a2btrans)
+    tail = len(values) % 4
+    if tail and not done:
         raise Incomplete('String has incomplete number of bytes')
+    whole = len(values) - tail
+
+    # Every 4 characters make 3 bytes
+    a, b, c, d = (values[i:whole:4] for i in range(4))
+    result = bytearray(whole // 4 * 3)
+    result[0::3] = _or(a.translate(_shl2), b.translate(_shr4))
+    result[1::3] = _or(b.translate(_lo4shl4), c.translate(_shr2))
+    result[2::3] = _or(c.translate(_lo2shl6), d)
+
+    # 2 or 3 characters left over make 1 or 2 bytes, with bits to spare
+    leftchar = 0
+    for v in values[whole:]: leftchar = (leftchar << 6) | v
+    nbits = tail * 6
+    result += (leftchar >> (nbits % 8)).to_bytes(nbits // 8, 'big')
+
     return bytes(result), done
 
+_b2a0, _b2a1hi = _lanes(lambda i: i >> 2), _lanes(lambda i: (i & 3) << 4)
+_b2a1lo, _b2a2hi = _lanes(lambda i: i >> 4), _lanes(lambda i: (i & 15) << 2)
+_b2a2lo, _b2a3 = _lanes(lambda i: i >> 6), _lanes(lambda i: i & 63)
+
 def b2a(data):
-    result, leftchar, leftbits = bytearray(), 0, 0
-    for b in data:
-        leftchar, leftbits = (leftchar << 8) | b, leftbits + 8
-        while leftbits >= 6:
-            value, leftbits = (leftchar >> (leftbits - 6)) & 0x3f, leftbits - 6
-            result.append(_b2atable[value])
-    if leftbits:
-        result.append(_b2atable[leftchar << (6 - leftbits)])
-    return bytes(result)
+    data = bytes(data)
+    tail = len(data) % 3
+    whole = len(data) - tail
+
+    # Every 3 bytes make 4 characters
+    x, y, z = (data[i:whole:3] for i in range(3))
+    result = bytearray(whole // 3 * 4)
+    result[0::4] = x.translate(_b2a0)
+    result[1::4] = _or(x.translate(_b2a1hi), y.translate(_b2a1lo))
+    result[2::4] = _or(y.translate(_b2a2hi), z.translate(_b2a2lo))
+    result[3::4] = z.translate(_b2a3)
+
+    # 1 or 2 bytes left over make 2 or 3 characters, padded with zero bits
+    if tail:
+        leftchar = int.from_bytes(data[whole:], 'big') << (6 - tail * 8 % 6)
+        result += bytes((leftchar >> shift) & 0x3f for shift in range(tail * 6, -1, -6))
+
+    return bytes(result.translate(_b2atrans))
 
 def crc(data, crc):
     crc &= 0xffff
-    for b in data:
+    data = memoryview(data).cast('B')
+    whole = len(data) // 8 * 8
+
+    words = array('Q')
+    words.frombytes(data[:whole])
+    if sys.byteorder == 'little': words.byteswap()
+    t0, t1, t2, t3, t4, t5, t6, t7 = _crctables
+    for x in words:
+        x ^= crc << 48
+        crc = (t7[x >> 56] ^ t6[x >> 48 & 0xff] ^ t5[x >> 40 & 0xff] ^ t4[x >> 32 & 0xff] ^
+            t3[x >> 24 & 0xff] ^ t2[x >> 16 & 0xff] ^ t1[x >> 8 & 0xff] ^ t0[x & 0xff])
+
+    for b in data[whole:]:
         high, low = crc >> 8, crc & 0xff
         crc = (low<<8) ^ _crctable[high^b]
     return crc
 
-def _get_repeat_count(bi):
-    try:
-        return next(bi)
-    except StopIteration:
-        raise Incomplete
-
-def _append_run(buffer, repeat_count):
-    if repeat_count == 0:
-        buffer.append(RUNCHAR)
-        return
-    if not buffer:
-        raise ValueError("Orphaned RLE code at start")
-    # 1 copy of the byte was already appended.
-    for i in range(repeat_count - 1):
-        buffer.append(buffer[-1])
-
 def rle_decode(data):
     # The original code seems to include some trickery to deal with "buffers"
     # that advertise a certain length of data but don't yet have all of it
@@ -108,41 +164,48 @@ def rle_decode(data):
     # (to detect an orphaned RLE code), and therefore special handling for
     # an empty input (where the first byte is not available). But it's simpler
     # to just check the output length before looking for the byte to repeat.
-    result, bi = bytearray(), iter(data)
-    for b in bi:
-        if b == RUNCHAR:
-            _append_run(result, _get_repeat_count(bi))
+    data = bytes(data)
+    result = bytearray()
+    i = 0
+    while True:
+        j = data.find(RUNCHAR, i)
+        if j < 0:
+            result += data[i:]
+            break
+        result += data[i:j]
+
+        if j + 1 == len(data):
+            raise Incomplete
+        repeat_count = data[j + 1]
+        i = j + 2
+
+        if repeat_count == 0:
+            result.append(RUNCHAR)
+        elif not result:
+            raise ValueError("Orphaned RLE code at start")
         else:
-            result.append(b)
+            # 1 copy of the byte was already appended.
+            result += result[-1:] * (repeat_count - 1)
     return bytes(result)
 
-def _add_run(buffer, b, count):
-    if b is None:
-        return
-    if b == RUNCHAR: # FIXME: allow for compressed runs of RUNCHAR?
-        buffer.extend([RUNCHAR, 0] * count)
-        return
+# Runs of RUNCHAR are escaped byte by byte (FIXME: allow for compressed
+# runs of RUNCHAR?), and runs of anything else longer than 3 are compressed
+_runs = re.compile(rb'(\x90+)|([^\x90])\2{3,}')
+
+def _add_run(m):
+    if m.group(1):
+        return b'\x90\x00' * len(m.group(1))
+
+    b, count = m.group(2), len(m.group(0))
     # The original code appears to handle long runs by outputting
     # a new "to-repeat" byte for each group of 255.
-    while count > 255:
-        buffer.extend([b, RUNCHAR, 255]) # represents 255 occurrences
-        count -= 255
+    result = (b + b'\x90\xff') * (count // 255)
+    count %= 255
     if count > 3:
-        buffer.extend([b, RUNCHAR, count])
+        result += b + bytes([RUNCHAR, count])
     else:
-        buffer.extend([b] * count)
+        result += b * count
+    return result
 
 def rle_encode(data):
-    # Chunk the input bytes into consecutive runs of equal bytes,
-    # and add an encoding of each to the result.
-    # This manual chunking should be faster than itertools.groupby.
-    result, to_add, count = bytearray(), None, 0
-    for b in data:
-        if b == to_add:
-            count += 1
-        else:
-            _add_run(result, to_add, count)
-            to_add, count = b, 1
-    # Add the last run.
-    _add_run(result, to_add, count)
-    return bytes(result)
+    return _runs.sub(_add_run, bytes(data))
@@ -1,9 +1,9 @@
 # This file is adapted from LZSS.C by Haruhiko Okumura 4/6/1989
 
 # Decompression is pretty quick
-# Compression is pretty slow:
-# about 50s to compress a 4 MB rom on my machine
+# Compression is pretty slow, even after some tuning (see tests/bench_lzss.py)
 
+from array import array
 from warnings import warn
 have_warned_about_slowness = False
 
@@ -13,120 +13,265 @@ THRESHOLD = 2
 NIL = N
 
 
-def memset(buf, start, stop, to):
-    for i in range(start, stop):
-        buf[i] = to
+def decompress(lzss, expected_len=None):
+    lzss = memoryview(lzss).cast('B')
+    lzss_len = len(lzss)
+    lzss_i = 0
 
+    # The output doubles as the dictionary. It starts with N spaces, which
+    # stand in for the initial contents of the ring buffer. Output byte k
+    # would have gone into the ring buffer at (k - F) % N, so position
+    # i % N of the ring buffer is always the last byte in plain whose
+    # index is congruent to i + F.
+    plain = bytearray(b' ' * N)
 
-def decompress(lzss):
-    lzss = iter(lzss)
-    plain = bytearray()
+    # Iterate through byte-headed "runs"
+    while lzss_i < lzss_len:
+        headerbyte = lzss[lzss_i]; lzss_i += 1
+
+        for bitnum in range(8):
+            if (headerbyte >> bitnum) & 1:
+                # Copy a single byte verbatim
+                if lzss_i >= lzss_len: break
+                plain.append(lzss[lzss_i]); lzss_i += 1
+            else:
+                # Copy 3-18 bytes from the dictionary
+                if lzss_i + 1 >= lzss_len: break
+                byte1 = lzss[lzss_i]
+                byte2 = lzss[lzss_i + 1]
+                lzss_i += 2
+                lookup_i = (byte2 << 4) & 0xf00 | byte1
+                lookup_len = (byte2 & 0x0f) + 3
+
+                end = len(plain)
+                start = end - 1 - (end - 1 - lookup_i - F) % N
+                if start + lookup_len <= end:
+                    plain += plain[start:start+lookup_len]
+                else:
+                    # Overlaps itself, so repeats with a period of end - start
+                    run = plain[start:end]
+                    plain += (run * (lookup_len // len(run) + 1))[:lookup_len]
 
-    lzdict = bytearray(b' ' * N)
+    # (Running out part way through a run is no problem: it means the last
+    # header had <8 real bits)
+    plain = memoryview(plain)[N:]
 
-    dict_i = N - F
-    def push(byte):
-        nonlocal dict_i
-        lzdict[dict_i % N] = byte
-        dict_i += 1
+    if expected_len is not None and len(plain) != expected_len:
+        raise ValueError('LZSS data does not decompress to %d bytes' % expected_len)
 
-        plain.append(byte)
+    return bytes(plain)
 
-    # Iterate through byte-headed "runs"
-    try:
-        for headerbyte in lzss:
-            for bitnum in range(8):
-                if (headerbyte >> bitnum) & 1:
-                    # Copy a single byte verbatim
-                    push(next(lzss))
-                else:
-                    # Copy 3-18 bytes from the dictionary
-                    byte1 = next(lzss)
-                    byte2 = next(lzss)
-                    lookup_i = (byte2 << 4) & 0xf00 | byte1
-                    lookup_len = (byte2 & 0x0f) + 3
 
-                    for i in range(lookup_i, lookup_i+lookup_len):
-                        push(lzdict[i % N])
+def decompress_into(lzss, buffer, offset=0):
+    plain = decompress(lzss)
+
+    buffer = memoryview(buffer).cast('B')
+    if not 0 <= offset <= len(buffer):
+        raise ValueError('offset out of range')
+    if len(plain) > len(buffer) - offset:
+        raise ValueError('buffer too small for decompressed data')
+
+    buffer[offset:offset+len(plain)] = plain
+    return len(plain)
+
+
+class LZSSDecompressor:
+    """Decompress a stream of LZSS data in chunks, like bz2.BZ2Decompressor
+
+    LZSS has no end marker, so eof only becomes true when expected_len is given.
+    """
+
+    def __init__(self, expected_len=None):
+        if expected_len is not None and expected_len < 0:
+            raise ValueError('expected_len must not be negative')
+
+        self.expected_len = expected_len
+        self.total_out = 0
+        self.eof = (expected_len == 0)
+        self.unused_data = b''
+
+        self._input = b''
+        self._lzdict = bytearray(b' ' * N)
+        self._dict_i = N - F
+        self._flags = 0 # bit 8 clear means a flag byte is due
+        self._byte1 = None
+        self._match_i = self._match_left = 0
+
+    @property
+    def needs_input(self):
+        return not self.eof and not self._input and not self._match_left
+
+    def feed(self, data=b'', max_length=-1):
+        if self.eof:
+            self.unused_data += bytes(data)
+            return b''
+
+        lzss = self._input + bytes(data)
+        pos = 0
+
+        limit = len(lzss) * 9 + F
+        if max_length >= 0: limit = min(limit, max_length)
+        if self.expected_len is not None: limit = min(limit, self.expected_len - self.total_out)
+
+        plain = bytearray()
+        lzdict = self._lzdict
+        dict_i = self._dict_i
+        flags = self._flags
+
+        while True:
+            while self._match_left and len(plain) < limit:
+                byte = lzdict[self._match_i]
+                self._match_i = (self._match_i + 1) % N
+                self._match_left -= 1
+                lzdict[dict_i] = byte
+                dict_i = (dict_i + 1) % N
+                plain.append(byte)
+            if len(plain) >= limit: break
+
+            if not flags & 0x100:
+                if pos == len(lzss): break
+                flags = lzss[pos] | 0xff00; pos += 1
+
+            if flags & 1:
+                # Copy a single byte verbatim
+                if pos == len(lzss): break
+                byte = lzss[pos]; pos += 1
+                lzdict[dict_i] = byte
+                dict_i = (dict_i + 1) % N
+                plain.append(byte)
+            else:
+                # Copy 3-18 bytes from the dictionary
+                if self._byte1 is None:
+                    if pos == len(lzss): break
+                    self._byte1 = lzss[pos]; pos += 1
+                if pos == len(lzss): break
+                byte2 = lzss[pos]; pos += 1
+                self._match_i = (byte2 << 4) & 0xf00 | self._byte1
+                self._match_left = (byte2 & 0x0f) + 3
+                self._byte1 = None
+
+            flags >>= 1
+
+        self._dict_i = dict_i
+        self._flags = flags
+
+        self.total_out += len(plain)
+        if self.total_out == self.expected_len:
+            self.eof = True
+            self.unused_data = lzss[pos:]
+            self._input = b''
+        else:
+            self._input = lzss[pos:]
 
-    except StopIteration:
-        # Means the last header had <8 real bits, no problem
-        pass
+        return bytes(plain)
 
-    return bytes(plain)
 
+def _find_matches(plain):
+    """Find the longest match at each position of plain, as the Okumura
+    encoder's trees would. The trees end up the same whichever tokens are
+    chosen, because every position goes in and comes out in the same order.
 
-class Tree:
-    def __init__(self):
-        self.lchild = [0] * (N + 1)
-        self.rchild = [0] * (N + 257); memset(self.rchild, N + 1, N + 256 + 1, NIL)
-        self.parent = [0] * (N + 1); memset(self.parent, 0, N, NIL)
+    Returns lens (0 where the match is too short to use) and positions.
+    """
+
+    plain_len = len(plain)
+    lens = bytearray(plain_len)
+    poss = array('H', bytes(2 * plain_len))
+
+    # left & right children & parent. These constitute binary search trees.
+    # For i = 1 to 256, rchild[N + i] is the root of the tree for strings
+    # that begin with character i - 1.
+    lchild = [0] * (N + 1)
+    rchild = [0] * (N + 1) + [NIL] * 256
+    parent = [NIL] * N + [0]
+
+    # ring buffer of size N, with extra F-1 bytes to aid string comparison
+    text_buf = bytearray(b' ' * (N - F) + bytes(2 * F - 1))
+    from_bytes = int.from_bytes
+
+    # Each node's string, as a big-endian integer. Nothing in a node's string
+    # is overwritten until the node is deleted, so these only need to be
+    # worked out once, on insertion. All the strings in one tree start with
+    # the same byte, so they compare just as the strings do.
+    keys = [0] * N
+
+    # The node holding each string. No two nodes in the trees hold the same
+    # string, because a match of length F replaces the old node.
+    nodes = {}
 
     # Inserts string of length F, text_buf[r..r+F-1], into one of the trees
-    # (text_buf[r]'th tree) and returns the longest-match position and length
-    # via the global variables match_position and match_length.
+    # (text_buf[r]'th tree) and returns the longest-match position and length.
     # If match_length = F, then removes the old node in favor of the new one,
     # because the old one will be deleted sooner. Note r plays double role,
     # as tree node and position in buffer.
-    def insert_node(self, r, text_buf):
-        lchild, rchild, parent = self.lchild, self.rchild, self.parent
+    #
+    # A match of length F is just looked up. Otherwise, rather than comparing
+    # strings a byte at a time, compare their keys. Only keys that share the
+    # first match_length + 1 bytes with this one can make a longer match, and
+    # they all fall in one range of integers.
+    def insert_node(r, key):
+        keys[r] = key
+        p = nodes.get(key)
+        nodes[key] = r
+
+        if p is not None:
+            parent[r] = parent[p]
+            lchild[r] = lchild[p]
+            rchild[r] = rchild[p]
+            parent[lchild[p]] = r
+            parent[rchild[p]] = r
+
+            if rchild[parent[p]] == p:
+                rchild[parent[p]] = r
+            else:
+                lchild[parent[p]] = r
 
-        cmp = 1
-        key = text_buf[r:]
-        p = N + 1 + key[0]
+            parent[p] = NIL
+
+            return p, F
+
+        first = key >> (8 * (F - 1))
+        p = N + 1 + first
         rchild[r] = lchild[r] = NIL
 
-        match_length = 0
-        match_position = 0
+        match_length = match_position = 0
+        greater = True
+
+        # Only keys in this range share enough bytes to make a longer match
+        lo = first << (8 * (F - 1))
+        hi = lo + (1 << (8 * (F - 1)))
 
         while 1:
-            if cmp >= 0:
-                if rchild[p] != NIL:
-                    p = rchild[p]
-                else:
+            if greater:
+                q = rchild[p]
+                if q == NIL:
                     rchild[p] = r
                     parent[r] = p
                     return match_position, match_length
             else:
-                if lchild[p] != NIL:
-                    p = lchild[p]
-                else:
+                q = lchild[p]
+                if q == NIL:
                     lchild[p] = r
                     parent[r] = p
                     return match_position, match_length
+            p = q
 
-            i = 1
-            while i < F:
-                cmp = key[i] - text_buf[p + i]
-                if cmp != 0: break
-                i += 1
+            other = keys[p]
+            greater = key > other
 
-            if i > match_length:
+            if lo <= other < hi:
                 match_position = p
-                match_length = i
-                if match_length >= F: break # out of while loop
-
-        parent[r] = parent[p]
-        lchild[r] = lchild[p]
-        rchild[r] = rchild[p]
-        parent[lchild[p]] = r
-        parent[rchild[p]] = r
-
-        if rchild[parent[p]] == p:
-            rchild[parent[p]] = r
-        else:
-            lchild[parent[p]] = r
-
-        parent[p] = NIL;
-
-        return match_position, match_length
+                match_length = F - (((key ^ other).bit_length() + 7) >> 3)
+                unshared = 8 * (F - 1 - match_length)
+                lo = key >> unshared << unshared
+                hi = lo + (1 << unshared)
 
     # deletes node p from tree
-    def delete_node(self, p):
-        lchild, rchild, parent = self.lchild, self.rchild, self.parent
-
+    def delete_node(p):
         if parent[p] == NIL: return
 
+        del nodes[keys[p]]
+
         if rchild[p] == NIL:
             q = lchild[p]
         elif lchild[p] == NIL:
@@ -134,9 +279,8 @@ class Tree:
         else:
             q = lchild[p]
             if rchild[q] != NIL:
-                while 1:
+                while rchild[q] != NIL:
                     q = rchild[q]
-                    if rchild[q] == NIL: break
 
                 rchild[parent[q]] = lchild[q]
                 parent[lchild[q]] = parent[q]
@@ -155,114 +299,328 @@ class Tree:
 
         parent[p] = NIL
 
-
-def compress(plain):
-    global have_warned_about_slowness
-
-    if not have_warned_about_slowness:
-        have_warned_about_slowness = True
-        warn('Using slow pure-Python LZSS compression')
-
-    if not plain: return b''
-
-    # Init the variables that get shared with the two closures below
-    tree = Tree()
-    text_buf = bytearray(N + F - 1); memset(text_buf, 0, N - F, ord(' '))
-    match_length = match_position = 0
-
-    # End of function defs, now onto the main attraction
-    plain_len = len(plain)
-    plain_i = 0
-
-    # code_buf[1..16] saves eight units of code, and code_buf[0] works
-    # as eight flags, "1" representing that the unit is an unencoded
-    # letter (1 byte), "" a position-and-length pair (2 bytes).
-    # Thus, eight units require at most 16 bytes of code.
-    code_buf = bytearray(1)
-    code_buf_list = [code_buf]
-    mask = 1
-
-    # Clear the buffer with any character that will appear often.
-    s = 0;  r = N - F
+    s = 0; r = N - F
 
     # Read F bytes into the last F bytes of the buffer
-    tblen = 0
-    while tblen < F and plain_i < plain_len:
-        text_buf[r + tblen] = plain[plain_i]
-        tblen += 1
-        plain_i += 1
+    tblen = min(F, plain_len)
+    text_buf[r:r+tblen] = plain[:tblen]
 
     # Insert the F strings, each of which begins with one or more
     # 'space' characters.  Note the order in which these strings are
     # inserted.  This way, degenerate trees will be less likely to occur.
     for i in range(1, F+1):
-        tree.insert_node(r - i, text_buf)
+        insert_node(r - i, from_bytes(text_buf[r-i:r-i+F], 'big'))
 
     # Finally, insert the whole string just read.
-    # The global variables match_length and match_position are set.
-    match_position, match_length = tree.insert_node(r, text_buf)
-    while 1:
-        match_length = min(match_length, tblen)
+    key = from_bytes(text_buf[r:r+F], 'big')
+    match_position, match_length = insert_node(r, key)
+
+    # Each string is the last one shifted along by the byte just read
+    mask = (1 << (8 * F)) - 1
+
+    k = 0
+    for c in plain[tblen:]:
+        if match_length > THRESHOLD:
+            lens[k] = match_length
+            poss[k] = match_position
+        k += 1
+
+        # Delete old strings (delete_node, inlined) and read new bytes
+        p = s
+        if parent[p] != NIL:
+            del nodes[keys[p]]
+
+            if rchild[p] == NIL:
+                q = lchild[p]
+            elif lchild[p] == NIL:
+                q = rchild[p]
+            else:
+                q = lchild[p]
+                if rchild[q] != NIL:
+                    while rchild[q] != NIL:
+                        q = rchild[q]
+
+                    rchild[parent[q]] = lchild[q]
+                    parent[lchild[q]] = parent[q]
+                    lchild[q] = lchild[p]
+                    parent[lchild[p]] = q
+
+                rchild[q] = rchild[p]
+                parent[rchild[p]] = q
+
+            pp = parent[q] = parent[p]
+
+            if rchild[pp] == p:
+                rchild[pp] = q
+            else:
+                lchild[pp] = q
+
+            parent[p] = NIL
+
+        # Since this is a ring buffer, increment the position modulo N.
+        s = (s + 1) & (N - 1)
+        r = (r + 1) & (N - 1)
+
+        # Register the string in text_buf[r..r+F-1] (insert_node, inlined)
+        keys[r] = key = ((key << 8) & mask) | c
+        p = nodes.get(key)
+        nodes[key] = r
+
+        if p is not None:
+            match_position = p
+            match_length = F
+
+            pp = parent[r] = parent[p]
+            q = lchild[r] = lchild[p]
+            parent[q] = r
+            q = rchild[r] = rchild[p]
+            parent[q] = r
+
+            if rchild[pp] == p:
+                rchild[pp] = r
+            else:
+                lchild[pp] = r
+
+            parent[p] = NIL
+            continue
+
+        first = key >> (8 * (F - 1))
+        p = N + 1 + first
+        rchild[r] = lchild[r] = NIL
+
+        match_length = match_position = 0
+        greater = True
+        lo = first << (8 * (F - 1))
+        hi = lo + (1 << (8 * (F - 1)))
+
+        while 1:
+            if greater:
+                q = rchild[p]
+                if q == NIL:
+                    rchild[p] = r
+                    parent[r] = p
+                    break
+            else:
+                q = lchild[p]
+                if q == NIL:
+                    lchild[p] = r
+                    parent[r] = p
+                    break
+            p = q
+
+            other = keys[p]
+            greater = key > other
+
+            if lo <= other < hi:
+                match_position = p
+                match_length = F - (((key ^ other).bit_length() + 7) >> 3)
+                unshared = 8 * (F - 1 - match_length)
+                lo = key >> unshared << unshared
+                hi = lo + (1 << unshared)
+
+    # Leave the buffer as reading a byte at a time would have: the last N
+    # bytes read, with any of the first F-1 that were read repeated at the end
+    tail = plain[max(0, plain_len - N):]
+    at = (N - F + plain_len - len(tail)) & (N - 1)
+    wrapped = max(0, len(tail) - (N - at))
+    text_buf[at:at+len(tail)-wrapped] = tail[:len(tail)-wrapped]
+    text_buf[:wrapped] = tail[len(tail)-wrapped:]
+    mirrored = min(F - 1, plain_len - F)
+    if mirrored > 0: text_buf[N:N+mirrored] = text_buf[:mirrored]
+
+    for k in range(k, plain_len):
+        # match_length may be spuriously long near the end of text.
+        if match_length > tblen: match_length = tblen
+        if match_length > THRESHOLD:
+            lens[k] = match_length
+            poss[k] = match_position
+
+        delete_node(s)
+
+        # After the end of text, no need to read,
+        s = (s + 1) & (N - 1)
+        r = (r + 1) & (N - 1)
+
+        # but buffer may not be empty.
+        tblen -= 1
+        if tblen:
+            match_position, match_length = insert_node(r, from_bytes(text_buf[r:r+F], 'big'))
+
+    return lens, poss
+
+
+def _pack(plain, lens, poss):
+    # Each flag byte is followed by eight units of code, "1" representing
+    # that the unit is an unencoded letter (1 byte), "0" a position-and-length
+    # pair (2 bytes). The flag byte is patched in when its eight are done.
+    out = bytearray()
+    flag_i = 0
+    flags = 0
+    mask = 1
+    out.append(0)
+
+    plain_len = len(plain)
+    k = 0
+    while k < plain_len:
+        match_length = lens[k]
 
         if match_length <= THRESHOLD:
             # Not long enough match.  Send one byte.
-            match_length = 1
-            code_buf[0] |= mask # 'send one byte' flag
-            code_buf.append(text_buf[r]) # Send uncoded.
+            flags |= mask
+            out.append(plain[k])
+            k += 1
         else:
             # Send position and length pair. Note match_length > THRESHOLD.
-            byte1 = match_position & 0xFF
-            byte2 = (match_position >> 4 & 0xF0) | (match_length - THRESHOLD - 1)
-            code_buf.append(byte1)
-            code_buf.append(byte2)
-
-        # Shift mask left one bit.
-        mask = (mask << 1) & 0xFF
-        # Send at most 8 units of code together
-        if mask == 0:
-            code_buf = bytearray(1)
-            code_buf_list.append(code_buf)
+            match_position = poss[k]
+            out.append(match_position & 0xFF)
+            out.append((match_position >> 4 & 0xF0) | (match_length - THRESHOLD - 1))
+            k += match_length
+
+        mask <<= 1
+        if mask == 0x100:
+            out[flag_i] = flags
+            flag_i = len(out)
+            out.append(0)
+            flags = 0
             mask = 1
 
-        last_match_length = match_length
-        i = 0
-        while i < last_match_length and plain_i < plain_len:
-            tree.delete_node(s) # Delete old strings and
-            c = plain[plain_i]; plain_i += 1
-            text_buf[s] = c # read new bytes
+    if mask == 1:
+        del out[flag_i:] # no units after the last flag byte
+    else:
+        out[flag_i] = flags
+
+    return bytes(out)
+
+
+def warn_about_slowness():
+    global have_warned_about_slowness
+
+    if not have_warned_about_slowness:
+        have_warned_about_slowness = True
+        warn('Using slow pure-Python LZSS compression')
+
+
+def compress(plain):
+    warn_about_slowness()
+
+    plain = memoryview(plain).cast('B')
+    lens, poss = _find_matches(plain)
+
+    # Greedily take every match
+    return _pack(plain, lens, poss)
+
+
+def compress_many(plains):
+    return [compress(p) for p in plains]
+
 
-            # If the position is near the end of buffer, extend the buffer
-            # to make string comparison easier.
-            if s < F - 1:
-                text_buf[s + N] = c
+def compress_optimal(plain):
+    """Make the smallest output the Okumura encoder's matches allow, working
+    backwards from the end. A literal costs 9 bits and a match 17 bits,
+    counting flag bits, and any match can be shortened to 3 bytes.
 
-            # Since this is a ring buffer, increment the position modulo N.
-            s = (s + 1) % N
-            r = (r + 1) % N
+    Returns the output, and the length compress() would give for comparison.
+    """
 
-            # Register the string in text_buf[r..r+F-1]
-            match_position, match_length = tree.insert_node(r, text_buf)
+    warn_about_slowness()
+
+    plain = memoryview(plain).cast('B')
+    lens, poss = _find_matches(plain)
+    plain_len = len(plain)
+
+    cost = [0] * (plain_len + 1)
+    choice = bytearray(plain_len)
+    for k in range(plain_len - 1, -1, -1):
+        best = cost[k + 1] + 9
+        best_len = 1
+        for l in range(THRESHOLD + 1, lens[k] + 1):
+            c = cost[k + l] + 17
+            if c < best:
+                best = c
+                best_len = l
+        cost[k] = best
+        choice[k] = best_len
+
+    return _pack(plain, choice, poss), len(_pack(plain, lens, poss))
+
+
+FAST_HASH_BITS = 15
+FAST_DEPTH = 16
 
-            i += 1
 
-        while i < last_match_length:
-            tree.delete_node(s)
+def compress_fast(plain):
+    """Quick greedy compression for development builds
 
-            # After the end of text, no need to read,
-            s = (s + 1) % N
-            r = (r + 1) % N
+    The output is a valid LZSS stream but not the one compress() makes. This
+    must make exactly the same choices as compress_lzss_fast in fast_lzss.c.
+    """
 
-            # but buffer may not be empty.
-            tblen -= 1
-            if tblen:
-                match_position, match_length = tree.insert_node(r, text_buf)
+    plain = bytes(plain)
+    plain_len = len(plain)
+
+    head = [0] * (1 << FAST_HASH_BITS) # last position (plus one) with each hash
+    prev = [0] * N # and the one before each
+    def fast_hash(i):
+        return (int.from_bytes(plain[i:i+3], 'big') * 2654435761 & 0xFFFFFFFF) >> (32 - FAST_HASH_BITS)
+
+    out = bytearray()
+    flag_i = 0
+    flags = 0
+    mask = 1
+    out.append(0)
+
+    i = 0
+    while i < plain_len:
+        best_len = best_pos = 0
+        max_len = min(F, plain_len - i)
+
+        if max_len > THRESHOLD:
+            cand = head[fast_hash(i)]
+            for depth in range(FAST_DEPTH):
+                if not cand: break
+                j = cand - 1
+                if i - j > N - F: break # would no longer be in the ring buffer
+
+                if plain[j + best_len] == plain[i + best_len]:
+                    length = 0
+                    while length < max_len and plain[j + length] == plain[i + length]:
+                        length += 1
+                    if length > best_len:
+                        best_len = length
+                        best_pos = j
+                        if length == max_len: break
+
+                cand = prev[j % N]
+
+        if best_len > THRESHOLD:
+            # input offset k went into the ring buffer at (k + N - F) % N
+            best_pos = (best_pos + N - F) % N
+            out.append(best_pos & 0xFF)
+            out.append((best_pos >> 4 & 0xF0) | (best_len - THRESHOLD - 1))
+        else:
+            best_len = 1
+            flags |= mask
+            out.append(plain[i])
+
+        mask <<= 1
+        if mask == 0x100:
+            out[flag_i] = flags
+            flag_i = len(out)
+            out.append(0)
+            flags = 0
+            mask = 1
 
-            i += 1
+        for i in range(i, i + best_len):
+            if plain_len - i > THRESHOLD:
+                h = fast_hash(i)
+                prev[i % N] = head[h]
+                head[h] = i + 1
+        i += 1
 
-        # until length of string to be processed is zero
-        if tblen == 0: break
+    if mask == 1:
+        del out[flag_i:]
+    else:
+        out[flag_i] = flags
 
-    if len(code_buf_list[-1]) == 1:
-        code_buf_list.pop()
+    return bytes(out)
 
-    return b''.join(code_buf_list)
@@ -7,6 +7,9 @@ from . import lowlevel
 from . import dispatcher
 
 
+# The file that marks a directory as this format
+SIGNATURE = 'Romfile'
+
 ALIGN = 16
 REV_COMBO_FIELDS = {v: k for (k, v) in lowlevel.COMBO_FIELDS.items()}
 
@@ -22,13 +25,10 @@ def checksum(binary):
     struct.pack_into('>L', binary, 0, oneword)
 
 
-def build(src):
-    if not path.exists(path.join(src, 'Romfile')): raise dispatcher.WrongFormat
-
-    romfile = dispatcher.build(path.join(src, 'Romfile')).decode('utf8').split('\n')
-
+def parse_romfile(romfile):
+    rom_size = None
     rsrc_list = []
-    for l in romfile:
+    for l in romfile.decode('utf8').split('\n'):
         words = shlex.split(l, comments=True, posix=True)
 
         thisdict = {}
@@ -47,6 +47,33 @@ def build(src):
         elif 'type' in thisdict:
             rsrc_list.append(thisdict)
 
+    return rom_size, rsrc_list
+
+
+def deps(src):
+    if not path.exists(path.join(src, 'Romfile')): raise dispatcher.WrongFormat
+
+    # Only a plain Romfile can be read without building anything
+    try:
+        with open(path.join(src, 'Romfile'), 'rb') as f:
+            rom_size, rsrc_list = parse_romfile(f.read())
+    except IsADirectoryError:
+        rsrc_list = []
+
+    found = [path.join(src, 'Romfile'), path.join(src, 'MainCode')]
+    if path.exists(path.join(src, 'DeclData')) or path.exists(path.join(src, 'DeclData.src')):
+        found.append(path.join(src, 'DeclData'))
+    found.extend(path.join(src, r['src']) for r in rsrc_list)
+
+    return [(p, None) for p in found]
+
+
+def build(src):
+    if not path.exists(path.join(src, 'Romfile')): raise dispatcher.WrongFormat
+
+    romfile = dispatcher.build(path.join(src, 'Romfile'))
+    rom_size, rsrc_list = parse_romfile(romfile)
+
     rom = bytearray(b'kc' * (rom_size // 2))
     free_map = bytearray(b'X' * (rom_size // ALIGN))
 
@@ -1,4 +1,5 @@
 from os import path
+import io
 import os
 import shlex
 
@@ -45,12 +46,27 @@ def clean_maincode(binary):
     return bytes(binary)
 
 
+def find_decldata(binary):
+    # Where DeclData starts, after the padding, or -1 if this is no SuperMario
+    # ROM. The header is checked first, so that most other images are turned
+    # away without a search through all of them.
+    if len(binary) not in (0x200000, 0x300000): return -1
+
+    reshead = SuperMarioHeader.unpack_from(binary).RomRsrc
+    if not SuperMarioHeader.size <= reshead <= len(binary) - ResHeader.size: return -1
+    if ResHeader.unpack_from(binary, reshead).offsetToFirst >= len(binary): return -1
+
+    pad_at = binary.rfind(PAD)
+    if pad_at == -1: return -1
+    return pad_at + len(PAD)
+
+
 def is_supermario(binary):
-    return (len(binary) in (0x200000, 0x300000)) and (PAD in binary)
+    return find_decldata(binary) != -1
 
 
-def extract_decldata(binary):
-    return binary[binary.rfind(PAD) + len(PAD):]
+def sniff(binary):
+    return 0.5 if is_supermario(binary) else 0
 
 
 # Get a list of (entry_offset, data_offset, data_len)
@@ -98,22 +114,25 @@ def ljustspc(s, n):
 
 
 def dump(binary, dest_dir):
-    if not is_supermario(binary): raise dispatcher.WrongFormat
+    decldata_at = find_decldata(binary)
+    if decldata_at == -1: raise dispatcher.WrongFormat
 
     os.makedirs(dest_dir, exist_ok=True)
 
-    with open(path.join(dest_dir, 'Romfile'), 'w') as f:
+    with io.StringIO() as f:
         print(HEADER_COMMENT +  '\n', file=f)
         print('rom_size=%s\n' % hex(len(binary)), file=f)
 
         header = SuperMarioHeader.unpack_from(binary)
 
         main_code = clean_maincode(binary[:header.RomRsrc])
-        dispatcher.dump(main_code, path.join(dest_dir, 'MainCode'))
+        jobs = [(main_code, path.join(dest_dir, 'MainCode'))]
 
-        decldata = extract_decldata(binary)
+        decldata = binary[decldata_at:]
         if decldata:
-            dispatcher.dump(decldata, path.join(dest_dir, 'DeclData'))
+            jobs.append((decldata, path.join(dest_dir, 'DeclData')))
+
+        dispatcher.dump_many(jobs)
 
         # now for the tricky bit: resources :(
         unavail_filenames = set(['', '.pef', '.pict'])
@@ -163,8 +182,7 @@ def dump(binary, dest_dir):
 
             unavail_filenames.add(filename)
 
-            with open(path.join(rsrc_dir, filename), 'wb') as f2:
-                f2.write(data)
+            dispatcher.write(path.join(rsrc_dir, filename), data)
 
             filename = path.join('Rsrc', filename)
 
@@ -181,3 +199,5 @@ def dump(binary, dest_dir):
             report = report.rstrip()
 
             print(report, file=f)
+
+        dispatcher.write(path.join(dest_dir, 'Romfile'), f.getvalue())
@@ -0,0 +1,61 @@
+# Time the LZSS compressors on synthetic ROM-sized inputs:
+#     python tests/bench_lzss.py [size-in-KB]
+#
+# The pure-Python compressor is timed against the one it replaced
+# (orig_slow_lzss.py) as well as against the C version.
+
+import random
+import sys
+import time
+import warnings
+
+from tbxi import slow_lzss
+
+import orig_slow_lzss
+from test_lzss import romlike
+
+try:
+    from tbxi import fast_lzss
+except ImportError:
+    fast_lzss = None
+
+
+def bench(name, func, data):
+    start = time.perf_counter()
+    packed = func(data)
+    secs = time.perf_counter() - start
+    print('%-24s %8.2f s %8.2f MB/s' % (name, secs, len(data) / secs / 1e6))
+    return packed, secs
+
+
+def main(args):
+    size = int(args[0]) * 1024 if args else 1024 * 1024
+    rng = random.Random(0)
+    corpora = [
+        ('ROM-like', romlike(size, seed=0)),
+        ('random', bytes(rng.getrandbits(8) for x in range(size))),
+        ('text-like', bytes(rng.choice(b'etaoin shrdlu\n') for x in range(size))),
+    ]
+
+    warnings.simplefilter('ignore')
+    for kind, data in corpora:
+        print('%d bytes of %s data' % (len(data), kind))
+
+        packed, old_secs = bench('orig_slow_lzss.compress', orig_slow_lzss.compress, data)
+        new_packed, new_secs = bench('slow_lzss.compress', slow_lzss.compress, data)
+        assert new_packed == packed
+        print('%-24s %8.2fx' % ('speedup', old_secs / new_secs))
+
+        if fast_lzss is not None:
+            assert bench('fast_lzss.compress', fast_lzss.compress, data)[0] == packed
+
+        assert bench('slow_lzss.decompress', slow_lzss.decompress, packed)[0] == data
+
+        if fast_lzss is not None:
+            assert bench('fast_lzss.decompress', fast_lzss.decompress, packed)[0] == data
+
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,86 @@
+from tbxi import binhex
+import io
+import pytest
+import random
+
+def encode(data, rsrc, chunks, badcrc=False):
+    out = io.BytesIO()
+    out.close = lambda: None # keep the contents around
+    finfo = binhex.FInfo()
+    finfo.Type = b'tbxi'
+    finfo.Creator = b'chrp'
+    bh = binhex.BinHex(('Mac OS ROM', finfo, len(data), len(rsrc)), out)
+    i = 0
+    while i < len(data):
+        n = random.choice(chunks)
+        bh.write(data[i:i+n])
+        i += n
+    bh.write_rsrc(rsrc)
+    if badcrc: bh.crc ^= 1
+    bh.close()
+    return out.getvalue()
+
+def test_round_trip():
+    for the_len in [0, 1, 2, 3, 1000, 100000]:
+        # Lots of RUNCHARs and runs, including runs of RUNCHAR
+        data = bytes(random.choice(b'\0\0\x90\x90ab') for x in range(the_len))
+        rsrc = bytes(random.choice(b'\x90xy') for x in range(random.randrange(3000)))
+        hqx = encode(data, rsrc, [1, 7, 1000, 40000])
+
+        for text in (hqx, hqx.replace(b'\n', b'\r\n')):
+            hb = binhex.HexBin(io.BytesIO(text))
+            assert hb.FName == b'Mac OS ROM'
+            assert hb.FInfo.Type == b'tbxi'
+
+            got = bytearray()
+            while True:
+                d = hb.read(random.choice([1, 3, 5000, 100000]))
+                if not d: break
+                got += d
+            assert got == data
+            assert hb.read_rsrc() == rsrc
+            hb.close()
+
+def test_chunking():
+    # The run that encodes 0x90 0x90 0x90 must survive any split
+    data = (b'a\x90' * 90 + b'\x90' * 150 + b'\x00' * 300) * 200
+    hqx = encode(data, b'', [len(data)])
+
+    for n in [1, 2, 3, 4, 99, 0x8001]:
+        hb = binhex.HexBin(io.BytesIO(hqx))
+        got = bytearray()
+        while len(got) < len(data):
+            got += hb.read(n)
+        assert got == data
+
+def classic(text):
+    hb = binhex.HexBin(io.BytesIO(text))
+    data = hb.read()
+    rsrc = hb.read_rsrc()
+    return hb.FName, vars(hb.FInfo), data, rsrc
+
+def test_hexbin_forks(tmp_path, monkeypatch):
+    data = bytes(random.choice(b'\0\0\x90\x90ab') for x in range(20000))
+    rsrc = bytes(random.choice(b'\x90xy') for x in range(3000))
+    text = encode(data, rsrc, [1000])
+
+    # Chunks that split lines and groups anywhere, and chunks of line breaks
+    for chunk in [7, 63, 64, 1000]:
+        monkeypatch.setattr(binhex, 'HQX_CHUNK', chunk)
+        for tryout in [text, text.replace(b'\n', b'\r\n'), text.replace(b'\n', b'\n' * 5), encode(b'', b'', [1])]:
+            (tmp_path / 'x.hqx').write_bytes(tryout)
+            fname, finfo, gotdata, gotrsrc = binhex._hexbin_forks_mmap(tryout, 4)
+            assert (fname, vars(finfo), gotdata, gotrsrc) == classic(tryout)
+            assert binhex.hexbin_forks(str(tmp_path / 'x.hqx'))[2:] == (gotdata, gotrsrc)
+
+    # A bad resource fork CRC goes unnoticed by HexBin.read_rsrc(), and so
+    # by the fallback, but a bad data fork CRC does not
+    bad = encode(data, rsrc, [1000], badcrc=True)
+    with pytest.raises(binhex.Error):
+        binhex._hexbin_forks_mmap(bad, 4)
+    (tmp_path / 'bad.hqx').write_bytes(bad)
+    assert binhex.hexbin_forks(str(tmp_path / 'bad.hqx'))[3] == classic(bad)[3]
+
+    (tmp_path / 'empty.hqx').write_bytes(b'')
+    with pytest.raises(binhex.Error):
+        binhex.hexbin_forks(str(tmp_path / 'empty.hqx'))
@@ -0,0 +1,94 @@
+from tbxi import cache, lzss
+import os
+import random
+import pytest
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    saved = cache.directory
+    cache.directory = str(tmp_path)
+    yield tmp_path
+    cache.directory = saved
+
+def test_load_store(cache_dir):
+    k = cache.key('test', b'hello')
+    assert k != cache.key('test', b'hell', b'o')
+    assert cache.load(k) is None
+
+    cache.store(k, b'world')
+    assert cache.load(k) == b'world'
+
+def test_evict(cache_dir):
+    keys = [cache.key('test', bytes([i])) for i in range(10)]
+    for i, k in enumerate(keys):
+        cache.store(k, bytes(100))
+        os.utime(cache._path(k), (i, i))
+
+    cache.load(keys[0]) # now the most recently used
+    cache.evict(500)
+
+    assert cache.load(keys[0]) is not None
+    assert [cache.load(k) for k in keys[1:6]] == [None] * 5
+    assert None not in [cache.load(k) for k in keys[6:]]
+
+def test_lzss_cache(cache_dir):
+    data = b'the same old thing ' * 100
+    packed = lzss.compress(data)
+
+    # A cache hit skips the compressor entirely
+    cache.store(lzss.cache_key(data), b'cached')
+    assert lzss.compress(data) == b'cached'
+    assert lzss.compress(data, 'okumura') == b'cached'
+
+    cache.directory = None
+    assert lzss.compress(data) == packed
+
+def test_unlzss_cache(cache_dir):
+    data = b'the same old thing ' * 100
+    packed = lzss.compress(data)
+
+    assert lzss.decompress_cached(packed) == data
+    assert cache.load(lzss.unpack_key(packed)) == data
+
+    # A cache hit skips the decompressor, unless the length is wrong
+    cache.store(lzss.unpack_key(packed), b'cached')
+    assert lzss.decompress_cached(packed) == b'cached'
+    assert lzss.decompress_cached(packed, len(data)) == data
+
+def test_store_threads(cache_dir, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    monkeypatch.setattr(cache, 'max_size', 1000)
+
+    walks = []
+    entries = cache._entries
+    monkeypatch.setattr(cache, '_entries', lambda: walks.append(1) or entries())
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: cache.store(cache.key('test', bytes([i])), bytes(100)), range(40)))
+
+    # Each eviction saw what the last one left, so none went too far
+    total = sum(size for (mtime, size, p) in entries())
+    assert 1000 - 1000 // 8 - 100 < total <= 1000
+    assert len(walks) < 20
+
+def test_store_failure(cache_dir, monkeypatch):
+    def replace(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'replace', replace)
+
+    cache.store(cache.key('test', b'x'), b'data')
+    assert [name for (parent, dirs, files) in os.walk(cache_dir) for name in files] == []
+
+def test_optimal_saved_cached(cache_dir):
+    rng = random.Random(1)
+    data = bytes(rng.choice(b'ab ') for x in range(5000))
+
+    counts = []
+    for attempt in range(2):
+        saved = lzss.optimal_saved
+        packed = lzss.compress(data, 'optimal')
+        counts.append(lzss.optimal_saved - saved)
+
+    # The second time is a cache hit, and counts the same saving
+    assert counts[0] == counts[1] == len(lzss.compress(data, 'okumura')) - len(packed)
+    assert counts[0] > 0
@@ -0,0 +1,225 @@
+from tbxi import dispatcher
+import types
+
+def fake_format(magic, log):
+    def sniff(binary):
+        return 1.0 if binary.startswith(magic) else 0
+
+    def dump(binary, dest_dir):
+        log.append(magic)
+        if binary == magic + b' but wrong': raise dispatcher.WrongFormat
+
+    return types.SimpleNamespace(sniff=sniff, dump=dump)
+
+def test_sniff(tmp_path, monkeypatch):
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+    log = []
+    dispatcher.register('fake', fake_format(b'FAKE', log))
+    dispatcher.register('other', fake_format(b'OTHER', log))
+
+    assert [fmt for (fmt, mod) in dispatcher.sniff(b'prcl' + bytes(100))] == ['parcels']
+    assert [fmt for (fmt, mod) in dispatcher.sniff(b'FAKE data')] == ['fake']
+    assert [fmt for (fmt, mod) in dispatcher.sniff((b'FAKE data', []))] == ['fake']
+    assert dispatcher.sniff(bytes(0x400000)) == []
+
+    # Only the winner gets to dump
+    dispatcher.dump(b'OTHER data', str(tmp_path / 'x'))
+    assert log == [b'OTHER']
+    assert (tmp_path / 'x').read_bytes() == b'OTHER data'
+
+    # Nothing fits, so the blob is just written out
+    dispatcher.dump(b'FAKE but wrong', str(tmp_path / 'y'))
+    dispatcher.dump(b'nothing', str(tmp_path / 'z'))
+    assert log == [b'OTHER', b'FAKE']
+    assert (tmp_path / 'z').read_bytes() == b'nothing'
+
+def test_sniff_supermario(monkeypatch):
+    from tbxi import supermario_dump
+    from tbxi.lowlevel import SuperMarioHeader
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+
+    binary = bytearray(0x200000)
+    binary[0x100000:0x100000+len(supermario_dump.PAD)] = supermario_dump.PAD
+    assert dispatcher.sniff(bytes(binary)) == [] # no resources in the header
+
+    binary[26:30] = (0x1000).to_bytes(4, 'big')
+    assert SuperMarioHeader.unpack_from(binary).RomRsrc == 0x1000
+    assert [fmt for (fmt, mod) in dispatcher.sniff(bytes(binary))] == ['supermario']
+    assert supermario_dump.find_decldata(binary) == 0x100000 + len(supermario_dump.PAD)
+
+def test_resolve(tmp_path, monkeypatch):
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+
+    assert dispatcher.resolve(str(tmp_path / 'missing')) == []
+    (tmp_path / 'file').write_bytes(b'')
+    assert dispatcher.resolve(str(tmp_path / 'file')) == []
+
+    (tmp_path / 'Romfile').write_text('')
+    (tmp_path / 'Parcelfile').write_text('')
+    assert [fmt for (fmt, mod) in dispatcher.resolve(str(tmp_path))] == ['parcels', 'supermario']
+
+    # The marker goes first
+    (tmp_path / dispatcher.MARKER).write_text('supermario\n')
+    assert [fmt for (fmt, mod) in dispatcher.resolve(str(tmp_path))] == ['supermario', 'parcels']
+
+def test_dump_many(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+
+    # A format whose children are nested blobs of the same format
+    def sniff(binary):
+        return 1.0 if binary.startswith(b'NEST') else 0
+
+    def dump(binary, dest_dir):
+        import os, random, time
+        os.makedirs(dest_dir, exist_ok=True)
+        time.sleep(random.random() / 100)
+        kids = binary[4:].split(b'/', 1)[0]
+        dispatcher.dump_many((b'NEST' + bytes(kids[:i]), os.path.join(dest_dir, str(i))) for i in range(len(kids)))
+
+    dispatcher.register('nest', types.SimpleNamespace(sniff=sniff, dump=dump))
+
+    results = []
+    for threads in [1, 4]:
+        monkeypatch.setattr(dispatcher, 'threads', threads)
+        dest = tmp_path / str(threads)
+        dispatcher.dump(b'NEST\0\0\0\0', str(dest), toplevel=True)
+        tree = {p.relative_to(dest): p.read_bytes() for p in dest.rglob('*') if p.is_file()}
+        results.append((tree, capsys.readouterr().out))
+
+    assert results[0] == results[1]
+    assert results[0][1].count('nest') == 16
+
+def test_build_tree(tmp_path, monkeypatch, capsys):
+    from tbxi import parcels_build, lzss
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+
+    compressed = []
+    def compress(data):
+        compressed.append(data)
+        return lzss.compress(data)
+    monkeypatch.setattr(parcels_build, 'compress', compress)
+
+    # The same inner parcels, and the same blob, are used more than once
+    inner = tmp_path / 'inner.src'
+    inner.mkdir()
+    (inner / 'Parcelfile').write_text('prop\n\tnlib name=a src=blob.lzss\n')
+    (inner / 'blob').write_bytes(b'blob' * 1000)
+    (tmp_path / 'Parcelfile').write_text('prop\n\tnlib name=x src=inner.lzss\n\tnlib name=y src=inner\n\tnlib name=z src=inner.src/blob.lzss\n')
+
+    assert [len(level) for level in dispatcher.plan(str(tmp_path))] == [1, 2, 1]
+
+    results = []
+    for tree in [False, True]:
+        compressed.clear()
+        monkeypatch.setattr(dispatcher, 'threads', 4)
+        if tree:
+            data = dispatcher.build_tree(str(tmp_path))
+        else:
+            data = dispatcher.build(str(tmp_path))
+        results.append((data, capsys.readouterr().out))
+        calls = len(compressed)
+
+    assert results[0] == results[1]
+    assert results[0][1] == 'parcels\n' * 3
+    assert calls == 2 # once each for the blob and the inner parcels
+
+def test_build_cache(tmp_path, monkeypatch, capsys):
+    from tbxi import cache
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+    monkeypatch.setattr(cache, 'directory', str(tmp_path / 'cache'))
+
+    src = tmp_path / 'src'
+    inner = src / 'inner.src'
+    inner.mkdir(parents=True)
+    (inner / 'Parcelfile').write_text('prop\n\tnlib name=a src=blob.lzss\n')
+    (inner / 'blob').write_bytes(b'blob' * 1000)
+    (src / 'other').write_bytes(b'other')
+    (src / 'Parcelfile').write_text('prop\n\tnlib name=x src=inner.lzss\n\tnlib name=y src=../outside\n')
+    (tmp_path / 'outside').write_bytes(b'outside')
+
+    def build(**kw):
+        for k, v in kw.items(): monkeypatch.setattr(dispatcher, k, v)
+        hits, misses = dispatcher.cache_hits, dispatcher.cache_misses
+        data = dispatcher.build_tree(str(src))
+        assert capsys.readouterr().out == 'parcels\n' * 2
+        return data, dispatcher.cache_hits - hits, dispatcher.cache_misses - misses
+
+    data, hits, misses = build()
+    assert (hits, misses) == (0, 2)
+    assert build() == (data, 2, 0)
+    assert build(rebuild=True) == (data, 0, 2)
+
+    # Only the edited subtree is built again
+    (inner / 'blob').write_bytes(b'blob' * 999)
+    data2, hits, misses = build(rebuild=False)
+    assert (hits, misses) == (0, 2)
+    assert data2 != data
+    (inner / 'blob').write_bytes(b'blob' * 1000)
+    assert build() == (data, 2, 0)
+
+    # A file outside the tree that the tree names counts too
+    (tmp_path / 'outside').write_bytes(b'elsewhere')
+    assert build()[1:] == (1, 1)
+
+    # Any other file in the tree counts too, by content and by name
+    (src / 'other').write_bytes(b'changed')
+    assert build()[1:] == (1, 1)
+    (src / 'other').rename(src / 'renamed')
+    assert build()[1:] == (1, 1)
+
+    # So does a different tbxi
+    assert build()[1:] == (2, 0)
+    monkeypatch.setattr(dispatcher, '_code', 'patched')
+    assert build()[1:] == (0, 2)
+
+def test_run_all(monkeypatch):
+    import threading, time
+    monkeypatch.setattr(dispatcher, 'threads', 3)
+
+    # Nested three deep, with more items than threads at every level
+    lock = threading.Lock()
+    busy = set()
+    most = []
+    def work(depth):
+        if depth == 0:
+            with lock:
+                busy.add(threading.get_ident())
+                most.append(len(busy))
+            time.sleep(0.001)
+            with lock:
+                busy.discard(threading.get_ident())
+            return 1
+        return sum(dispatcher.run_all(work, [depth - 1] * 4))
+
+    assert dispatcher.run_all(work, [3] * 4) == [64] * 4
+    assert max(most) <= 3
+
+def test_build_cycle(tmp_path, monkeypatch):
+    import threading
+    from tbxi import parcels_build
+    monkeypatch.setattr(dispatcher, '_plugins', {})
+
+    # One tree that names itself, and two that name each other
+    (tmp_path / 'self.src').mkdir()
+    (tmp_path / 'self.src' / 'Parcelfile').write_text('prop\n\tnlib name=x src=../self\n')
+    for a, b in [('a', 'b'), ('b', 'a')]:
+        (tmp_path / (a + '.src')).mkdir()
+        (tmp_path / (a + '.src') / 'Parcelfile').write_text('prop\n\tnlib name=x src=blob\n\tnlib name=y src=../%s\n' % b)
+        (tmp_path / (a + '.src') / 'blob').write_bytes(b'blob')
+
+    for threads in [1, 4]:
+        monkeypatch.setattr(dispatcher, 'threads', threads)
+        for name in ['self', 'a']:
+            errors = []
+            def attempt():
+                try:
+                    dispatcher.build_tree(str(tmp_path / name))
+                except parcels_build.PdslParseError as e:
+                    while e.__cause__ is not None: e = e.__cause__
+                    errors.append(e)
+
+            t = threading.Thread(target=attempt, daemon=True)
+            t.start()
+            t.join(10)
+            assert not t.is_alive() # no deadlock
+            assert [type(e) for e in errors] == [dispatcher.CycleError]
@@ -0,0 +1,93 @@
+from tbxi import slow_hqx
+import orig_slow_hqx
+import random
+import pytest
+
+# Both versions are checked against the pure-Python code they replaced
+@pytest.fixture(params=['slow_hqx', 'fast_hqx'])
+def mod(request):
+    return pytest.importorskip('tbxi.' + request.param)
+
+def corpora():
+    yield b''
+    yield b'\x90'
+    yield b'\x90\x90\x90'
+    yield bytes(1000)
+    yield b'a' * 254 + b'b' * 255 + b'c' * 256 + b'd' * 600
+    for n in [1, 2, 3, 4, 5, 100, 10000]:
+        yield bytes(random.getrandbits(8) for x in range(n))
+        yield bytes(random.choice(b'\0\0\0\x90ab') for x in range(n))
+
+def check_b2a(mod, tryout):
+    hqx = mod.b2a(tryout)
+    try:
+        expected = orig_slow_hqx.b2a(tryout)
+    except IndexError:
+        # The original overran its table on some trailing partial groups
+        assert len(tryout) % 3
+        assert mod.a2b(hqx + b':')[0][:len(tryout)] == tryout
+    else:
+        assert hqx == expected
+    return hqx
+
+def a2b_or_incomplete(mod, hqx):
+    try:
+        return mod.a2b(hqx)
+    except mod.Incomplete:
+        return 'Incomplete'
+
+def test_b2a_a2b(mod):
+    for tryout in corpora():
+        hqx = check_b2a(mod, tryout)
+
+        # Line breaks are ignored and ':' stops decoding
+        wrapped = b'\n'.join(hqx[i:i+64] for i in range(0, len(hqx), 64)) + b'\r\n:junk'
+        assert mod.a2b(wrapped) == orig_slow_hqx.a2b(wrapped)
+        if len(tryout) % 3 == 0:
+            assert mod.a2b(hqx) == (tryout, 0)
+        assert mod.a2b(wrapped)[0][:len(tryout)] == tryout
+
+def test_a2b_errors(mod):
+    assert mod.a2b(b'!!!!') == (b'\0\0\0', 0)
+    assert mod.a2b(b'!!!!!:') == (b'\0\0\0', 1)
+
+    with pytest.raises(mod.Incomplete):
+        mod.a2b(b'!')
+    with pytest.raises(KeyError):
+        mod.a2b(b'!!!~')
+
+def test_crc(mod):
+    for tryout in corpora():
+        for start in [0, 1, 0xffff, 0x12345, -1]:
+            assert mod.crc(tryout, start) == orig_slow_hqx.crc(tryout, start)
+
+def test_rle(mod):
+    for tryout in corpora():
+        rle = mod.rle_encode(tryout)
+        assert rle == orig_slow_hqx.rle_encode(tryout)
+        assert mod.rle_decode(rle) == orig_slow_hqx.rle_decode(rle) == tryout
+
+    assert mod.rle_decode(b'a\x90\x01\x90\x00\x90\x03') == b'a\x90\x90\x90'
+
+    with pytest.raises(mod.Incomplete):
+        mod.rle_decode(b'abc\x90')
+    with pytest.raises(ValueError):
+        mod.rle_decode(b'\x90\x05')
+
+def test_differential(mod):
+    # Lots of small awkward inputs
+    for i in range(2000):
+        tryout = bytes(random.choice(b'\0\x90\xffa') for x in range(random.randrange(600)))
+        assert mod.rle_encode(tryout) == orig_slow_hqx.rle_encode(tryout)
+        rle = b'a' + tryout.rstrip(b'\x90')
+        assert mod.rle_decode(rle) == orig_slow_hqx.rle_decode(rle)
+        check_b2a(mod, tryout)
+        assert mod.crc(tryout, i) == orig_slow_hqx.crc(tryout, i)
+
+        hqx = bytes(random.choice(b'!!!r\r\n:') for x in range(random.randrange(50)))
+        assert a2b_or_incomplete(mod, hqx) == a2b_or_incomplete(orig_slow_hqx, hqx)
+
+def test_slow_matches_fast():
+    fast_hqx = pytest.importorskip('tbxi.fast_hqx')
+    for tryout in corpora():
+        assert slow_hqx.b2a(tryout) == fast_hqx.b2a(tryout)
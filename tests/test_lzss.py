@@ -1,6 +1,8 @@
 from tbxi.slow_lzss import decompress
 from tbxi.fast_lzss import compress
+from tbxi import slow_lzss, fast_lzss, lzss, dispatcher
 import random
+import pytest
 
 def test_random():
     the_len = 0
@@ -11,3 +13,292 @@ def test_random():
         tryout = bytes(random.choice(range(256)) for x in range(the_len))
 
         assert decompress(compress(tryout)) == tryout
+
+def test_fast_decompress():
+    for the_len in [1, 2, 17, 18, 19, 4096, 100000]:
+        tryout = bytes(random.choice(b'\0 abc') for x in range(the_len))
+        packed = compress(tryout)
+
+        assert fast_lzss.decompress(packed) == tryout
+        assert fast_lzss.decompress(packed, len(tryout)) == tryout
+        assert fast_lzss.decompress(memoryview(packed)) == tryout
+
+        # Truncated streams should stop exactly where the slow version does
+        for cut in range(1, min(len(packed), 40)):
+            assert fast_lzss.decompress(packed[:-cut]) == slow_lzss.decompress(packed[:-cut])
+
+def test_slow_decompress():
+    # Any bytes are a valid LZSS stream, including references into the
+    # dictionary's initial spaces and copies that overlap themselves
+    for x in range(500):
+        tryout = bytes(random.getrandbits(8) for x in range(random.randrange(300)))
+        assert slow_lzss.decompress(tryout) == fast_lzss.decompress(tryout)
+
+    assert slow_lzss.decompress(b'\0\0\xff') == b' ' * 18
+    assert slow_lzss.decompress(memoryview(b'\x01a\xee\xf0')) == b'a' * 4
+
+def test_expected_len():
+    packed = compress(b'hello hello hello')
+
+    for mod in (slow_lzss, fast_lzss):
+        with pytest.raises(ValueError):
+            mod.decompress(packed, 16)
+        with pytest.raises(ValueError):
+            mod.decompress(packed, 18)
+
+def test_decompress_into():
+    tryout = b'The quick brown fox jumps over the lazy dog. ' * 20
+    packed = compress(tryout)
+
+    for mod in (slow_lzss, fast_lzss):
+        buf = bytearray(b'!' * (len(tryout) + 8))
+        assert mod.decompress_into(packed, buf, 4) == len(tryout)
+        assert buf == b'!!!!' + tryout + b'!!!!'
+
+        buf = bytearray(len(tryout))
+        assert mod.decompress_into(packed, memoryview(buf)) == len(tryout)
+        assert buf == tryout
+
+        with pytest.raises(ValueError):
+            mod.decompress_into(packed, bytearray(len(tryout)), 1)
+
+def romlike(the_len, seed=None):
+    # Code-ish data: repeated instruction words, tables and strings
+    rng = random.Random(seed)
+    words = [rng.getrandbits(32).to_bytes(4, 'big') for x in range(200)]
+    strings = [bytes(rng.choice(b'abcdefgh ') for x in range(rng.randrange(4, 30))) for x in range(50)]
+    out = bytearray()
+    while len(out) < the_len:
+        kind = rng.randrange(4)
+        if kind == 0:
+            out += b''.join(rng.choice(words[:20]) for x in range(rng.randrange(1, 30)))
+        elif kind == 1:
+            out += rng.choice(strings)
+        elif kind == 2:
+            out += bytes(rng.randrange(1, 200))
+        else:
+            out += rng.choice(words)
+    return bytes(out[:the_len])
+
+def test_segments():
+    corpora = [
+        romlike(0x60000),
+        bytes(random.getrandbits(8) for x in range(0x30000)),
+        bytes(0x30000),
+        b'0123456789abcdef!' * 0x3000,
+    ]
+
+    for tryout in corpora:
+        ref = fast_lzss.compress(tryout)
+
+        for warmup in [0, 0x1000, 0x4000, lzss.WARMUP]:
+            for seglen in [0x1000, 0x8000, 0x10000, 0x10007]:
+                bounds = list(range(seglen, len(tryout), seglen))
+                assert lzss.compress_segments(tryout, bounds, warmup) == ref
+
+def test_segments_accepted(monkeypatch):
+    # Byte-identity alone would pass with every segment rejected
+    used = []
+    pack_tokens = lzss.pack_tokens
+    monkeypatch.setattr(lzss, 'pack_tokens', lambda encoders: used.append(len(encoders)) or pack_tokens(encoders))
+
+    tryout = romlike(4 * lzss.WARMUP, seed=0)
+    bounds = [2 * lzss.WARMUP, 3 * lzss.WARMUP]
+    assert lzss.compress_segments(tryout, bounds) == fast_lzss.compress(tryout)
+    assert used == [3]
+
+def test_encoder_threads():
+    # Threads sharing an Encoder take turns instead of corrupting it
+    from concurrent.futures import ThreadPoolExecutor
+
+    tryout = romlike(0x40000, seed=0)
+    enc = fast_lzss.Encoder(tryout)
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(enc.run, range(0x1000, len(tryout), 0x1000)))
+        list(pool.map(lambda i: enc.same_state(enc.copy()), range(8)))
+    enc.run()
+    assert fast_lzss.pack_tokens([enc, enc.copy()]) == fast_lzss.compress(tryout)
+
+def test_modes(monkeypatch):
+    tryout = romlike(0x90000)
+    ref = fast_lzss.compress(tryout)
+
+    monkeypatch.setattr(lzss, 'MIN_SEGMENT', 0x10000)
+    monkeypatch.setattr(dispatcher, 'threads', 4)
+    assert lzss.compress(tryout) == ref
+    assert lzss.compress(tryout, 'okumura') == ref
+    assert lzss.compress(b'') == b''
+    assert lzss.compress(b'x') == fast_lzss.compress(b'x')
+    with pytest.raises(ValueError):
+        lzss.compress(tryout, 'bogus')
+
+def test_modes_share_threads(monkeypatch):
+    # Segments of children compressed in parallel don't start threads of their own
+    import threading
+
+    tryout = romlike(0x40000, seed=0)
+    monkeypatch.setattr(lzss, 'MIN_SEGMENT', 0x10000)
+    monkeypatch.setattr(dispatcher, 'threads', 3)
+
+    counts = []
+    def encoder(*args):
+        counts.append(threading.active_count())
+        return fast_lzss.Encoder(*args)
+    monkeypatch.setattr(lzss, 'Encoder', encoder)
+
+    dispatcher.run_all(lzss.compress, [tryout] * 4) # starts the shared workers
+    baseline = threading.active_count()
+    del counts[:]
+    assert dispatcher.run_all(lzss.compress, [tryout] * 4) == [fast_lzss.compress(tryout)] * 4
+    assert counts and max(counts) <= baseline
+
+def test_compress_buffers():
+    tryout = romlike(0x20000)
+    ref = fast_lzss.compress(tryout)
+
+    assert fast_lzss.compress(bytearray(tryout)) == ref
+    assert fast_lzss.compress(memoryview(tryout)) == ref
+    assert fast_lzss.compress(memoryview(b'xx' + tryout)[2:]) == ref
+
+    # Incompressible data takes exactly the worst-case bound
+    for the_len in [1, 7, 8, 9, 256]:
+        tryout = bytes(random.sample(range(256), the_len))
+        assert len(fast_lzss.compress(tryout)) == the_len + (the_len + 7) // 8
+
+@pytest.mark.parametrize('mod', [slow_lzss, fast_lzss])
+def test_decompressor(mod):
+    tryout = romlike(0x8000)
+    packed = compress(tryout)
+
+    for expected_len in [None, len(tryout)]:
+        obj = mod.LZSSDecompressor(expected_len)
+        out = bytearray()
+        i = 0
+        while i < len(packed) or not (obj.needs_input or obj.eof):
+            n = random.choice([0, 1, 2, 3, 100])
+            out += obj.feed(packed[i:i+n], random.choice([-1, 0, 1, 19, 1000]))
+            i += n
+        assert out == tryout
+        assert obj.eof == (expected_len is not None)
+
+    # Truncated streams stop where the one-shot version does
+    for cut in range(1, 20):
+        obj = mod.LZSSDecompressor()
+        assert obj.feed(packed[:-cut]) == decompress(packed[:-cut])
+
+    obj = mod.LZSSDecompressor(len(tryout))
+    assert obj.feed(packed + b'junk') == tryout
+    obj.feed(b'more')
+    assert obj.eof and obj.unused_data == b'junkmore'
+
+def test_decompressor_threads():
+    # Threads sharing a decompressor take turns instead of corrupting it
+    from concurrent.futures import ThreadPoolExecutor
+
+    tryout = romlike(0x40000, seed=0)
+    obj = fast_lzss.LZSSDecompressor(len(tryout))
+    assert obj.feed(compress(tryout), 0) == b''
+    with ThreadPoolExecutor(4) as pool:
+        got = list(pool.map(lambda i: len(obj.feed(b'', 0x1000)), range(len(tryout) // 0x1000 + 8)))
+    assert sum(got) == len(tryout)
+    assert obj.eof
+
+def test_decompress_stream():
+    import io
+    tryout = romlike(0x30000)
+    packed = compress(tryout)
+
+    out = bytearray()
+    assert lzss.decompress_stream(packed, out.extend, chunk=1000) == len(tryout)
+    assert out == tryout
+
+    out = bytearray()
+    assert lzss.decompress_stream(io.BytesIO(packed), out.extend, len(tryout)) == len(tryout)
+    assert out == tryout
+
+    with pytest.raises(ValueError):
+        lzss.decompress_stream(packed[:-10], bytearray().extend, len(tryout))
+
+def test_seekable():
+    tryout = romlike(0x30000) + bytes(0x3000) + b'abc' * 0x1000
+    packed = compress(tryout)
+
+    seekable = lzss.SeekableLZSS(packed, spacing=0x1000)
+    assert len(seekable) == len(tryout)
+    assert len(seekable.checkpoints) > len(tryout) // 0x1000 - 1
+
+    reloaded = lzss.SeekableLZSS(packed, seekable.dump_index())
+    assert reloaded.checkpoints == seekable.checkpoints
+
+    for obj in (seekable, reloaded):
+        for i in range(200):
+            offset = random.randrange(len(tryout) + 10)
+            length = random.choice([0, 1, 18, 0x1000, 0x5000])
+            assert obj.read_at(offset, length) == tryout[offset:offset+length]
+        assert obj.read_at(len(tryout) - 4, 4) == tryout[-4:]
+        assert obj.read_at(0, len(tryout)) == tryout
+
+    for the_len in [0, 1, 17, 100]:
+        tryout = romlike(the_len)
+        obj = lzss.SeekableLZSS(compress(tryout), spacing=7)
+        assert obj.read_at(0, 1000) == tryout
+        assert obj.read_at(the_len // 2, 1) == tryout[the_len//2:the_len//2+1]
+
+    # Truncated streams stop where decompress() does, with no checkpoints
+    # past the end
+    for cut in range(1, 20):
+        expected = decompress(packed[:-cut])
+        obj = lzss.SeekableLZSS(packed[:-cut], spacing=7)
+        assert len(obj) == len(expected)
+        assert all(cp[0] < len(expected) for cp in obj.checkpoints)
+        assert obj.read_at(0, len(expected)) == expected
+        assert obj.read_at(len(expected) - 100, 200) == expected[-100:]
+
+    with pytest.raises(ValueError):
+        lzss.SeekableLZSS(packed[:-1], seekable.dump_index())
+    with pytest.raises(ValueError):
+        lzss.SeekableLZSS(packed, seekable.dump_index()[:-1])
+
+@pytest.mark.filterwarnings('ignore:Using slow')
+def test_slow_compress():
+    corpora = [romlike(0x9000), bytes(0x2000), b'0123456789abcdef!' * 0x200]
+    corpora += [bytes(random.getrandbits(8) for x in range(n)) for n in [1, 17, 18, 19, 0x1001]]
+
+    for tryout in corpora:
+        assert slow_lzss.compress(tryout) == fast_lzss.compress(tryout)
+
+@pytest.mark.filterwarnings('ignore:Using slow')
+def test_compress_many():
+    tryouts = [romlike(n) for n in [0, 1, 17, 18, 19, 300, 0x5000]]
+    tryouts += [bytearray(b'abc' * 100), memoryview(romlike(0x1000))[100:]]
+
+    packed = fast_lzss.compress_many(tryouts)
+    assert packed == [fast_lzss.compress(t) for t in tryouts]
+    assert slow_lzss.compress_many(tryouts) == packed
+    assert fast_lzss.compress_many([]) == []
+
+    with pytest.raises(TypeError):
+        fast_lzss.compress_many([b'ok', 'not a buffer'])
+
+def test_fast_mode():
+    for tryout in [b'', b'x', romlike(0x20000), bytes(0x5000), b'0123456789abcdef!' * 0x300]:
+        packed = lzss.compress(tryout, 'fast')
+        assert slow_lzss.decompress(packed) == tryout
+        assert fast_lzss.decompress(packed) == tryout
+        assert slow_lzss.compress_fast(tryout) == packed
+
+    assert lzss.cache_key(b'x', 'fast') != lzss.cache_key(b'x', 'canonical')
+
+@pytest.mark.filterwarnings('ignore:Using slow')
+def test_optimal_mode():
+    for tryout in [b'', b'x', b'abcabcabc', romlike(0x8000), bytes(0x3000), b'0123456789abcdef!' * 0x100]:
+        packed, canonical_len = fast_lzss.compress_optimal(tryout)
+        assert canonical_len == len(fast_lzss.compress(tryout))
+        assert len(packed) <= canonical_len
+        assert slow_lzss.decompress(packed) == tryout
+        assert slow_lzss.compress_optimal(tryout) == (packed, canonical_len)
+
+    saved = lzss.optimal_saved
+    tryout = romlike(0x10000)
+    packed = lzss.compress(tryout, 'optimal')
+    assert lzss.optimal_saved - saved == len(fast_lzss.compress(tryout)) - len(packed)
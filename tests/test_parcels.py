@@ -0,0 +1,118 @@
+from tbxi import parcels_build, parcels_dump, dispatcher
+import random
+
+PARCELFILE = '''
+prop flags=0x1 a=One b=Two
+\tnlib flags=0x4 name=first src=first.lzss
+\tnlib name=second src=second
+\tcstr name=strings
+\t\thello world
+\tnlib name=third src=third.lzss deduplicate=1
+\tnlib name=fourth src=fourth.lzss deduplicate=1
+'''
+
+def test_threads_same_output(tmp_path):
+    (tmp_path / 'Parcelfile').write_text(PARCELFILE)
+    for name in ['first', 'second', 'third']:
+        (tmp_path / name).write_bytes(bytes(random.choice(b'abc ') for x in range(random.randrange(10000))))
+    (tmp_path / 'fourth').write_bytes((tmp_path / 'third').read_bytes())
+
+    saved = dispatcher.threads
+    try:
+        results = []
+        for threads in [1, 4]:
+            dispatcher.threads = threads
+            results.append(parcels_build.build(str(tmp_path)))
+    finally:
+        dispatcher.threads = saved
+
+    assert results[0] == results[1]
+
+def test_dump_threads(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'Parcelfile').write_text(PARCELFILE)
+    for name in ['first', 'second', 'third']:
+        (src / name).write_bytes(bytes(random.choice(b'abc ') for x in range(random.randrange(10000))))
+    (src / 'fourth').write_bytes((src / 'third').read_bytes())
+    binary = parcels_build.build(str(src))
+
+    saved = dispatcher.threads
+    try:
+        trees = []
+        for threads in [1, 4]:
+            dispatcher.threads = threads
+            dest = tmp_path / ('dump%d' % threads)
+            parcels_dump.dump(binary, str(dest))
+            trees.append({p.relative_to(dest): p.read_bytes() for p in dest.rglob('*') if p.is_file()})
+    finally:
+        dispatcher.threads = saved
+
+    assert trees[0] == trees[1]
+    assert parcels_build.build(str(tmp_path / 'dump1')) == binary
+
+    # A dump through the dispatcher leaves a marker for the build side
+    dispatcher.dump(binary, str(tmp_path / 'Parcels'))
+    assert (tmp_path / 'Parcels.src' / dispatcher.MARKER).read_text() == 'parcels\n'
+    assert dispatcher.build(str(tmp_path / 'Parcels')) == binary
+
+def test_dump_update(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'Parcelfile').write_text(PARCELFILE)
+    for name in ['first', 'second', 'third', 'fourth']:
+        (src / name).write_bytes(name.encode() * 1000)
+    binary = parcels_build.build(str(src))
+
+    def counts():
+        return dispatcher.files_written, dispatcher.files_unchanged, dispatcher.files_removed
+
+    def update(binary):
+        before = counts()
+        dispatcher.dump_update(binary, str(tmp_path / 'Parcels'))
+        tree = {p.relative_to(tmp_path): p.read_bytes() for p in tmp_path.glob('Parcels*/**/*') if p.is_file()}
+        tree[(tmp_path / 'Parcels').relative_to(tmp_path)] = (tmp_path / 'Parcels').read_bytes()
+        return tree, tuple(a - b for (a, b) in zip(counts(), before))
+
+    tree, (written, unchanged, removed) = update(binary)
+    assert unchanged == removed == 0
+
+    # Nothing has changed, so nothing is written
+    stat = (tmp_path / 'Parcels.src' / 'Parcelfile').stat()
+    (tmp_path / 'Parcels.src' / 'stray').write_bytes(b'')
+    assert update(binary) == (tree, (0, written, 1))
+    assert (tmp_path / 'Parcels.src' / 'Parcelfile').stat().st_mtime_ns == stat.st_mtime_ns
+
+    # One child changes, and its old file goes
+    (src / 'second').write_bytes(b'changed' * 1000)
+    binary2 = parcels_build.build(str(src))
+    tree2, (written2, unchanged2, removed2) = update(binary2)
+    assert 0 < written2 < written
+    assert dispatcher.build(str(tmp_path / 'Parcels')) == binary2
+
+    # The same as a dump from scratch
+    (tmp_path / 'fresh').mkdir()
+    dispatcher.dump(binary2, str(tmp_path / 'fresh' / 'Parcels'))
+    fresh = {p.relative_to(tmp_path / 'fresh'): p.read_bytes() for p in (tmp_path / 'fresh').rglob('*') if p.is_file()}
+    assert fresh == tree2
+
+def test_dump_update_keeps_dotfiles(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    (src / 'Parcelfile').write_text(PARCELFILE)
+    for name in ['first', 'second', 'third', 'fourth']:
+        (src / name).write_bytes(name.encode() * 1000)
+    binary = parcels_build.build(str(src))
+
+    dest = tmp_path / 'Parcels.src'
+    dispatcher.dump_update(binary, str(tmp_path / 'Parcels'))
+    (dest / '.git' / 'objects').mkdir(parents=True)
+    (dest / '.git' / 'objects' / 'stray').write_bytes(b'x')
+    (dest / '.gitignore').write_text('*.tmp\n')
+    (dest / 'stray').write_bytes(b'')
+
+    dispatcher.dump_update(binary, str(tmp_path / 'Parcels'))
+    assert (dest / '.git' / 'objects' / 'stray').read_bytes() == b'x'
+    assert (dest / '.gitignore').read_text() == '*.tmp\n'
+    assert not (dest / 'stray').exists()
+    assert dispatcher.build(str(tmp_path / 'Parcels')) == binary